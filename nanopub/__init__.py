@@ -2,11 +2,13 @@ from ._version import __version__
 from .nanopub_conf import NanopubConf
 
 from .client import NanopubClient
+from .query_cache import DiskQueryCache, MemoryQueryCache, QueryCache
 from .profile import Profile, load_profile, generate_keyfiles
 from .nanopub import Nanopub
 
-from .templates.nanopub_index import NanopubIndex, create_nanopub_index
+from .templates.nanopub_index import NanopubIndex, append_to_nanopub_index, create_nanopub_index, iter_nanopub_index
 from .templates.nanopub_introduction import NanopubIntroduction
 from .templates.nanopub_claim import NanopubClaim
 from .templates.nanopub_retract import NanopubRetract
 from .templates.nanopub_update import NanopubUpdate
+from .templates.table_template import TableTemplate
@@ -1,4 +1,5 @@
 #! /usr/bin/env python3
+import json
 import os
 import re
 import shutil
@@ -12,11 +13,16 @@ import rdflib
 import typer
 from typer import Argument, Option
 
-from nanopub import Nanopub, NanopubClaim, NanopubConf, load_profile
+from nanopub import Nanopub, NanopubClaim, NanopubClient, NanopubConf, load_profile
 from nanopub._version import __version__
+from nanopub.bench import run_bench
+from nanopub.bulk import DEFAULT_MAX_RETRIES, DEFAULT_UPLOAD_WORKERS, publish_many
 from nanopub.definitions import DEFAULT_PROFILE_PATH, USER_CONFIG_DIR
+from nanopub.local_server import LocalNanopubServer
+from nanopub.outbox import FAILED, PUBLISHED, SIGNED, PublishOutbox
 from nanopub.profile import Profile, ProfileError, generate_keyfiles
 from nanopub.templates.nanopub_introduction import NanopubIntroduction
+from nanopub.templates.table_template import TableTemplate, read_table
 from nanopub.utils import MalformedNanopubError
 
 cli = typer.Typer(help="Nanopub Command Line Interface", no_args_is_help=True)
@@ -28,6 +34,7 @@ DEFAULT_PRIVATE_KEY_PATH = USER_CONFIG_DIR / PRIVATE_KEY_FILE
 DEFAULT_PUBLIC_KEY_PATH = USER_CONFIG_DIR / PUBLIC_KEY_FILE
 RSA = 'RSA'
 ORCID_ID_REGEX = r'^https://orcid.org/(\d{4}-){3}\d{3}(\d|X)$'
+PUBLISH_DIR_SUFFIXES = ('.trig', '.nq')
 
 
 def validate_orcid_id(ctx, param, orcid_id: str):
@@ -91,10 +98,15 @@ def sign(
     print(f" 📬️ To publish it run \033[1mnp publish {signed_filepath}\033[0m")
 
 
-@cli.command(help='Publish a Nanopublication')
+@cli.command(help='Publish a Nanopublication, or all the .trig and .nq files of a directory')
 def publish(
     filepath: Path,
     test: bool = typer.Option(False, help="Publish to the test server"),
+    sign_workers: Optional[int] = typer.Option(
+        None, help="Number of processes signing nanopubs of a directory, defaults to the number of CPUs"
+    ),
+    upload_workers: int = typer.Option(DEFAULT_UPLOAD_WORKERS, help="Number of nanopubs of a directory uploaded at the same time"),
+    retries: int = typer.Option(DEFAULT_MAX_RETRIES, help="Number of times an upload is retried after a transient error"),
 ):
     if test:
         print(" 🧪 Publishing to the test server")
@@ -102,12 +114,93 @@ def publish(
         profile=load_profile(),
         use_test_server=test,
     )
+    if filepath.is_dir():
+        files = _publish_files([filepath])
+        failed = 0
+        for result in publish_many(
+            files, config, sign_workers=sign_workers, upload_workers=upload_workers, max_retries=retries
+        ):
+            if result.published:
+                print(f" 📬️ {result.source} published at \033[1m{result.source_uri}\033[0m")
+            else:
+                failed += 1
+                print(f" ❌ {result.source} could not be published: {result.error}")
+        print(f" 📊 {len(files) - failed} nanopubs published, {failed} failed")
+        if failed:
+            raise typer.Exit(code=1)
+        return
     np = Nanopub(conf=config, rdf=filepath)
     np.publish()
     print(f" 📬️ Nanopub published at \033[1m{np.source_uri}\033[0m")
 
 
 
+@cli.command(help='Run a local stand-in for the nanopub registry, query and SPARQL services')
+def serve(
+    host: str = typer.Option("127.0.0.1", help="Host to listen on"),
+    port: int = typer.Option(8080, help="Port to listen on"),
+    directory: Optional[Path] = typer.Option(None, help="Directory where published nanopubs are stored"),
+    latency: float = typer.Option(0.0, help="Delay in seconds added to each request"),
+    latency_jitter: float = typer.Option(0.0, help="Random variation in seconds of the delay"),
+    failure_rate: float = typer.Option(0.0, help="Probability that a request fails with a 503 error"),
+    seed: Optional[int] = typer.Option(None, help="Seed of the random latency and failures"),
+    verify: bool = typer.Option(True, help="Check the signature and trusty URI of published nanopubs"),
+):
+    server = LocalNanopubServer(
+        host=host, port=port, directory=directory, latency=latency, latency_jitter=latency_jitter,
+        failure_rate=failure_rate, seed=seed, verify=verify,
+    )
+    print(f" 📬️ Registry: \033[1m{server.registry_url}\033[0m ({len(server)} nanopubs)")
+    print(f" 🔎 Queries: \033[1m{server.query_url}\033[0m")
+    print(f" 🗃️  SPARQL: \033[1m{server.sparql_url}\033[0m")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+@cli.command(help='Measure the publish, fetch and query throughput against a nanopub registry, as JSON')
+def bench(
+    server: Optional[str] = typer.Option(
+        None, help="Registry URL to publish to, a local stand-in server is started if not given"
+    ),
+    query_url: Optional[str] = typer.Option(None, help="Nanopub Query URL used for the pattern queries"),
+    test: bool = typer.Option(False, help="Publish to the test server"),
+    count: int = typer.Option(100, help="Number of synthetic nanopubs published and fetched back"),
+    triples: int = typer.Option(10, help="Number of triples in the assertion of each nanopub"),
+    concurrency: int = typer.Option(DEFAULT_UPLOAD_WORKERS, help="Number of uploads, fetches and queries running at the same time"),
+    sign_workers: Optional[int] = typer.Option(None, help="Number of signing processes, defaults to the number of CPUs"),
+    queries: int = typer.Option(20, help="Number of pattern queries"),
+    retries: int = typer.Option(0, help="Number of times an upload is retried after a transient error"),
+    seed: Optional[int] = typer.Option(None, help="Seed picking the nanopubs that are queried"),
+    output: Optional[Path] = typer.Option(None, help="File where the JSON report is written, printed if not given"),
+):
+    local = None
+    if test:
+        config = NanopubConf(use_test_server=True)
+        client = NanopubClient(use_test_server=True, query_urls=[query_url] if query_url else None)
+    elif server:
+        config = NanopubConf(use_server=server)
+        client = NanopubClient(use_server=server, query_urls=[query_url] if query_url else None)
+    else:
+        local = LocalNanopubServer().start()
+        config = local.conf()
+        client = local.client()
+    try:
+        report = run_bench(
+            config, client, count=count, triples=triples, concurrency=concurrency, sign_workers=sign_workers,
+            queries=queries, max_retries=retries, seed=seed,
+        )
+    finally:
+        if local is not None:
+            local.stop()
+    if output:
+        output.write_text(json.dumps(report, indent=2))
+        print(f" 📊 Report written to \033[1m{output}\033[0m")
+    else:
+        print(json.dumps(report, indent=2))
+
+
 @cli.command(help='Check if a signed Nanopublication is valid')
 def check(filepath: Path):
     config = NanopubConf(profile=load_profile())
@@ -359,5 +452,135 @@ def claim(
     ctx.obj.show(np)
 
 
+@create.command(help='Create a signed nanopub for each row of a CSV, TSV or JSON lines table')
+def from_table(
+    ctx: CreateNanopubContext,
+    template: Annotated[
+        Path,
+        Argument(
+            exists=True,
+            dir_okay=False,
+            help='TriG template whose assertion, provenance and pubinfo graphs contain {column} placeholders.',
+        )
+    ],
+    table: Annotated[Path, Argument(exists=True, dir_okay=False, help='CSV, TSV or JSON lines file of the rows')],
+    table_format: Annotated[
+        str | None, Option(help='Format of the table (csv, tsv or jsonl), inferred from its extension by default')
+    ] = None,
+    output_dir: Annotated[
+        Path | None,
+        Option(help='Directory where each nanopub is written to a trig file, instead of the standard output')
+    ] = None,
+    sign_workers: Annotated[
+        int | None, Option(help='Number of signing processes, defaults to the number of CPUs')
+    ] = None,
+):
+    """Create nanopublications from the rows of a table."""
+    config = NanopubConf(
+        profile=load_profile(),
+        add_pubinfo_generated_time=True,
+        add_prov_generated_time=True,
+        attribute_publication_to_profile=True,
+    )
+    table_template = TableTemplate.from_file(config, template)
+    if output_dir:
+        output_dir.mkdir(parents=True, exist_ok=True)
+    created = failed = 0
+    for result in table_template.generate(read_table(table, table_format), sign_workers=sign_workers):
+        if result.error:
+            failed += 1
+            print(f" ❌ Row {result.index} could not be converted: {result.error}", file=sys.stderr)
+            continue
+        created += 1
+        if output_dir:
+            (output_dir / f"{result.source_uri.rsplit('/', 1)[-1]}.trig").write_text(result.rdf, encoding="utf-8")
+        elif ctx.obj.output_format == DataFormat.TRIG:
+            print(result.rdf)
+        else:
+            print(rdflib.Dataset().parse(data=result.rdf, format="trig").serialize(format=ctx.obj.output_format.value))
+    if output_dir:
+        print(f" ✒️  {created} nanopubs signed in \033[1m{output_dir}\033[0m, {failed} rows failed")
+        print(f" 📬️ To publish them run \033[1mnp publish {output_dir}\033[0m")
+    if failed:
+        raise typer.Exit(code=1)
+
+
+outbox = typer.Typer(
+    help='Durable outbox of signed nanopubs, published in the background and resumable.',
+    no_args_is_help=True,
+)
+cli.add_typer(outbox, name='outbox')
+
+
+def _publish_files(paths: list[Path]) -> list[Path]:
+    """Expand directories to the .trig and .nq files they contain."""
+    files = []
+    for path in paths:
+        if path.is_dir():
+            files.extend(sorted(f for f in path.iterdir() if f.suffix in PUBLISH_DIR_SUFFIXES))
+        else:
+            files.append(path)
+    return files
+
+
+def _drain_outbox(box: PublishOutbox, workers: int, retries: int, rate: Optional[float], compress: bool):
+    counts = box.drain(workers=workers, max_retries=retries, rate_limit=rate, compress=compress)
+    print(f" 📬️ {counts[PUBLISHED]} published, {counts[FAILED]} failed, {counts[SIGNED]} waiting")
+    if counts[FAILED]:
+        print(" ℹ️  Use \033[1mnp outbox retry\033[0m to publish the failed nanopubs again")
+        raise typer.Exit(code=1)
+
+
+@outbox.command(name='add', help='Sign nanopubs, or the .trig and .nq files of directories, and add them to the outbox')
+def outbox_add(
+    path: Annotated[Path, Argument(help='Path to the outbox file, created if needed')],
+    files: Annotated[list[Path], Argument(exists=True, help='Nanopub files or directories')],
+    test: bool = typer.Option(False, help="Publish to the test server"),
+    sign_workers: Optional[int] = typer.Option(None, help="Number of signing processes, defaults to the number of CPUs"),
+):
+    config = NanopubConf(profile=load_profile(), use_test_server=test)
+    with PublishOutbox(path) as box:
+        source_uris = box.add(_publish_files(files), config, sign_workers=sign_workers)
+    failed = source_uris.count(None)
+    print(f" ✒️  {len(source_uris) - failed} nanopubs signed and added to \033[1m{path}\033[0m")
+    if failed:
+        print(f" ❌ {failed} nanopubs could not be signed, see \033[1mnp outbox status\033[0m")
+        raise typer.Exit(code=1)
+
+
+@outbox.command(name='status', help='Show the number of nanopubs in each state, and the failed ones')
+def outbox_status(path: Annotated[Path, Argument(exists=True, help='Path to the outbox file')]):
+    with PublishOutbox(path) as box:
+        for state, count in box.status().items():
+            print(f"{state}: {count}")
+        for item in box.items(FAILED):
+            print(f" ❌ {item.source_uri} ({item.attempts} attempts): {item.error}")
+
+
+@outbox.command(name='resume', help='Publish the nanopubs of the outbox that are not published yet')
+def outbox_resume(
+    path: Annotated[Path, Argument(exists=True, help='Path to the outbox file')],
+    workers: int = typer.Option(DEFAULT_UPLOAD_WORKERS, help="Number of nanopubs uploaded at the same time"),
+    retries: int = typer.Option(DEFAULT_MAX_RETRIES, help="Number of times an upload is retried after a transient error"),
+    rate: Optional[float] = typer.Option(None, help="Maximum number of uploads per second"),
+    compress: bool = typer.Option(False, help="Send the nanopubs gzip compressed, the server must accept it"),
+):
+    with PublishOutbox(path) as box:
+        _drain_outbox(box, workers, retries, rate, compress)
+
+
+@outbox.command(name='retry', help='Publish again the nanopubs of the outbox that failed')
+def outbox_retry(
+    path: Annotated[Path, Argument(exists=True, help='Path to the outbox file')],
+    workers: int = typer.Option(DEFAULT_UPLOAD_WORKERS, help="Number of nanopubs uploaded at the same time"),
+    retries: int = typer.Option(DEFAULT_MAX_RETRIES, help="Number of times an upload is retried after a transient error"),
+    rate: Optional[float] = typer.Option(None, help="Maximum number of uploads per second"),
+    compress: bool = typer.Option(False, help="Send the nanopubs gzip compressed, the server must accept it"),
+):
+    with PublishOutbox(path) as box:
+        print(f" 🔁 Retrying {box.retry_failed()} failed nanopubs")
+        _drain_outbox(box, workers, retries, rate, compress)
+
+
 if __name__ == '__main__':
     cli()
@@ -0,0 +1,276 @@
+"""
+This module holds a load generator measuring the throughput of the nanopub client against a registry.
+
+Synthetic nanopubs are signed and published at a given concurrency, fetched back, and looked up
+with pattern queries. The report gives for each stage its throughput, latency percentiles and
+error rate, and the CPU time spent canonicalizing RDF, computing RSA signatures and doing HTTP.
+"""
+import random
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import replace
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import requests
+from rdflib import Dataset, Graph, Literal, Namespace
+
+from nanopub.bulk import DEFAULT_UPLOAD_WORKERS, make_publish_session, make_sign_pool, upload_signed
+from nanopub.client import NanopubClient
+from nanopub.definitions import NANOPUB_FETCH_FORMAT, QUERY_TIMEOUT, TEST_NANOPUB_REGISTRY_URL
+from nanopub.nanopub import Nanopub
+from nanopub.nanopub_conf import NanopubConf
+from nanopub.profile import Profile
+from nanopub.server_selection import percentile
+from nanopub.sign_utils import cpu_timer
+from nanopub.utils import log
+
+BENCH = Namespace("https://w3id.org/np/bench/")
+"""Namespace of the subjects and predicates of the synthetic nanopubs"""
+
+BENCH_ORCID = "https://orcid.org/0000-0000-0000-0000"
+"""ORCID iD of the throwaway profile signing the synthetic nanopubs"""
+
+LATENCY_PERCENTILES = (0.5, 0.9, 0.95, 0.99)
+"""Percentiles of the latencies given in the report"""
+
+CPU_CATEGORIES = ("canonicalization", "rsa", "serialization", "http", "parsing")
+"""Categories of the CPU time given in the report"""
+
+
+def bench_profile() -> Profile:
+    """Profile with a newly generated key, to sign synthetic nanopubs without using a real identity."""
+    return Profile(orcid_id=BENCH_ORCID, name="Nanopub bench")
+
+
+def make_synthetic_nanopub(run_id: str, index: int, triples: int, conf: NanopubConf) -> Nanopub:
+    """Build a nanopub whose assertion has `triples` triples about a subject unique to the run and index.
+
+    The assertion and the nanopub are attributed to the profile of the conf, so that the
+    provenance and publication info are never empty.
+    """
+    conf = replace(conf, attribute_assertion_to_profile=True, attribute_publication_to_profile=True)
+    subject = BENCH[f"{run_id}/{index}"]
+    assertion = Graph()
+    for i in range(triples):
+        assertion.add((subject, BENCH[f"p{i}"], Literal(f"Value {i} of synthetic nanopub {index}")))
+    return Nanopub(conf=conf, assertion=assertion)
+
+
+def sign_synthetic_nanopub(
+    run_id: str, index: int, triples: int, conf: NanopubConf
+) -> Tuple[Optional[str], Optional[str], float, Dict[str, float], Optional[str]]:
+    """Build and sign a synthetic nanopub, timing it.
+
+    This function runs in the signing processes of `run_bench`, which is why it returns the
+    nanopub serialized.
+
+    Returns:
+        tuple of: the trusty URI of the nanopub, the nanopub serialized as trig, the time it took
+        in seconds, the CPU time spent per category, the error if signing failed.
+    """
+    timings: Dict[str, float] = {}
+    start = time.perf_counter()
+    try:
+        np = make_synthetic_nanopub(run_id, index, triples, conf)
+        np.sign(timings)
+        with cpu_timer(timings, "serialization"):
+            data = np.rdf.serialize(format="trig")
+    except Exception as e:
+        return None, None, time.perf_counter() - start, timings, f"{type(e).__name__}: {e}"
+    return np.source_uri, data, time.perf_counter() - start, timings, None
+
+
+class _Stage:
+    """Latencies and errors of the operations of one stage of the benchmark, recorded from many threads."""
+
+    def __init__(self) -> None:
+        self.latencies: List[float] = []
+        self.errors = 0
+        self.duration = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, latency: float, ok: bool) -> None:
+        with self._lock:
+            self.latencies.append(latency)
+            if not ok:
+                self.errors += 1
+
+    def report(self) -> Dict[str, Any]:
+        count = len(self.latencies)
+        report: Dict[str, Any] = {
+            "count": count,
+            "errors": self.errors,
+            "error_rate": self.errors / count if count else 0.0,
+            "duration_s": round(self.duration, 3),
+            "throughput_per_s": round((count - self.errors) / self.duration, 3) if self.duration else 0.0,
+            "latency_ms": {},
+        }
+        if count:
+            report["latency_ms"] = {
+                f"p{round(q * 100)}": round(percentile(self.latencies, q) * 1000, 3) for q in LATENCY_PERCENTILES
+            }
+            report["latency_ms"]["mean"] = round(sum(self.latencies) / count * 1000, 3)
+            report["latency_ms"]["max"] = round(max(self.latencies) * 1000, 3)
+        return report
+
+
+class _Bench:
+    """State of a benchmark run, shared by its worker threads."""
+
+    def __init__(self, concurrency: int) -> None:
+        self.concurrency = concurrency
+        self.stages = {name: _Stage() for name in ("sign", "upload", "fetch", "query")}
+        self.cpu = {category: 0.0 for category in CPU_CATEGORIES}
+        self._lock = threading.Lock()
+
+    def add_cpu(self, timings: Dict[str, float]) -> None:
+        with self._lock:
+            for category, seconds in timings.items():
+                self.cpu[category] = self.cpu.get(category, 0.0) + seconds
+
+    def timed(self, stage: str, call: Callable[[], Any]) -> Tuple[bool, Any]:
+        """Run a call, recording its latency and whether it failed in the given stage.
+
+        Returns:
+            tuple of: whether the call succeeded, its result.
+        """
+        start = time.perf_counter()
+        try:
+            result = call()
+        except Exception as e:
+            self.stages[stage].record(time.perf_counter() - start, ok=False)
+            log.info(f"Bench {stage} failed: {e}")
+            return False, None
+        self.stages[stage].record(time.perf_counter() - start, ok=True)
+        return True, result
+
+    def run_stage(self, stage: str, task: Callable[[Any], Any], items: List[Any]) -> List[Any]:
+        """Run `task` on the items with the concurrency of the run, timing the stage."""
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            results = list(pool.map(task, items))
+        self.stages[stage].duration = time.perf_counter() - start
+        return results
+
+
+def run_bench(
+    conf: NanopubConf,
+    client: Optional[NanopubClient] = None,
+    count: int = 100,
+    triples: int = 10,
+    concurrency: int = DEFAULT_UPLOAD_WORKERS,
+    sign_workers: Optional[int] = None,
+    queries: int = 20,
+    max_retries: int = 0,
+    session: Optional[requests.Session] = None,
+    seed: Optional[int] = None,
+) -> Dict[str, Any]:
+    """Publish synthetic nanopubs, fetch them back and query them, measuring the client throughput.
+
+    The stages run one after the other, so that the throughput of each is measured on its own:
+    the nanopubs are signed in a pool of processes like `publish_many` does, then uploaded,
+    fetched and queried from `concurrency` threads.
+
+    Args:
+        conf: Configuration giving the server to publish to, and the profile used to sign
+            (a throwaway profile is generated if it has none)
+        client: Client used for the pattern queries, defaults to one for the server of the conf
+        count: Number of nanopubs published and fetched back
+        triples: Number of triples in the assertion of each nanopub
+        concurrency: Number of uploads, fetches and queries running at the same time
+        sign_workers: Number of signing processes, defaults to the number of CPUs.
+            Use 0 to sign in the current process.
+        queries: Number of pattern queries, each on the subject of a random published nanopub
+        max_retries: Number of times an upload is retried after a transient error
+        session: Session used for the uploads and fetches
+        seed: Seed picking the nanopubs that are queried
+
+    Returns:
+        the report of the run, as a JSON serializable dict.
+    """
+    if conf.profile is None:
+        conf = replace(conf, profile=bench_profile())
+    server = TEST_NANOPUB_REGISTRY_URL if conf.use_test_server else conf.use_server
+    client = client or NanopubClient(use_test_server=conf.use_test_server, use_server=conf.use_server)
+    session = session or make_publish_session(concurrency)
+    run_id = uuid.uuid4().hex[:12]
+    bench = _Bench(concurrency)
+    log.info(f"Benchmarking {server} with {count} nanopubs of {triples} triples, {concurrency} at a time")
+
+    start = time.perf_counter()
+    pool = make_sign_pool(sign_workers)
+    try:
+        map_fn = pool.map if pool is not None else map
+        indexes = list(range(count))
+        signed = list(map_fn(
+            sign_synthetic_nanopub, [run_id] * count, indexes, [triples] * count, [conf] * count
+        ))
+    finally:
+        if pool is not None:
+            pool.shutdown()
+    bench.stages["sign"].duration = time.perf_counter() - start
+    for source_uri, data, latency, timings, error in signed:
+        bench.stages["sign"].record(latency, ok=error is None)
+        bench.add_cpu(timings)
+        if error:
+            log.info(f"Bench sign failed: {error}")
+
+    def upload(item: Tuple[int, Tuple]) -> Optional[int]:
+        index, (source_uri, data, _, _, _) = item
+        timings: Dict[str, float] = {}
+        with cpu_timer(timings, "http"):
+            uploaded, _ = bench.timed("upload", lambda: upload_signed(
+                data, server, session, max_retries=max_retries, backoff=0.1, compress=conf.compress_uploads
+            ))
+        bench.add_cpu(timings)
+        return index if uploaded else None
+
+    to_upload = [(index, item) for index, item in enumerate(signed) if item[0]]
+    published = {index: signed[index][0] for index in bench.run_stage("upload", upload, to_upload) if index is not None}
+
+    def fetch(source_uri: str) -> None:
+        timings: Dict[str, float] = {}
+
+        def get() -> Dataset:
+            url = server + source_uri.rsplit("/", 1)[-1] + "." + NANOPUB_FETCH_FORMAT
+            with cpu_timer(timings, "http"):
+                r = session.get(url, timeout=QUERY_TIMEOUT)
+                r.raise_for_status()
+                text = r.text
+            with cpu_timer(timings, "parsing"):
+                return Dataset().parse(data=text, format=NANOPUB_FETCH_FORMAT)
+
+        bench.timed("fetch", get)
+        bench.add_cpu(timings)
+
+    bench.run_stage("fetch", fetch, list(published.values()))
+
+    rng = random.Random(seed)
+    queried = [rng.choice(list(published)) for _ in range(queries)] if published else []
+    found = _Stage()
+
+    def query(index: int) -> None:
+        timings: Dict[str, float] = {}
+        subject = str(BENCH[f"{run_id}/{index}"])
+        with cpu_timer(timings, "http"):
+            ok, results = bench.timed("query", lambda: list(client.find_nanopubs_with_pattern(subj=subject)))
+        bench.add_cpu(timings)
+        if ok:
+            # Registries can take a while to index new nanopubs, so a query without results is not an error
+            found.record(0.0, ok=bool(results))
+
+    bench.run_stage("query", query, queried)
+
+    return {
+        "server": server,
+        "run_id": run_id,
+        "nanopubs": count,
+        "triples": triples,
+        "concurrency": concurrency,
+        "published": len(published),
+        "queries_with_results": len(found.latencies) - found.errors,
+        "stages": {name: stage.report() for name, stage in bench.stages.items()},
+        "cpu_s": {category: round(seconds, 4) for category, seconds in bench.cpu.items()},
+    }
@@ -0,0 +1,580 @@
+"""
+This module holds functions to sign and publish many nanopublications at once.
+
+Signing is CPU bound and runs in a pool of processes, while uploads are network bound and run in
+a pool of threads sharing keep-alive connections to the registry. Both stages overlap, and the
+number of nanopubs between them is bounded to keep the memory usage constant.
+
+Retractions and supersessions of many nanopubs go through the same pipeline, after checking in
+batches that the nanopubs are signed with the key of the profile.
+"""
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Any, Callable, Deque, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+import requests
+from requests.adapters import HTTPAdapter
+from rdflib import Dataset, Graph
+from rdflib.util import guess_format
+
+from nanopub.client import NanopubClient
+from nanopub.definitions import NANOPUB_FETCH_FORMAT, QUERY_TIMEOUT, TEST_NANOPUB_REGISTRY_URL
+from nanopub.namespaces import NPX
+from nanopub.nanopub import Nanopub, fetch_nanopub_response
+from nanopub.nanopub_conf import NanopubConf
+from nanopub.profile import ProfileError
+from nanopub.sign_utils import serialize_upload_body
+from nanopub.templates.nanopub_retract import NanopubRetract
+from nanopub.templates.nanopub_update import NanopubUpdate
+from nanopub.utils import log
+
+DEFAULT_UPLOAD_WORKERS = 8
+"""Number of nanopubs uploaded at the same time, which is also the number of connections kept open"""
+
+DEFAULT_MAX_RETRIES = 5
+"""Number of times an upload is retried after a transient error"""
+
+DEFAULT_BACKOFF = 1.0
+"""Delay in seconds before the first retry, doubled after each attempt"""
+
+MAX_BACKOFF = 60.0
+"""Maximum delay in seconds between two attempts"""
+
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+"""HTTP status codes of the registry that are worth retrying"""
+
+SIGN_START_METHOD = "spawn"
+"""Start method of the signing processes. They are not forked, as forking a process whose other
+threads hold locks (e.g. of the logging module or of a connection pool) can deadlock the child"""
+
+PublishInput = Union[Nanopub, Dataset, Path, str]
+
+
+@dataclass
+class PublishResult:
+    """Outcome of the publication of one nanopub by `publish_many`.
+
+    Args:
+        index: Position of the nanopub in the input
+        source: Path of the file the nanopub was read from, if any
+        source_uri: Trusty URI of the signed nanopub, None if signing failed
+        published: True if the registry accepted the nanopub
+        attempts: Number of upload attempts it took to publish the nanopub
+        error: Description of the last error, None if published
+    """
+
+    index: int
+    source: Optional[str] = None
+    source_uri: Optional[str] = None
+    published: bool = False
+    attempts: int = 0
+    error: Optional[str] = None
+
+    dict = asdict
+
+
+def make_publish_session(pool_size: int = DEFAULT_UPLOAD_WORKERS) -> requests.Session:
+    """Create a session keeping up to `pool_size` connections open to each registry."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=2, pool_maxsize=pool_size, pool_block=True)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def make_sign_pool(
+    sign_workers: Optional[int] = None,
+    initializer: Optional[Callable[..., None]] = None,
+    initargs: tuple = (),
+) -> Optional[ProcessPoolExecutor]:
+    """Create a pool of signing processes, started with `SIGN_START_METHOD`.
+
+    The pool can safely be created and used while other threads are running.
+
+    Args:
+        sign_workers: Number of processes, defaults to the number of CPUs.
+            Returns None for 0, to sign in the current process.
+        initializer: Called in each process when it starts
+        initargs: Arguments of the initializer
+    """
+    if sign_workers == 0:
+        return None
+    return ProcessPoolExecutor(
+        max_workers=sign_workers,
+        mp_context=multiprocessing.get_context(SIGN_START_METHOD),
+        initializer=initializer,
+        initargs=initargs,
+    )
+
+
+class SigningPipeline:
+    """Run signing tasks in a pool of processes, taking their results in submission order.
+
+    Tasks are submitted with a tag, e.g. the level of a Nanopub Index, and at most `max_pending`
+    of them are running or waiting to be taken, so that a producer reading a long iterator only
+    keeps a bounded number of nanopubs in memory. With 0 `sign_workers`, tasks run when submitted.
+
+    Args:
+        sign_workers: Number of signing processes, defaults to the number of CPUs.
+            Use 0 to sign in the current process.
+        max_pending: Maximum number of tasks running or waiting to be taken, defaults to twice
+            the number of signing processes
+        initializer: Called in each signing process when it starts
+        initargs: Arguments of the initializer
+    """
+
+    def __init__(
+        self,
+        sign_workers: Optional[int] = None,
+        max_pending: Optional[int] = None,
+        initializer: Optional[Callable[..., None]] = None,
+        initargs: tuple = (),
+    ) -> None:
+        self.pool = make_sign_pool(sign_workers, initializer, initargs)
+        self.max_pending = max_pending or 2 * (sign_workers or os.cpu_count() or 1)
+        self._pending: Deque[Tuple[Any, Future]] = deque()
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def __enter__(self) -> "SigningPipeline":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    @property
+    def tags(self) -> List[Any]:
+        """Tags of the pending tasks, in submission order."""
+        return [tag for tag, _ in self._pending]
+
+    def submit(self, fn: Callable[..., Any], *args, tag: Any = None) -> None:
+        if self.pool is not None:
+            future = self.pool.submit(fn, *args)
+        else:
+            future = Future()
+            try:
+                future.set_result(fn(*args))
+            except Exception as e:
+                future.set_exception(e)
+        self._pending.append((tag, future))
+
+    def pop(self) -> Tuple[Any, Any]:
+        """Wait for the oldest pending task, and return its tag and result."""
+        tag, future = self._pending.popleft()
+        return tag, future.result()
+
+    def ready(self) -> Iterator[Tuple[Any, Any]]:
+        """Take the oldest tasks while they are done, or while there are `max_pending` of them."""
+        while self._pending and (len(self._pending) >= self.max_pending or self._pending[0][1].done()):
+            yield self.pop()
+
+    def drain(self) -> Iterator[Tuple[Any, Any]]:
+        """Take all the pending tasks."""
+        while self._pending:
+            yield self.pop()
+
+    def close(self) -> None:
+        if self.pool is not None:
+            self.pool.shutdown(cancel_futures=True)
+
+
+def sign_rdf(data: str, rdf_format: str, conf: NanopubConf, add_conf_triples: bool = True) -> Tuple[str, str]:
+    """Sign a serialized nanopub with the profile of the conf, if it is not signed yet.
+
+    The nanopub is loaded like `Nanopub(rdf=..., conf=conf)` would, so the triples added by the
+    conf (e.g. generated time or attributions) are signed too, unless `add_conf_triples` is
+    False, for nanopubs already holding them.
+
+    This function runs in the worker processes of `publish_many`, which is why the nanopub
+    is passed and returned serialized.
+
+    Returns:
+        tuple of: the trusty URI of the signed nanopub, the signed nanopub serialized as trig.
+    """
+    rdf = Dataset()
+    rdf.parse(data=data, format=rdf_format)
+    signed = next(rdf.quads((None, NPX.hasSignature, None, None)), None) is not None
+    np = Nanopub(rdf=rdf, conf=conf if add_conf_triples and not signed else NanopubConf(profile=conf.profile))
+    if signed:
+        # The URI of a nanopub loaded from signed RDF is only found in its metadata
+        return str(np.metadata.np_uri), np.rdf.serialize(format="trig")
+    np.sign()
+    return np.source_uri, np.rdf.serialize(format="trig")
+
+
+def upload_signed(
+    data: str,
+    use_server: str,
+    session: Optional[requests.Session] = None,
+    max_retries: int = DEFAULT_MAX_RETRIES,
+    backoff: float = DEFAULT_BACKOFF,
+    timeout=QUERY_TIMEOUT,
+    compress: bool = False,
+) -> int:
+    """Upload a signed nanopub serialized as trig, retrying on transient errors.
+
+    Publishing a nanopub with a trusty URI is idempotent, so an upload can safely be retried
+    when the outcome of the previous attempt is unknown.
+
+    Returns:
+        the number of attempts it took.
+    """
+    session = session or requests.Session()
+    body, headers = serialize_upload_body(data, compress)
+    # Read once, so that each attempt sends the whole body
+    body = body.getvalue()
+    attempt = 0
+    while True:
+        attempt += 1
+        delay = min(backoff * 2 ** (attempt - 1), MAX_BACKOFF)
+        try:
+            r = session.post(use_server, headers=headers, data=body, timeout=timeout)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            if attempt > max_retries:
+                raise
+            log.info(f"Upload to {use_server} failed ({e}), retrying in {delay:.1f}s")
+        else:
+            if r.status_code not in RETRY_STATUS_CODES or attempt > max_retries:
+                r.raise_for_status()
+                return attempt
+            retry_after = r.headers.get("Retry-After", "")
+            if retry_after.isdigit():
+                delay = min(float(retry_after), MAX_BACKOFF)
+            log.info(f"Upload to {use_server} returned {r.status_code}, retrying in {delay:.1f}s")
+            r.close()
+        time.sleep(delay)
+
+
+def publish_many(
+    nanopubs: Iterable[PublishInput],
+    conf: NanopubConf = NanopubConf(),
+    sign_workers: Optional[int] = None,
+    upload_workers: int = DEFAULT_UPLOAD_WORKERS,
+    max_pending: Optional[int] = None,
+    max_retries: int = DEFAULT_MAX_RETRIES,
+    backoff: float = DEFAULT_BACKOFF,
+    session: Optional[requests.Session] = None,
+) -> Iterator[PublishResult]:
+    """Sign and publish many nanopubs, overlapping signing and uploads.
+
+    Unsigned nanopubs are signed with the profile of the given conf in a pool of processes,
+    and uploaded to the server of the conf by a pool of threads sharing keep-alive connections.
+    At most `max_pending` nanopubs are read from the input and not published yet, so the input
+    can be a generator producing more nanopubs than fit in memory.
+
+    The nanopubs given as `Nanopub` objects are not updated with their signed RDF, the trusty
+    URIs are in the returned results.
+
+    Args:
+        nanopubs: Nanopub objects, rdflib Datasets, or paths to trig/nquads files
+        conf: Configuration giving the profile used to sign, and the server to publish to
+        sign_workers: Number of signing processes, defaults to the number of CPUs.
+            Use 0 to sign in a thread of the current process.
+        upload_workers: Number of uploads running at the same time
+        max_pending: Maximum number of nanopubs read from the input and not published yet,
+            defaults to twice the number of workers
+        max_retries: Number of times an upload is retried after a transient error
+        backoff: Delay in seconds before the first retry, doubled after each attempt
+        session: Session used for the uploads, by default one is created with a connection
+            pool of size `upload_workers`
+
+    Returns:
+        an iterator over the PublishResult of each nanopub, in the order they complete.
+    """
+    use_server = TEST_NANOPUB_REGISTRY_URL if conf.use_test_server else conf.use_server
+    if sign_workers is None:
+        sign_workers = os.cpu_count() or 1
+    if max_pending is None:
+        max_pending = 2 * (max(sign_workers, 1) + upload_workers)
+    session = session or make_publish_session(upload_workers)
+    slots = threading.BoundedSemaphore(max_pending)
+    results: queue.Queue = queue.Queue()
+    stop = threading.Event()
+    sign_pool = make_sign_pool(sign_workers) or ThreadPoolExecutor(max_workers=1)
+    upload_pool = ThreadPoolExecutor(max_workers=upload_workers)
+
+    def finish(result: PublishResult) -> None:
+        slots.release()
+        results.put(result)
+
+    def upload(result: PublishResult, data: str) -> None:
+        try:
+            result.attempts = upload_signed(
+                data, use_server, session, max_retries=max_retries, backoff=backoff, compress=conf.compress_uploads
+            )
+            result.published = True
+            log.info(f"Published {result.source_uri} to {use_server}")
+        except Exception as e:
+            result.error = f"{type(e).__name__}: {e}"
+        finish(result)
+
+    def on_signed(result: PublishResult, future: Future) -> None:
+        try:
+            result.source_uri, data = future.result()
+        except Exception as e:
+            result.error = f"{type(e).__name__}: {e}"
+            finish(result)
+            return
+        try:
+            upload_pool.submit(upload, result, data)
+        except RuntimeError as e:
+            # The pipeline is shutting down
+            result.error = str(e)
+            finish(result)
+
+    def feed() -> None:
+        count = 0
+        try:
+            for index, item in enumerate(nanopubs):
+                while not slots.acquire(timeout=0.1):
+                    if stop.is_set():
+                        return
+                if stop.is_set():
+                    slots.release()
+                    return
+                count += 1
+                result = PublishResult(index=index, source=str(item) if isinstance(item, (Path, str)) else None)
+                try:
+                    data, rdf_format, source_uri = _serialize_input(item)
+                    if source_uri:
+                        result.source_uri = source_uri
+                        upload_pool.submit(upload, result, data)
+                        continue
+                    if conf.profile is None:
+                        raise ProfileError("Profile not available, cannot sign the nanopub")
+                    # Nanopub objects already hold the triples added by the conf
+                    future = sign_pool.submit(sign_rdf, data, rdf_format, conf, not isinstance(item, Nanopub))
+                except Exception as e:
+                    result.error = f"{type(e).__name__}: {e}"
+                    finish(result)
+                    continue
+                future.add_done_callback(lambda f, result=result: on_signed(result, f))
+        except Exception as e:
+            results.put(e)
+        finally:
+            results.put(_FeedDone(count))
+
+    feeder = threading.Thread(target=feed, name="nanopub-publish-feeder", daemon=True)
+    feeder.start()
+    try:
+        received = 0
+        total = None
+        while total is None or received < total:
+            item = results.get()
+            if isinstance(item, _FeedDone):
+                total = item.count
+            elif isinstance(item, Exception):
+                raise item
+            else:
+                received += 1
+                yield item
+    finally:
+        stop.set()
+        feeder.join()
+        sign_pool.shutdown(wait=True, cancel_futures=True)
+        upload_pool.shutdown(wait=True, cancel_futures=True)
+
+
+@dataclass
+class InvalidationResult:
+    """Outcome of the retraction or supersession of one nanopub by `retract_many` or `supersede_many`.
+
+    Args:
+        target: URI of the nanopub retracted or superseded
+        source_uri: Trusty URI of the retraction or update nanopub, None if it was not signed
+        published: True if the registry accepted the retraction or update
+        skipped: Why the target was not retracted or superseded, e.g. when it is signed with
+            another public key than the one of the profile. None if it was not skipped.
+        error: Description of the error if signing or publishing failed
+    """
+
+    target: str
+    source_uri: Optional[str] = None
+    published: bool = False
+    skipped: Optional[str] = None
+    error: Optional[str] = None
+
+    dict = asdict
+
+
+def fetch_public_key(uri: str, conf: NanopubConf) -> Optional[str]:
+    """Fetch a nanopub and return the public key it is signed with, None if it has none.
+
+    The nanopub is not built as a Nanopub object, so this is safe in threads.
+    """
+    r = fetch_nanopub_response(uri, conf)
+    r.raw.decode_content = True
+    rdf = Dataset()
+    with r:
+        rdf.parse(source=r.raw, format=NANOPUB_FETCH_FORMAT)
+    return next((str(key) for _, _, key, _ in rdf.quads((None, NPX.hasPublicKey, None, None))), None)
+
+
+def check_ownership(
+    targets: Iterable[str],
+    conf: NanopubConf,
+    client: Optional[NanopubClient] = None,
+    skip_retracted: bool = False,
+    fetch_workers: int = DEFAULT_UPLOAD_WORKERS,
+) -> Dict[str, Optional[str]]:
+    """Check that nanopubs are signed with the public key of the profile of the conf.
+
+    The public keys of all the nanopubs are retrieved with batched queries to the Nanopub Query
+    servers, and only the nanopubs they do not know yet are fetched, concurrently.
+
+    Args:
+        targets: URIs of the nanopubs to check
+        conf: Configuration giving the profile, and the server to fetch nanopubs from
+        client: Client used for the queries, defaults to one for the server of the conf
+        skip_retracted: Also reject the nanopubs that are already retracted
+        fetch_workers: Number of nanopubs fetched at the same time
+
+    Returns:
+        a dict with, for each URI, None if the nanopub can be retracted or superseded, or the
+        reason why it cannot.
+    """
+    if conf.profile is None or conf.profile.public_key is None:
+        raise ProfileError("Profile not available, cannot check the public keys of the nanopubs")
+    client = client or NanopubClient(use_test_server=conf.use_test_server)
+    statuses = client.retraction_status(targets)
+    reasons: Dict[str, Optional[str]] = {}
+    fetch_conf = NanopubConf(use_test_server=conf.use_test_server, use_server=conf.use_server)
+    # The nanopubs not indexed by the query servers yet are fetched
+    missing = [uri for uri, status in statuses.items() if status.public_key is None]
+    fetched: Dict[str, Future] = {}
+    if missing:
+        with ThreadPoolExecutor(max_workers=max(1, min(fetch_workers, len(missing)))) as pool:
+            fetched = {uri: pool.submit(fetch_public_key, uri, fetch_conf) for uri in missing}
+    for uri, status in statuses.items():
+        public_key = status.public_key
+        if uri in fetched:
+            try:
+                public_key = fetched[uri].result()
+            except Exception as e:
+                reasons[uri] = f"Could not fetch the nanopub: {type(e).__name__}: {e}"
+                continue
+        if public_key is None:
+            reasons[uri] = "Public key not found in the nanopub"
+        elif str(public_key) != conf.profile.public_key:
+            reasons[uri] = "Signed with another public key than the one of the profile"
+        elif skip_retracted and status.is_retracted:
+            reasons[uri] = f"Already retracted by {', '.join(status.retracted_by)}"
+        else:
+            reasons[uri] = None
+    return reasons
+
+
+def retract_many(
+    targets: Iterable[str],
+    conf: NanopubConf,
+    force: bool = False,
+    client: Optional[NanopubClient] = None,
+    **publish_kwargs,
+) -> List[InvalidationResult]:
+    """Retract many nanopubs, checking their public keys in batches and publishing in parallel.
+
+    Nanopubs signed with another public key than the one of the profile, and the ones that are
+    already retracted, are skipped unless `force` is True. The retractions are signed and
+    published with `publish_many`.
+
+    Args:
+        targets: URIs of the nanopubs to retract
+        conf: Configuration giving the profile used to sign, and the server to publish to
+        force: Retract the nanopubs without checking their public keys
+        client: Client used to check the public keys, defaults to one for the server of the conf
+        publish_kwargs: Arguments passed to `publish_many`, e.g. sign_workers or upload_workers
+
+    Returns:
+        the InvalidationResult of each target, in the input order.
+    """
+    targets = list(dict.fromkeys(str(t) for t in targets))
+    reasons = {} if force else check_ownership(targets, conf, client, skip_retracted=True)
+    return _publish_invalidations(
+        [(target, NanopubRetract(conf, target, force=True)) for target in targets if not reasons.get(target)],
+        targets, reasons, conf, publish_kwargs,
+    )
+
+
+def supersede_many(
+    updates: Iterable[Tuple[str, Graph]],
+    conf: NanopubConf,
+    force: bool = False,
+    client: Optional[NanopubClient] = None,
+    **publish_kwargs,
+) -> List[InvalidationResult]:
+    """Supersede many nanopubs with new versions, checking their public keys in batches and publishing in parallel.
+
+    Nanopubs signed with another public key than the one of the profile are skipped unless
+    `force` is True. The new versions are signed and published with `publish_many`.
+
+    Args:
+        updates: Tuples of the URI of a nanopub to supersede and the assertion of its new version
+        conf: Configuration giving the profile used to sign, and the server to publish to
+        force: Supersede the nanopubs without checking their public keys
+        client: Client used to check the public keys, defaults to one for the server of the conf
+        publish_kwargs: Arguments passed to `publish_many`, e.g. sign_workers or upload_workers
+
+    Returns:
+        the InvalidationResult of each target, in the input order.
+    """
+    assertions = {str(target): assertion for target, assertion in updates}
+    targets = list(assertions)
+    reasons = {} if force else check_ownership(targets, conf, client)
+    return _publish_invalidations(
+        [
+            (target, NanopubUpdate(conf, target, force=True, assertion=assertions[target]))
+            for target in targets if not reasons.get(target)
+        ],
+        targets, reasons, conf, publish_kwargs,
+    )
+
+
+def _publish_invalidations(
+    nanopubs: List[Tuple[str, Nanopub]],
+    targets: List[str],
+    reasons: Dict[str, Optional[str]],
+    conf: NanopubConf,
+    publish_kwargs: dict,
+) -> List[InvalidationResult]:
+    """Publish retractions or updates, and gather the results by target."""
+    results = {target: InvalidationResult(target, skipped=reasons.get(target)) for target in targets}
+    for target, reason in reasons.items():
+        if reason:
+            log.info(f"Skipping {target}: {reason}")
+    # The nanopubs are built beforehand, as building them runs SPARQL queries on their RDF
+    # which must not overlap with the signing thread of publish_many
+    for published in publish_many([np for _, np in nanopubs], conf, **publish_kwargs):
+        result = results[nanopubs[published.index][0]]
+        result.source_uri = published.source_uri
+        result.published = published.published
+        result.error = published.error
+    return list(results.values())
+
+
+@dataclass
+class _FeedDone:
+    """Marks the end of the input of `publish_many`, with the number of nanopubs read."""
+
+    count: int
+
+
+def _serialize_input(item: PublishInput) -> Tuple[str, str, Optional[str]]:
+    """Serialize a nanopub given to `publish_many`.
+
+    Returns:
+        tuple of: the serialized nanopub, its RDF format, its trusty URI if it is already signed.
+    """
+    if isinstance(item, Nanopub):
+        return item.rdf.serialize(format="trig"), "trig", item.source_uri
+    if isinstance(item, Dataset):
+        return item.serialize(format="trig"), "trig", None
+    path = Path(item)
+    return path.read_text(encoding="utf-8"), guess_format(str(path)) or "trig", None
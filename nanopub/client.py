@@ -2,9 +2,11 @@
 This module includes a client for the nanopub server.
 """
 
-import random
+import io
+import time
 import warnings
-from typing import Dict, List, Tuple, Union
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple, Union
 import csv
 from io import StringIO
 
@@ -17,15 +19,122 @@ from nanopub.definitions import (
     DUMMY_NANOPUB_URI,
     NANOPUB_QUERY_URLS,
     NANOPUB_REGISTRY_URLS,
+    NANOPUB_SPARQL_URLS,
+    QUERY_TIMEOUT,
     TEST_NANOPUB_QUERY_URL,
     TEST_NANOPUB_REGISTRY_URL,
 )
+from nanopub.hedging import hedge_delay, hedged_call
 from nanopub.nanopub import Nanopub
 from nanopub.nanopub_conf import NanopubConf
+from nanopub.query_cache import QueryCache, make_cache_key
+from nanopub.server_selection import ServerSelector, shared_selector
 from nanopub.utils import log
 
 DUMMY_NAMESPACE = rdflib.Namespace(DUMMY_NANOPUB_URI + "/")
 NP_URI = DUMMY_NAMESPACE[""]
+SERVER_DOWN_STATUS_CODES = {502, 503, 504}
+
+# Number of patterns or URIs sent in each SPARQL query by the batch methods
+SPARQL_BATCH_SIZE = 100
+
+SPARQL_PREFIXES = f"""prefix np: <{namespaces.NP}>
+prefix npa: <{namespaces.NPA}>
+prefix npx: <{namespaces.NPX}>
+prefix dct: <http://purl.org/dc/terms/>
+"""
+
+FILTER_RETRACTED = """FILTER NOT EXISTS {
+      ?invalidating npx:invalidates ?np ;
+          npa:hasValidSignatureForPublicKey ?pubkey .
+    }"""
+
+FIND_PATTERNS_QUERY = SPARQL_PREFIXES + """
+SELECT DISTINCT ?i ?np ?date WHERE {
+  VALUES (?i ?s ?p ?o) { %(values)s }
+  GRAPH ?a { ?s ?p ?o }
+  GRAPH npa:graph {
+    ?np np:hasAssertion ?a ;
+        npa:hasValidSignatureForPublicKey ?pubkey ;
+        dct:created ?date .
+    %(filters)s
+  }
+}
+"""
+
+
+RETRACTION_STATUS_QUERY = SPARQL_PREFIXES + """
+SELECT DISTINCT ?i ?pubkey ?kind ?by WHERE {
+  VALUES (?i ?np) { %(values)s }
+  OPTIONAL { GRAPH npa:graph { ?np npa:hasValidSignatureForPublicKey ?pubkey } }
+  OPTIONAL {
+    {
+      GRAPH ?g { ?retractor npx:retracts ?np }
+      GRAPH npa:graph { ?by np:hasAssertion ?g ; npa:hasValidSignatureForPublicKey ?bykey }
+      BIND("retracted" AS ?kind)
+    } UNION {
+      GRAPH ?g { ?by npx:supersedes ?np }
+      GRAPH npa:graph { ?by npa:hasValidSignatureForPublicKey ?bykey }
+      BIND("superseded" AS ?kind)
+    }
+    %(filters)s
+  }
+}
+"""
+
+
+@dataclass
+class RetractionStatus:
+    """Retraction and supersession status of a nanopublication.
+
+    Attributes:
+        uri (str): URI of the nanopublication
+        public_key (str): Public key the nanopublication is signed with, None if it was not found
+        retracted_by (list): URIs of the nanopublications retracting it
+        superseded_by (list): URIs of the nanopublications superseding it
+    """
+
+    uri: str
+    public_key: Optional[str] = None
+    retracted_by: List[str] = field(default_factory=list)
+    superseded_by: List[str] = field(default_factory=list)
+
+    @property
+    def is_retracted(self) -> bool:
+        return len(self.retracted_by) > 0
+
+    @property
+    def is_superseded(self) -> bool:
+        return len(self.superseded_by) > 0
+
+
+def _sparql_term(value) -> str:
+    """Write a pattern element in SPARQL. Strings are URIs, empty elements match anything."""
+    if value is None or value == "":
+        return "UNDEF"
+    if isinstance(value, rdflib.term.Identifier):
+        return value.n3()
+    return rdflib.URIRef(value).n3()
+
+
+def _chunks(items: List[Any], size: int) -> Iterator[Tuple[int, List[Any]]]:
+    for start in range(0, len(items), size):
+        yield start, items[start:start + size]
+
+
+def _convert_rows(
+    rows: Iterable[dict], converters: Optional[Dict[str, Callable[[str], Any]]]
+) -> Iterator[dict]:
+    """Apply the converters to the values of the given columns of each row."""
+    if not converters:
+        yield from rows
+        return
+    for row in rows:
+        for column, convert in converters.items():
+            if column in row:
+                value = row[column]
+                row[column] = convert(value) if value not in (None, "") else None
+        yield row
 
 
 class NanopubClient:
@@ -35,6 +144,18 @@ class NanopubClient:
     Args:
         use_test_server (bool): Toggle using the test nanopub server.
         use_server (str): Provide the URL of a nanopub server to use
+        query_urls (list): Provide the URLs of the Nanopub Query servers to use
+        sparql_urls (list): Provide the URLs of the SPARQL endpoints used by query_sparql
+        cache (QueryCache): Cache for the results of searches and query templates,
+            e.g. MemoryQueryCache or DiskQueryCache. Default is None, no caching.
+        server_selector (ServerSelector): Picks which Nanopub Query server to use, based on
+            their latency and errors. By default the selector shared by all the clients using
+            the same query_urls, see `shared_selector`.
+        timeout (float or tuple): Timeout in seconds for requests to the Nanopub Query servers,
+            as accepted by requests: one value, or a (connect, read) tuple.
+        hedge_quantile (float): When set, a query is also sent to a second Nanopub Query server
+            if the first one did not answer within this quantile (e.g. 0.95) of the observed
+            latencies, and the first answer is used. Default is None, no hedging.
     """
 
     def __init__(
@@ -42,18 +163,28 @@ class NanopubClient:
         use_test_server=False,
         use_server=NANOPUB_REGISTRY_URLS[0],
         query_urls=None,
+        sparql_urls=None,
+        cache: Optional[QueryCache] = None,
+        server_selector: Optional[ServerSelector] = None,
+        timeout: Union[float, Tuple[float, float]] = QUERY_TIMEOUT,
+        hedge_quantile: Optional[float] = None,
     ):
         self.use_test_server = use_test_server
+        self.cache = cache
+        self.timeout = timeout
+        self.hedge_quantile = hedge_quantile
         if use_test_server:
             self.query_urls = [TEST_NANOPUB_QUERY_URL]
             self.use_server = TEST_NANOPUB_REGISTRY_URL
         else:
-            self.query_urls = NANOPUB_QUERY_URLS
+            self.query_urls = list(NANOPUB_QUERY_URLS)
             self.use_server = use_server
             if use_server not in NANOPUB_REGISTRY_URLS:
                 log.warn(f"{use_server} is not in our list of nanopub servers. {', '.join(NANOPUB_REGISTRY_URLS)}\nMake sure you are using an existing Nanopub server.")
         if query_urls is not None:
-            self.query_urls = query_urls
+            self.query_urls = list(query_urls)
+        self.sparql_urls = list(sparql_urls) if sparql_urls is not None else list(NANOPUB_SPARQL_URLS)
+        self.server_selector = server_selector or shared_selector(self.query_urls)
 
     def find_nanopubs_with_text(
         self, text: str, pubkey: str = None, filter_retracted: bool = True
@@ -222,12 +353,50 @@ class NanopubClient:
         return [result["np"] for result in results]
 
 
+    def retraction_status(
+        self,
+        sources: Iterable[Union[str, Nanopub]],
+        valid_only: bool = True,
+        chunk_size: int = SPARQL_BATCH_SIZE,
+    ) -> Dict[str, RetractionStatus]:
+        """Find the retractions and supersessions of many nanopublications.
+
+        Unlike find_retractions_of, the nanopublications are not fetched to get their public key:
+        the public keys, retractions and supersessions are all retrieved with one SPARQL query for
+        every `chunk_size` nanopublications.
+
+        Args:
+            sources (list): URIs or Nanopub objects to check
+            valid_only (bool): Toggle returning only valid retractions and supersessions, i.e. the ones
+                signed with the same public key as the publication they retract. Default is True.
+            chunk_size (int): Maximum number of nanopublications checked in one query.
+
+        Returns:
+            Dict with the RetractionStatus of each nanopublication, by URI, in the order given
+        """
+        uris = [str(source.source_uri) if isinstance(source, Nanopub) else str(source) for source in sources]
+        statuses = {uri: RetractionStatus(uri) for uri in uris}
+        unique_uris = list(statuses.keys())
+        filters = "FILTER(?bykey = ?pubkey)" if valid_only else ""
+        rows = [(_sparql_term(uri),) for uri in unique_uris]
+        for row in self._query_sparql_values(RETRACTION_STATUS_QUERY, rows, chunk_size, filters):
+            status = statuses[unique_uris[row["i"]]]
+            if row.get("pubkey"):
+                status.public_key = row["pubkey"]
+            by = row.get("by")
+            if row.get("kind") == "retracted" and by not in status.retracted_by:
+                status.retracted_by.append(by)
+            elif row.get("kind") == "superseded" and by not in status.superseded_by:
+                status.superseded_by.append(by)
+        return statuses
+
+
     @staticmethod
-    def _query_api(params: dict, endpoint: str, query_url: str) -> requests.Response:
+    def _query_api(params: dict, endpoint: str, query_url: str, timeout=None) -> requests.Response:
         """Query a specific Nanopub Query endpoint."""
         headers = {"Accept": "application/json"}
         url = query_url + endpoint
-        return requests.get(url, params=params, headers=headers)
+        return requests.get(url, params=params, headers=headers, timeout=timeout)
 
 
     def _query_api_try_servers(
@@ -236,24 +405,34 @@ class NanopubClient:
         """Query the Nanopub Query endpoint.
 
         Query a Nanopub Query endpoint (for example: 'RARqGauUpDMEA1o4KBSKC8AeP694qJjpbf7x7FOWHDfM8/find-valid-things').
-        Try several of the Nanopub Query servers.
+        Try the Nanopub Query servers in the order given by the server selector, moving on to
+        the next server when one times out, cannot be reached or returns a 502, 503 or 504 error.
 
         Returns:
             tuple of: r: request response, query_url: url of the Nanopub Query server used.
         """
+        if self.hedge_quantile is not None:
+            return self._query_api_hedged(params, endpoint)
         r = None
-        random.shuffle(self.query_urls)  # To balance load across servers
-        for query_url in self.query_urls:
-            r = self._query_api(params, endpoint, query_url)
-            if r.status_code == 502:  # Server is likely down
+        for query_url in self.server_selector.ordered():
+            start = time.monotonic()
+            try:
+                r = self._query_api(params, endpoint, query_url, timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                self.server_selector.record_failure(query_url)
+                warnings.warn(f"Could not get response from {query_url} ({e}), trying other servers")
+                continue
+            if r.status_code in SERVER_DOWN_STATUS_CODES:  # Server is likely down
+                self.server_selector.record_failure(query_url)
                 warnings.warn(
                     f"Could not get response from {query_url}, trying other servers"
                 )
             else:
-                r.raise_for_status()  # For non-502 errors we don't want to try other servers
+                self.server_selector.record_success(query_url, time.monotonic() - start)
+                r.raise_for_status()  # For other errors we don't want to try other servers
                 return r, query_url
         resp = ""
-        if r:
+        if r is not None:
             resp = f" Last response: {r.status_code}:{r.reason}"
         raise requests.HTTPError(
             f"Could not get response from any of the Nanopub Query servers "
@@ -261,6 +440,43 @@ class NanopubClient:
         )
 
 
+    def _query_api_hedged(
+        self, params: dict, endpoint: str
+    ) -> Tuple[requests.Response, str]:
+        """Query the Nanopub Query endpoint, hedging the request to a second server when the first is slow."""
+        def query(query_url: str) -> requests.Response:
+            start = time.monotonic()
+            try:
+                r = self._query_api(params, endpoint, query_url, timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout):
+                self.server_selector.record_failure(query_url)
+                raise
+            if r.status_code in SERVER_DOWN_STATUS_CODES:
+                self.server_selector.record_failure(query_url)
+                r.raise_for_status()
+            self.server_selector.record_success(query_url, time.monotonic() - start)
+            return r
+
+        try:
+            r, query_url = hedged_call(
+                query,
+                self.server_selector.ordered(),
+                hedge_after=hedge_delay(self.server_selector, self.hedge_quantile),
+                discard=lambda response: response.close(),
+            )
+        except requests.RequestException as e:
+            raise requests.HTTPError(
+                f"Could not get response from any of the Nanopub Query servers endpoints. Last error: {e}"
+            ) from e
+        r.raise_for_status()
+        return r, query_url
+
+
+    def _cache_key(self, endpoint: str, params: dict) -> str:
+        """Key of the results of a query in the cache, specific to the query servers of this client."""
+        return make_cache_key(endpoint, params, self.query_urls)
+
+
     def _search(self, endpoint: str, params: dict):
         """
         General nanopub server search method. User should use e.g. find_nanopubs_with_text,
@@ -274,12 +490,21 @@ class NanopubClient:
             JSONDecodeError: in case response can't be serialized as JSON, this can happen due to a
                 virtuoso error.
         """
-        # First try different servers
+        if self.cache is None:
+            yield from self._search_servers(endpoint, params)
+        else:
+            # Copy the cached results so callers cannot alter the content of the cache
+            results = self.cache.get_or_fetch(
+                self._cache_key(endpoint, params),
+                lambda: list(self._search_servers(endpoint, params)),
+            )
+            for result in results:
+                yield dict(result)
+
+
+    def _search_servers(self, endpoint: str, params: dict):
+        """Run a search on the Nanopub Query servers, without using the cache."""
         r, query_url = self._query_api_try_servers(params, endpoint)
-        # If we have found a Nanopub Query server we should use that for further queries (so
-        # pagination works properly)
-        r = self._query_api(params, endpoint, query_url)
-        r.raise_for_status()
 
         # Check if JSON was actually returned. HTML can be returned instead
         # if e.g. virtuoso errors on the backend (due to spaces in the search
@@ -304,8 +529,8 @@ class NanopubClient:
     def _parse_search_result(result: dict):
         """
         Parse a nanopub search result (i.e. referring to one matching nanopublication).
-        Rename 'v' to 'description', select only date, np, label and description fields
-        and unnest them.
+        Rename 'v' to 'description', select only date, np, label and description fields,
+        and the fdo or thing the result is about, and unnest them.
         """
         parsed = dict()
         parsed["np"] = result["np"]["value"]
@@ -318,13 +543,16 @@ class NanopubClient:
             parsed["description"] = ""
         if "label" in result:
             parsed["label"] = result["label"]["value"]
+        for key in ("fdo", "thing"):
+            if key in result:
+                parsed[key] = result[key]["value"]
         parsed["date"] = result["date"]["value"]
         return parsed
     
     def _query_api_csv(self, params, endpoint, query_url) -> str:
         headers = {"Accept": "text/csv"}
         url = query_url + endpoint
-        response = requests.get(url, params=params, headers=headers)
+        response = requests.get(url, params=params, headers=headers, timeout=self.timeout)
         response.raise_for_status()
         response.encoding = 'utf-8-sig'
         return response.text
@@ -335,6 +563,156 @@ class NanopubClient:
         reader = csv.DictReader(line for line in StringIO(csv_text) if line.strip())
         return list(reader)
     
+    def _open_csv_stream(self, response: requests.Response) -> Iterator[dict]:
+        """Parse the CSV body of a streamed response row by row, as it is received."""
+        response.raw.decode_content = True
+        # Keep the stream open once the body is read, as expected by TextIOWrapper
+        response.raw.auto_close = False
+        text = io.TextIOWrapper(response.raw, encoding="utf-8-sig", newline="")
+        try:
+            yield from csv.DictReader(text)
+        finally:
+            response.close()
+
+    def _query_api_csv_stream(self, params, endpoint, query_url) -> Iterator[dict]:
+        """Query a Nanopub Query endpoint, and yield the rows of the CSV results as they arrive."""
+        headers = {"Accept": "text/csv"}
+        url = query_url + endpoint
+        response = requests.get(url, params=params, headers=headers, timeout=self.timeout, stream=True)
+        try:
+            response.raise_for_status()
+        except requests.HTTPError:
+            response.close()
+            raise
+        return self._open_csv_stream(response)
+
+    def iter_query_template(
+        self,
+        query_pid: str,
+        params: Dict[str, str],
+        converters: Optional[Dict[str, Callable[[str], Any]]] = None,
+    ) -> Iterator[dict]:
+        """
+        Executes a nanopub query template (CSV-based) and yields rows as dicts while they are received.
+
+        Unlike execute_query_template the results are never fully loaded in memory, and they
+        are not cached. Other query servers are only tried if the first one fails before
+        returning results.
+
+        Args:
+            query_pid (str): The query template, e.g. 'RAs0HI_KRAds4w_OOEMl-_ed0nZHFWdfePPXsDHf4kQkU/get-fdo-by-id'
+            params (dict): The parameters of the query template
+            converters (dict): Functions used to convert the values of some columns, e.g. {"count": int}.
+                Empty values are converted to None.
+        """
+        for query_url in self.server_selector.ordered():
+            start = time.monotonic()
+            try:
+                rows = self._query_api_csv_stream(params=params, endpoint=query_pid, query_url=query_url)
+            except Exception as e:
+                self.server_selector.record_failure(query_url)
+                warnings.warn(f"Query failed on {query_url}: {e}")
+                continue
+            self.server_selector.record_success(query_url, time.monotonic() - start)
+            yield from _convert_rows(rows, converters)
+            return
+        raise RuntimeError("Failed to retrieve query result from any query server")
+
+    def iter_sparql(
+        self,
+        query: str,
+        converters: Optional[Dict[str, Callable[[str], Any]]] = None,
+    ) -> Iterator[dict]:
+        """
+        Run a raw SPARQL query against a nanopub server, and yield the result rows as they are received.
+
+        The results are requested as CSV, so all values are strings unless converted.
+
+        Args:
+            query (str): A valid SPARQL 1.1 query string.
+            converters (dict): Functions used to convert the values of some columns, e.g. {"count": int}.
+                Empty (unbound) values are converted to None.
+        """
+        for endpoint_url in self.sparql_urls:
+            try:
+                response = requests.post(
+                    endpoint_url,
+                    data={"query": query},
+                    headers={"Accept": "text/csv"},
+                    timeout=self.timeout,
+                    stream=True,
+                )
+            except Exception as e:
+                warnings.warn(f"SPARQL query failed on {endpoint_url}: {e}")
+                continue
+            try:
+                response.raise_for_status()
+            except requests.HTTPError as e:
+                response.close()
+                warnings.warn(f"SPARQL query failed on {endpoint_url}: {e}")
+                continue
+            yield from _convert_rows(self._open_csv_stream(response), converters)
+            return
+        raise RuntimeError("SPARQL query failed on all nanopub endpoints.")
+
+    def find_nanopubs_with_patterns(
+        self,
+        patterns: Iterable[Tuple[Any, Any, Any]],
+        filter_retracted: bool = True,
+        pubkey: str = None,
+        chunk_size: int = SPARQL_BATCH_SIZE,
+    ) -> List[List[dict]]:
+        """Batch pattern search.
+
+        Search the nanopub servers for the nanopubs matching each of the given RDF patterns, with
+        one SPARQL query for every `chunk_size` patterns instead of one request per pattern.
+
+        Args:
+            patterns (list): (subject, predicate, object) tuples. Strings are used as URIs, rdflib
+                terms (e.g. Literal) are used as is, and None or '' matches anything.
+            filter_retracted (bool): Toggle filtering for publications that are
+                retracted. Default is True, returning only publications that are not retracted.
+            pubkey (str): Public key that the matching nanopubs should be signed with
+            chunk_size (int): Maximum number of patterns sent in one query.
+
+        Returns:
+            A list with, for each pattern in the order given, the list of the matching
+            nanopublications as dicts with 'np': the nanopublication uri and 'date': its date of creation.
+        """
+        patterns = list(patterns)
+        results: List[List[dict]] = [[] for _ in patterns]
+        filters = []
+        if pubkey:
+            filters.append(f"FILTER(?pubkey = {rdflib.Literal(pubkey).n3()})")
+        if filter_retracted:
+            filters.append(FILTER_RETRACTED)
+        rows = [tuple(_sparql_term(term) for term in pattern) for pattern in patterns]
+        for row in self._query_sparql_values(FIND_PATTERNS_QUERY, rows, chunk_size, "\n    ".join(filters)):
+            results[row["i"]].append({"np": row["np"], "date": row["date"]})
+        return results
+
+    def _query_sparql_values(
+        self,
+        query: str,
+        rows: List[Tuple[str, ...]],
+        chunk_size: int = SPARQL_BATCH_SIZE,
+        filters: str = "",
+    ) -> Iterator[dict]:
+        """Run a SPARQL query for many inputs, sent in chunks as a VALUES block.
+
+        The query must contain a `VALUES (?i ...) { %(values)s }` block, and can contain a
+        `%(filters)s` placeholder. Each row of SPARQL terms is numbered with its position ?i in
+        `rows`, so results can be sent back to the input that produced them.
+        """
+        for start, chunk in _chunks(rows, chunk_size):
+            values = " ".join(
+                f"({start + offset} {' '.join(row)})" for offset, row in enumerate(chunk)
+            )
+            yield from self.iter_sparql(
+                query % {"values": values, "filters": filters},
+                converters={"i": int},
+            )
+
     def query_sparql(self, query: str, return_format: str = "json") -> Union[List[dict], str]:
         """
         Run a raw SPARQL query against a nanopub server using SPARQLWrapper.
@@ -348,8 +726,7 @@ class NanopubClient:
         """
         if return_format not in {"json", "csv"}:
             raise ValueError("return_format must be 'json' or 'csv'")
-        endpoints = ['https://query.knowledgepixels.com/repo/full'] # TODO: Consider adding more endpoints if needed
-        for endpoint_url in endpoints:
+        for endpoint_url in self.sparql_urls:
             try:
                 sparql = SPARQLWrapper(endpoint_url)
                 sparql.setQuery(query)
@@ -371,11 +748,25 @@ class NanopubClient:
         """
         Executes a nanopub query template (CSV-based) and returns rows as a list of dicts.
         """
-        for query_url in self.query_urls:
+        if self.cache is None:
+            return self._execute_query_template(query_pid, params)
+        rows = self.cache.get_or_fetch(
+            self._cache_key(query_pid, params),
+            lambda: self._execute_query_template(query_pid, params),
+        )
+        return [dict(row) for row in rows]
+
+    def _execute_query_template(self, query_pid: str, params: Dict[str, str]) -> List[dict]:
+        for query_url in self.server_selector.ordered():
+            start = time.monotonic()
             try:
                 csv_text = self._query_api_csv(params=params, endpoint=query_pid, query_url=query_url)
                 reader = csv.DictReader(StringIO(csv_text))
-                return list(reader)
+                rows = list(reader)
             except Exception as e:
+                self.server_selector.record_failure(query_url)
                 warnings.warn(f"Query failed on {query_url}: {e}")
+            else:
+                self.server_selector.record_success(query_url, time.monotonic() - start)
+                return rows
         raise RuntimeError("Failed to retrieve query result from any query server")
@@ -35,3 +35,8 @@ NANOPUB_QUERY_URLS = [
     'https://query.np.trustyuri.net/api/',
 ]
 TEST_NANOPUB_QUERY_URL = 'https://query.knowledgepixels.com/api/' # we don't yet have a test server for this
+NANOPUB_SPARQL_URLS = [
+    'https://query.knowledgepixels.com/repo/full',
+]
+# Timeout for the requests to the Nanopub Query servers: (connect, read) in seconds
+QUERY_TIMEOUT = (5, 60)
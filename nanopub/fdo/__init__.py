@@ -1,20 +1,35 @@
 from .fdo_record import FdoRecord
 from .fdo_nanopub import FdoNanopub
 from .fdo_query import FdoQuery
-from .validate import validate_fdo_record
-from .retrieve import retrieve_record_from_id, retrieve_content_from_id, resolve_handle_metadata, resolve_id, resolve_in_nanopub_network, get_fdo_uri_from_fdo_record
-from .update import update_record
+from .validate import ShapeCache, validate_fdo_record, validate_fdo_records
+from .retrieve import FdoResolver, resolve_many, retrieve_record_from_id, retrieve_content_from_id, resolve_handle_metadata, resolve_id, resolve_in_nanopub_network, get_fdo_uri_from_fdo_record
+from .update import diff_record, update_record, update_records
+from .download import download_content, download_content_from_id
+from .bulk import handles_to_nanopubs
+from .aggregation import iter_sharded_aggregation, iter_aggregation_parts, retrieve_aggregation_record
 
 __all__ = [
     "FdoRecord",
     "FdoNanopub",
     "FdoQuery",
     "validate_fdo_record",
+    "validate_fdo_records",
+    "ShapeCache",
     "retrieve_record_from_id",
     "update_record",
+    "update_records",
+    "diff_record",
     "retrieve_content_from_id",
+    "download_content",
+    "download_content_from_id",
+    "handles_to_nanopubs",
+    "iter_sharded_aggregation",
+    "iter_aggregation_parts",
+    "retrieve_aggregation_record",
     "resolve_handle_metadata",
     "resolve_id",
     "resolve_in_nanopub_network",
+    "resolve_many",
+    "FdoResolver",
     "get_fdo_uri_from_fdo_record"
 ]
@@ -0,0 +1,228 @@
+"""
+This module holds functions to publish and read aggregation FDOs with more parts than a nanopub can hold.
+
+The parts (dcterms:hasPart) of a sharded aggregation FDO are split in shard nanopubs of at most
+`MAX_PARTS_PER_SHARD` parts, like the elements of a Nanopub Index. The FDO nanopub introducing the
+FDO links to each shard nanopub as one of its metadata records (fdof:hasMetadata) that it requires
+(dcterms:requires, `HAS_SHARD`). It holds the parts itself when they fit in a single nanopub.
+"""
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from copy import deepcopy
+from itertools import chain, islice
+from typing import Deque, Iterable, Iterator, List, Optional, Union
+
+from rdflib import Graph, Literal, URIRef
+from rdflib.namespace import DCTERMS, RDFS
+
+from nanopub.bulk import SigningPipeline
+from nanopub.fdo.fdo_nanopub import FdoNanopub, to_aggregate_iri
+from nanopub.fdo.fdo_record import FdoRecord
+from nanopub.fdo.retrieve import fetch_assertion, get_fdo_uri_from_fdo_record
+from nanopub.fdo.utils import handle_to_iri, looks_like_handle
+from nanopub.definitions import MAX_TRIPLES_PER_NANOPUB
+from nanopub.namespaces import FDOF, HAS_SHARD
+from nanopub.nanopub import Nanopub
+from nanopub.nanopub_conf import NanopubConf
+from nanopub.utils import log
+
+MAX_PARTS_PER_SHARD = 1000
+"""Number of parts of an aggregation FDO held by each shard nanopub"""
+
+SHARD_FETCH_WORKERS = 4
+"""Default number of shard nanopubs fetched at the same time when reading an aggregation"""
+
+
+def _to_iri(value: Union[URIRef, str]) -> URIRef:
+    return handle_to_iri(value) if looks_like_handle(value) else URIRef(value)
+
+
+def get_shard_uris(assertion: Graph, fdo_iri: URIRef) -> List[URIRef]:
+    """URIs of the shard nanopubs of an aggregation FDO, in the assertion of its FDO nanopub."""
+    return [
+        shard_uri for shard_uri in assertion.objects(fdo_iri, HAS_SHARD)
+        if (fdo_iri, FDOF.hasMetadata, shard_uri) in assertion
+    ]
+
+
+def _sign_shard(conf: NanopubConf, fdo_iri: URIRef, label: str, parts: List[URIRef], start: int) -> Nanopub:
+    """Build and sign a shard nanopub, in the worker processes of `iter_sharded_aggregation`."""
+    assertion = Graph()
+    for part in parts:
+        assertion.add((fdo_iri, DCTERMS.hasPart, part))
+    np = Nanopub(conf=conf, assertion=assertion)
+    np.pubinfo.add((
+        np.metadata.np_uri, RDFS.label,
+        Literal(f"Parts {start + 1} to {start + len(parts)} of FAIR Digital Object: {label}"),
+    ))
+    np.sign()
+    return np
+
+
+def iter_sharded_aggregation(
+    fdo_iri: Union[URIRef, str],
+    profile_uri: str,
+    label: str,
+    aggregates: Iterable[Union[URIRef, str]],
+    conf: Optional[NanopubConf] = None,
+    shard_size: int = MAX_PARTS_PER_SHARD,
+    sign_workers: Optional[int] = None,
+    max_pending: Optional[int] = None,
+) -> Iterator[Nanopub]:
+    """Create an aggregation FDO from an iterator of parts of any length, yielding the signed nanopubs.
+
+    Like `FdoNanopub.create_aggregation_fdo`, the FDO is introduced by an FDO nanopub with its
+    label and profile. When there are more than `shard_size` parts, they are split in shard
+    nanopubs asserting `<fdo_iri> dcterms:hasPart <part>` for `shard_size` parts each, and the
+    FDO nanopub links to every shard nanopub with fdof:hasMetadata and dcterms:requires.
+    Otherwise the FDO nanopub holds the parts, like a regular aggregation FDO.
+
+    The FDO nanopub must hold two triples per shard, which limits the number of shards to
+    about 590. The parts are read before signing the first shard to check they fit, so
+    nothing is yielded for an aggregation that cannot be published.
+
+    Shard nanopubs are signed in a pool of processes, and yielded in the order of the parts as
+    soon as they are signed. The FDO nanopub is the last one yielded, once the URIs of all the
+    shards are known. Use `iter_aggregation_parts` to read the parts of the published FDO.
+
+    Args:
+        fdo_iri: IRI or handle of the aggregation FDO
+        profile_uri: Profile of the aggregation FDO
+        label: Label of the aggregation FDO
+        aggregates: Iterator of the IRIs or handles of the parts
+        conf: Config of the nanopubs, with the profile used to sign them
+        shard_size: Maximum number of parts in each shard nanopub
+        sign_workers: Number of signing processes, defaults to the number of CPUs.
+            Use 0 to sign in the current process.
+        max_pending: Maximum number of shards being signed or waiting to be yielded,
+            defaults to twice the number of signing processes.
+    """
+    if conf is None:
+        conf = NanopubConf()
+    if not 0 < shard_size <= MAX_PARTS_PER_SHARD:
+        raise ValueError(f"The shard size must be between 1 and {MAX_PARTS_PER_SHARD}")
+    fdo_iri = _to_iri(fdo_iri)
+    parts = (to_aggregate_iri(agg) for agg in aggregates)
+    # Handles are expanded, to not publish them as relative IRIs
+    record = FdoRecord(profile_uri=_to_iri(profile_uri), label=label)
+
+    first = list(islice(parts, shard_size + 1))
+    if len(first) <= shard_size:
+        # All the parts fit in the FDO nanopub
+        for part in first:
+            record.add_aggregate(part)
+        np = FdoNanopub.create_with_fdo_iri(record, fdo_iri, conf=conf)
+        np.sign()
+        yield np
+        return
+
+    np = FdoNanopub.create_with_fdo_iri(record, fdo_iri, conf=conf)
+    max_shards = (MAX_TRIPLES_PER_NANOPUB - len(np.rdf)) // 2
+    all_parts = list(islice(chain(first, parts), max_shards * shard_size + 1))
+    if len(all_parts) > max_shards * shard_size:
+        raise ValueError(
+            f"Aggregation FDO {fdo_iri} has more than {max_shards * shard_size} parts, which is more than "
+            f"its FDO nanopub can link to: {max_shards} shards of {shard_size} parts"
+        )
+
+    shard_conf = deepcopy(conf)
+    shard_conf.add_prov_generated_time = False
+    shard_uris: List[str] = []
+    count = 0
+
+    def complete(shard: Nanopub) -> Nanopub:
+        log.info(f"Signed shard {len(shard_uris) + 1} of aggregation FDO {fdo_iri}: {shard.source_uri}")
+        shard_uris.append(shard.source_uri)
+        return shard
+
+    with SigningPipeline(sign_workers, max_pending) as pipeline:
+        for start in range(0, len(all_parts), shard_size):
+            buffer = all_parts[start:start + shard_size]
+            pipeline.submit(_sign_shard, shard_conf, fdo_iri, label, buffer, count)
+            count += len(buffer)
+            for _, shard in pipeline.ready():
+                yield complete(shard)
+        for _, shard in pipeline.drain():
+            yield complete(shard)
+
+    for shard_uri in shard_uris:
+        np.assertion.add((fdo_iri, HAS_SHARD, URIRef(shard_uri)))
+        np.assertion.add((fdo_iri, FDOF.hasMetadata, URIRef(shard_uri)))
+    np.sign()
+    log.info(f"Signed aggregation FDO {fdo_iri} with {count} parts in {len(shard_uris)} shards: {np.source_uri}")
+    yield np
+
+
+def iter_aggregation_parts(
+    fdo_np: Union[Nanopub, str],
+    conf: Optional[NanopubConf] = None,
+    workers: int = SHARD_FETCH_WORKERS,
+) -> Iterator[URIRef]:
+    """Iterate over the parts of an aggregation FDO, fetching its shard nanopubs lazily.
+
+    The parts held by the FDO nanopub are given first, then the parts of each shard nanopub
+    created by `iter_sharded_aggregation`, shard after shard. Only the metadata records that
+    the FDO requires (`HAS_SHARD`) are read as shards, not its other ones. Up to `workers` shards are fetched ahead
+    of the one being read, so only a few shards are in memory at the same time. Works as well
+    for a regular aggregation FDO, which has no shard.
+
+    Args:
+        fdo_np: The FDO nanopub, or its URI
+        conf: Config used to fetch the nanopubs, like for `resolve_in_nanopub_network`
+        workers: Number of shard nanopubs fetched at the same time
+    """
+    if isinstance(fdo_np, Nanopub):
+        np_uri = fdo_np.source_uri or fdo_np.metadata.np_uri
+        assertion = fdo_np.assertion
+    else:
+        np_uri = fdo_np
+        assertion = fetch_assertion(fdo_np, conf)
+    fdo_iri = get_fdo_uri_from_fdo_record(assertion)
+    if fdo_iri is None:
+        raise ValueError(f"No FDO found in the assertion of {np_uri}")
+
+    yield from assertion.objects(fdo_iri, DCTERMS.hasPart)
+    shard_uris = [str(o) for o in get_shard_uris(assertion, fdo_iri)]
+    if not shard_uris:
+        return
+
+    def fetch_parts(shard_uri: str) -> List[URIRef]:
+        return list(fetch_assertion(shard_uri, conf).objects(fdo_iri, DCTERMS.hasPart))
+
+    pool = ThreadPoolExecutor(max_workers=max(1, min(workers, len(shard_uris))))
+    pending: Deque[Future] = deque()
+    shards = iter(shard_uris)
+    try:
+        for shard_uri in islice(shards, workers):
+            pending.append(pool.submit(fetch_parts, shard_uri))
+        while pending:
+            parts = pending.popleft().result()
+            for shard_uri in islice(shards, 1):
+                pending.append(pool.submit(fetch_parts, shard_uri))
+            yield from parts
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def retrieve_aggregation_record(
+    fdo_np: Union[Nanopub, str],
+    conf: Optional[NanopubConf] = None,
+    workers: int = SHARD_FETCH_WORKERS,
+) -> FdoRecord:
+    """Get the FdoRecord of an aggregation FDO, with the parts of all its shard nanopubs.
+
+    Args:
+        fdo_np: The FDO nanopub, or its URI
+        conf: Config used to fetch the nanopubs
+        workers: Number of shard nanopubs fetched at the same time
+    """
+    if not isinstance(fdo_np, Nanopub):
+        fdo_np = Nanopub(fdo_np, conf=conf)
+    assertion = Graph()
+    for triple in fdo_np.assertion.triples((None, None, None)):
+        if triple[1] != DCTERMS.hasPart:
+            assertion.add(triple)
+    record = FdoRecord(assertion=assertion)
+    for part in iter_aggregation_parts(fdo_np, conf=conf, workers=workers):
+        record.add_aggregate(part)
+    return record
@@ -0,0 +1,155 @@
+"""
+This module holds functions to convert many handle records to FDO nanopubs at once.
+
+The metadata of the handles is fetched from the Handle API by a pool of threads sharing
+keep-alive connections, the nanopubs are built and signed in a pool of processes, and they can
+be uploaded to a registry as soon as they are signed.
+"""
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import asdict, dataclass
+from typing import Deque, Iterable, Iterator, Optional, Tuple
+
+import requests
+
+from nanopub.bulk import DEFAULT_BACKOFF, DEFAULT_MAX_RETRIES, make_publish_session, make_sign_pool, upload_signed
+from nanopub.definitions import TEST_NANOPUB_REGISTRY_URL
+from nanopub.fdo.fdo_nanopub import FdoNanopub
+from nanopub.fdo.retrieve import resolve_handle_metadata_cached
+from nanopub.nanopub_conf import NanopubConf
+from nanopub.profile import ProfileError
+from nanopub.query_cache import MemoryQueryCache, QueryCache, SingleFlight
+from nanopub.utils import log
+
+HANDLE_WORKERS = 16
+"""Default number of handles converted at the same time"""
+
+_sign_lock = threading.Lock()
+"""Lets one conversion thread at a time build and sign its nanopub when sign_workers is 0,
+since FdoNanopub reads the metadata of the nanopub back with SPARQL queries while signing"""
+
+
+@dataclass
+class HandleNanopub:
+    """Outcome of the conversion of one handle by `handles_to_nanopubs`.
+
+    Args:
+        handle: The converted handle
+        source_uri: Trusty URI of the signed FDO nanopub, None if it could not be signed
+        rdf: The signed nanopub serialized as trig
+        published: True if the registry accepted the nanopub
+        attempts: Number of upload attempts it took to publish the nanopub
+        error: Description of the error if the handle could not be converted or published
+    """
+
+    handle: str
+    source_uri: Optional[str] = None
+    rdf: Optional[str] = None
+    published: bool = False
+    attempts: int = 0
+    error: Optional[str] = None
+
+    dict = asdict
+
+
+def sign_handle_nanopub(handle: str, metadata: dict, conf: NanopubConf) -> Tuple[str, str]:
+    """Build and sign the FDO nanopub of a handle from its metadata.
+
+    This function runs in the signing processes of `handles_to_nanopubs`, which is why the
+    nanopub is returned serialized.
+
+    Returns:
+        tuple of: the trusty URI of the signed nanopub, the signed nanopub serialized as trig.
+    """
+    np = FdoNanopub.from_handle_metadata(handle, metadata, conf=conf)
+    np.sign()
+    return np.source_uri, np.rdf.serialize(format="trig")
+
+
+def handles_to_nanopubs(
+    handles: Iterable[str],
+    conf: NanopubConf,
+    publish: bool = False,
+    workers: int = HANDLE_WORKERS,
+    sign_workers: Optional[int] = None,
+    max_pending: Optional[int] = None,
+    cache: Optional[QueryCache] = None,
+    max_retries: int = DEFAULT_MAX_RETRIES,
+    backoff: float = DEFAULT_BACKOFF,
+    session: Optional[requests.Session] = None,
+) -> Iterator[HandleNanopub]:
+    """Convert many handles to signed FDO nanopubs, like `FdoNanopub.handle_to_nanopub`, and optionally publish them.
+
+    Up to `workers` handles are processed at the same time: their metadata is fetched through a
+    pooled session and a cache, once for duplicated handles, their nanopub is built and signed
+    in a pool of processes, and uploaded to the server of the conf with retries when `publish`
+    is set. At most `max_pending` handles are read from the input and not yielded yet, so it can
+    be a generator over hundreds of thousands of handles.
+
+    Args:
+        handles: The handles to convert
+        conf: Config of the nanopubs, with the profile used to sign them and the server to publish to
+        publish: Upload the nanopubs once signed
+        workers: Number of handles processed at the same time
+        sign_workers: Number of signing processes, defaults to the number of CPUs.
+            Use 0 to sign in the current process.
+        max_pending: Maximum number of handles read from the input and not yielded yet,
+            defaults to twice the number of workers
+        cache: Cache of the handle metadata, defaults to an in-memory one with a TTL of 5 minutes
+        max_retries: Number of times an upload is retried after a transient error
+        backoff: Delay in seconds before the first upload retry, doubled after each attempt
+        session: Session used for the Handle API requests and the uploads, by default one is
+            created with a connection pool of size `workers`
+
+    Returns:
+        an iterator over the HandleNanopub of each handle, in the order of the handles.
+    """
+    if conf.profile is None:
+        raise ProfileError("Profile not available, cannot sign the nanopubs")
+    use_server = TEST_NANOPUB_REGISTRY_URL if conf.use_test_server else conf.use_server
+    cache = cache if cache is not None else MemoryQueryCache(ttl=300)
+    session = session or make_publish_session(workers)
+    max_pending = max_pending or 2 * workers
+    pool = ThreadPoolExecutor(max_workers=workers)
+    sign_pool = make_sign_pool(sign_workers)
+
+    # Duplicated handles being processed at the same time share one request
+    single_flight = SingleFlight()
+
+    def fetch_metadata(handle: str) -> dict:
+        return single_flight.do(handle, lambda: resolve_handle_metadata_cached(handle, cache, session=session))
+
+    def convert(handle: str) -> HandleNanopub:
+        result = HandleNanopub(handle)
+        try:
+            metadata = fetch_metadata(handle)
+            if sign_pool is not None:
+                result.source_uri, result.rdf = sign_pool.submit(sign_handle_nanopub, handle, metadata, conf).result()
+            else:
+                with _sign_lock:
+                    result.source_uri, result.rdf = sign_handle_nanopub(handle, metadata, conf)
+            if publish:
+                result.attempts = upload_signed(
+                    result.rdf, use_server, session,
+                    max_retries=max_retries, backoff=backoff, compress=conf.compress_uploads,
+                )
+                result.published = True
+                log.info(f"Published {result.source_uri} for handle {handle}")
+        except Exception as e:
+            result.error = f"{type(e).__name__}: {e}"
+        return result
+
+    pending: Deque[Future] = deque()
+    try:
+        for handle in handles:
+            pending.append(pool.submit(convert, str(handle)))
+            while pending and (len(pending) >= max_pending or pending[0].done()):
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+        if sign_pool is not None:
+            sign_pool.shutdown(wait=True, cancel_futures=True)
+        pool.shutdown(wait=True)
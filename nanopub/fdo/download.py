@@ -0,0 +1,261 @@
+"""
+This module holds functions to download the content of FDOs, i.e. the files their data references
+(fdof:isMaterializedBy) point to.
+
+Content is streamed in chunks to files or to caller-supplied sinks, several references are
+downloaded at the same time, interrupted downloads are resumed with HTTP range requests, and
+content whose URL carries a trusty hash (FA module) is verified while it is downloaded.
+"""
+import hashlib
+import os
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import BinaryIO, Callable, Dict, Iterable, List, Optional, Union
+from urllib.parse import unquote, urlparse
+
+import requests
+from rdflib import URIRef
+
+from nanopub.fdo.retrieve import resolve_id
+from nanopub.trustyuri import TrustyUriUtils
+from nanopub.utils import log
+
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+"""Size of the chunks in which the content is streamed, in bytes"""
+
+DOWNLOAD_WORKERS = 4
+"""Default number of data references downloaded at the same time"""
+
+DOWNLOAD_TIMEOUT = 60
+"""Timeout in seconds to connect to a server and between two received chunks"""
+
+
+@dataclass
+class ContentDownload:
+    """Outcome of the download of one data reference by `download_content`.
+
+    Args:
+        url: URL of the downloaded content
+        path: Path of the downloaded file, None when written to a sink
+        size: Total number of bytes of the content
+        resumed_from: Number of bytes already downloaded by a previous attempt
+        verified: True if the content matches the trusty hash of its URL, None if the URL has none
+        error: Description of the error if the download failed
+    """
+
+    url: str
+    path: Optional[Path] = None
+    size: int = 0
+    resumed_from: int = 0
+    verified: Optional[bool] = None
+    error: Optional[str] = None
+
+    dict = asdict
+
+
+def trusty_file_hash(url: str) -> Optional[str]:
+    """Return the trusty hash of a URL if it identifies a file (FA module), None otherwise."""
+    tail = TrustyUriUtils.get_trustyuri_tail(url)
+    return tail if tail.startswith("FA") and len(tail) == 45 else None
+
+
+def _file_name(url: str) -> str:
+    name = unquote(urlparse(url).path.rstrip("/").rsplit("/", 1)[-1])
+    return name or hashlib.sha256(url.encode("utf-8")).hexdigest()
+
+
+def _file_names(urls: List[str]) -> Dict[str, str]:
+    """Name of the file of each URL, the names shared by several URLs being suffixed with a hash of the URL.
+
+    Names are compared ignoring case, for case-insensitive file systems. The suffix only
+    depends on the URL, so the name of a URL is the same as long as the other URLs are.
+    """
+    names = {url: _file_name(url) for url in urls}
+    counts = Counter(name.lower() for name in names.values())
+    for url, name in names.items():
+        if counts[name.lower()] > 1:
+            stem, dot, suffix = name.partition(".")
+            names[url] = f"{stem}-{hashlib.sha256(url.encode('utf-8')).hexdigest()[:8]}{dot}{suffix}"
+    return names
+
+
+def _hash_file(path: Path, digest, chunk_size: int) -> None:
+    """Update the digest with the content of a file, read by chunks."""
+    with open(path, "rb") as f:
+        while chunk := f.read(chunk_size):
+            digest.update(chunk)
+
+
+def _download(
+    url: str,
+    path: Optional[Path],
+    sink: Optional[Callable[[str], BinaryIO]],
+    session: requests.Session,
+    chunk_size: int,
+    resume: bool,
+    max_retries: int,
+) -> ContentDownload:
+    result = ContentDownload(url, path=path)
+    expected_hash = trusty_file_hash(url)
+    digest = hashlib.sha256()
+
+    if path is not None and resume and path.exists():
+        # Content downloaded by a previous call is only checked
+        result.size = result.resumed_from = path.stat().st_size
+        if expected_hash:
+            _hash_file(path, digest, chunk_size)
+            result.verified = "FA" + TrustyUriUtils.get_base64(digest.digest()) == expected_hash
+            if not result.verified:
+                result.error = f"Content of {path} does not match the trusty hash of {url}"
+        return result
+
+    part_path = path.with_name(path.name + ".part") if path is not None else None
+    offset = 0
+    if part_path is not None and resume and part_path.exists():
+        offset = result.resumed_from = part_path.stat().st_size
+        if expected_hash:
+            _hash_file(part_path, digest, chunk_size)
+
+    out = None
+    attempts = 0
+    try:
+        out = open(part_path, "ab" if offset else "wb") if part_path is not None else sink(url)
+        while True:
+            headers = {"Accept-Encoding": "identity"}
+            if offset:
+                headers["Range"] = f"bytes={offset}-"
+            try:
+                with session.get(url, headers=headers, stream=True, timeout=DOWNLOAD_TIMEOUT) as r:
+                    if offset and r.status_code == 416:
+                        # Nothing left to download
+                        break
+                    r.raise_for_status()
+                    if offset and r.status_code != 206:
+                        if part_path is None:
+                            raise IOError("the server does not support range requests, cannot resume the download")
+                        # The server ignored the range, start over
+                        log.info(f"Range requests not supported for {url}, downloading it again")
+                        out.seek(0)
+                        out.truncate()
+                        offset = 0
+                        digest = hashlib.sha256()
+                    for chunk in r.iter_content(chunk_size=chunk_size):
+                        out.write(chunk)
+                        digest.update(chunk)
+                        offset += len(chunk)
+                break
+            except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError) as e:
+                attempts += 1
+                if attempts > max_retries:
+                    raise
+                log.info(f"Download of {url} interrupted at {offset} bytes, resuming: {e}")
+    except Exception as e:
+        result.error = f"Could not download {url}: {e}"
+        return result
+    finally:
+        result.size = offset
+        if part_path is not None and out is not None:
+            out.close()
+            if result.error and offset == 0:
+                part_path.unlink()
+
+    if expected_hash:
+        result.verified = "FA" + TrustyUriUtils.get_base64(digest.digest()) == expected_hash
+        if not result.verified:
+            result.error = f"Downloaded content does not match the trusty hash of {url}"
+            if part_path is not None:
+                part_path.unlink()
+            return result
+    if part_path is not None:
+        os.replace(part_path, path)
+    return result
+
+
+def download_content(
+    urls: Iterable[Union[str, URIRef]],
+    destination: Optional[Union[Path, str]] = None,
+    sink: Optional[Callable[[str], BinaryIO]] = None,
+    workers: int = DOWNLOAD_WORKERS,
+    chunk_size: int = DOWNLOAD_CHUNK_SIZE,
+    resume: bool = True,
+    max_retries: int = 3,
+    session: Optional[requests.Session] = None,
+) -> List[ContentDownload]:
+    """Download content by streaming it in chunks, several URLs at the same time.
+
+    Each URL is either saved in the destination directory, under the last segment of its path,
+    or written to the binary file object returned by `sink(url)`. When several URLs have the
+    same last segment, e.g. `https://a/x/data.csv` and `https://b/y/data.csv`, a short hash of
+    the URL is added to their file names, like `data-1f2e3d4c.csv`. Duplicated URLs are only
+    downloaded once. Files are first written with
+    a `.part` suffix, which is removed once the download is complete and verified. With `resume`,
+    files already in the destination are not downloaded again, and the download of `.part`
+    files is resumed with a range request. Interrupted downloads are also resumed, up to
+    `max_retries` times.
+
+    When a URL carries a trusty hash of a file (FA module), the content is hashed while it is
+    downloaded, and it is rejected if it does not match.
+
+    Args:
+        urls: URLs of the content to download
+        destination: Directory where the files are saved
+        sink: Function returning the binary file object where the content of a URL is written,
+            used instead of a destination directory. The caller closes the file objects.
+        workers: Number of URLs downloaded at the same time
+        chunk_size: Size of the chunks in which the content is streamed
+        resume: Resume downloads from the files and `.part` files found in the destination
+        max_retries: Number of times an interrupted download is resumed
+        session: Session used for the requests
+
+    Returns:
+        the ContentDownload of each URL, in the same order.
+    """
+    if (destination is None) == (sink is None):
+        raise ValueError("Provide either a destination directory or a sink")
+    urls = [str(url) for url in urls]
+    unique = list(dict.fromkeys(urls))
+    if destination is not None:
+        destination = Path(destination)
+        destination.mkdir(parents=True, exist_ok=True)
+        # Names are given before starting, so that two downloads never write to the same file
+        names = _file_names(unique)
+    session = session or requests.Session()
+
+    def download(url: str) -> ContentDownload:
+        path = destination / names[url] if destination is not None else None
+        return _download(url, path, sink, session, chunk_size, resume, max_retries)
+
+    if not urls:
+        return []
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(unique)))) as pool:
+        downloads = dict(zip(unique, pool.map(download, unique)))
+    return [downloads[url] for url in urls]
+
+
+def download_content_from_id(
+    iri_or_handle: str,
+    destination: Optional[Union[Path, str]] = None,
+    sink: Optional[Callable[[str], BinaryIO]] = None,
+    **kwargs,
+) -> List[ContentDownload]:
+    """Download the content of an FDO, streaming it to files or sinks instead of loading it in memory.
+
+    Unlike `retrieve_content_from_id`, the data references of the FDO are downloaded
+    concurrently, with resume and trusty hash verification, see `download_content`.
+
+    Args:
+        iri_or_handle: IRI or handle of the FDO
+        destination: Directory where the files are saved
+        sink: Function returning the binary file object where the content of a URL is written
+        kwargs: Other arguments of `download_content`, e.g. workers or resume
+
+    Returns:
+        the ContentDownload of each data reference of the FDO.
+    """
+    content_ref = resolve_id(iri_or_handle).get_data_ref()
+    if not content_ref:
+        raise ValueError("FDO has no file / DataRef (isMaterializedBy)")
+    urls = content_ref if isinstance(content_ref, list) else [content_ref]
+    return download_content(urls, destination=destination, sink=sink, **kwargs)
@@ -1,7 +1,7 @@
 from nanopub import Nanopub
 import json
 import rdflib
-from typing import Optional
+from typing import Iterable, List, Optional
 from rdflib.namespace import RDF, RDFS, DCTERMS
 from nanopub.namespaces import HDL, FDOF, NPX, FDOC
 from nanopub.constants import FDO_PROFILE_HANDLE, FDO_DATA_REF_HANDLE, FDO_DATA_REFS_HANDLE
@@ -19,6 +19,15 @@ def to_hdl_uri(value):
         raise ValueError(f"Invalid value: {value}")
 
 
+def to_aggregate_iri(value: rdflib.URIRef | str) -> rdflib.URIRef:
+    if looks_like_url(value):
+        return rdflib.URIRef(value)
+    elif looks_like_handle(value):
+        return handle_to_iri(value)
+    else:
+        raise ValueError(f"Invalid aggregate format: {value}")
+
+
 class FdoNanopub(Nanopub):
     """
     EXPERIMENTAL: This class is experimental and may change or be removed in future versions.
@@ -50,6 +59,11 @@ class FdoNanopub(Nanopub):
         # To prevent circular import issue
         from nanopub.fdo.retrieve import resolve_handle_metadata
         data = resolve_handle_metadata(handle)
+        return cls.from_handle_metadata(handle, data, **kwargs)
+
+    @classmethod
+    def from_handle_metadata(cls, handle: str, data: dict, **kwargs) -> "FdoNanopub":
+        """Build the nanopub of a handle from its metadata, as returned by the Handle API."""
         values = data.get("values", [])
 
         label = None
@@ -113,15 +127,10 @@ class FdoNanopub(Nanopub):
             np.add_fdo_data_ref(data_ref)
 
         skip_preds = {RDFS.label, DCTERMS.conformsTo, FDOC.hasFdoProfile, FDOF.isMaterializedBy}
-        for predicate, obj in fdo_record.tuples.items():
+        for predicate, obj in fdo_record.tuples.predicate_objects():
             if predicate in skip_preds:
                 continue
-
-            if isinstance(obj, list):
-                for o in obj:
-                    np.assertion.add((fdo_iri, predicate, o))
-            else:
-                np.assertion.add((fdo_iri, predicate, obj))
+            np.assertion.add((fdo_iri, predicate, obj))
 
         return np
 
@@ -140,17 +149,34 @@ class FdoNanopub(Nanopub):
             raise ValueError("Aggregate FDOs cannot have a dataRef (isMaterializedBy)")
 
         for agg in aggregates:
-            if looks_like_url(agg):
-                iri = rdflib.URIRef(agg)
-            elif looks_like_handle(agg):
-                iri = handle_to_iri(agg)
-            else:
-                raise ValueError(f"Invalid aggregate format: {agg}")
-            record.add_aggregate(iri)
+            record.add_aggregate(to_aggregate_iri(agg))
 
         npub = cls.create_with_fdo_iri(record, fdo_iri, conf=conf)
 
         return npub
+
+    @classmethod
+    def create_sharded_aggregation_fdo(cls,
+                    fdo_iri: rdflib.URIRef | str,
+                    profile_uri: str,
+                    label: str,
+                    aggregates: Iterable[str],
+                    conf: Optional[NanopubConf] = None,
+                    sign_workers: Optional[int] = 0,
+                    ) -> List[Nanopub]:
+        """
+        Create an aggregation FDO whose parts can exceed the size of a nanopub.
+        The parts are split in shard nanopubs linked from the FDO nanopub, see
+        `nanopub.fdo.aggregation.iter_sharded_aggregation`.
+
+        Returns:
+            the signed nanopubs to publish, the last one being the FDO nanopub.
+        """
+        # To prevent circular import issue
+        from nanopub.fdo.aggregation import iter_sharded_aggregation
+        return list(iter_sharded_aggregation(
+            fdo_iri, profile_uri, label, aggregates, conf=conf, sign_workers=sign_workers
+        ))
     
     @classmethod
     def create_derivation_fdo(cls,
@@ -1,10 +1,31 @@
-from typing import Iterator
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from typing import Iterable, Iterator, List, Optional, Tuple
 from nanopub.client import NanopubClient
+from nanopub.query_cache import QueryCache
+
+FDO_QUERY_WORKERS = 8
+"""Default number of FDO queries run at the same time by `FdoQuery.run_many`"""
+
+FDO_QUERY_CHUNK_SIZE = 50
+"""Default number of results in a chunk of `FdoQuery.chunks` and `FdoQuery.chunk`"""
+
+
+def fdo_result_id(result: dict) -> str:
+    """ID of the FDO (or thing) a query result is about, falling back to the nanopub URI."""
+    return result.get("fdo") or result.get("thing") or result["np"]
 
 
 class FdoQuery:
     """
     A utility class to query FDO-specific endpoints, using a NanopubClient instance.
+
+    Args:
+        client: Client used to run the queries
+        cache: Cache of the query results, e.g. MemoryQueryCache or DiskQueryCache. Results are
+            fetched once per query and parameters, so the chunks of a query are served from it.
+            Default is None, using the cache of the client if it has one.
+        workers: Number of queries run at the same time by `run_many`
     """
 
     _endpoints = {
@@ -14,29 +35,123 @@ class FdoQuery:
         "get_favorites": "RAsyc6zFFnE8mblnDfdCCNRsrcN1CSCBDW9I4Ppidgk9g/get-favorite-things",
     }
 
-    def __init__(self, client: NanopubClient):
+    def __init__(self, client: NanopubClient, cache: Optional[QueryCache] = None, workers: int = FDO_QUERY_WORKERS):
         self.client = client
+        self.cache = cache
+        self.workers = workers
+
+    def _search(self, endpoint: str, params: dict) -> Iterator[dict]:
+        if self.cache is None:
+            return self.client._search(endpoint, params)
+        return self._search_cached(endpoint, params)
+
+    def _search_cached(self, endpoint: str, params: dict) -> Iterator[dict]:
+        results = self.cache.get_or_fetch(
+            self.client._cache_key(endpoint, params),
+            lambda: list(self.client._search(endpoint, params)),
+        )
+        # Copy the cached results so callers cannot alter the content of the cache
+        for result in results:
+            yield dict(result)
 
     def text_search(self, query: str) -> Iterator[dict]:
         """Full-text search on FDO nanopublications."""
         if not query:
             raise ValueError("Query string must not be empty")
-        return self.client._search(self._endpoints["text_search"], {"query": query})
+        return self._search(self._endpoints["text_search"], {"query": query})
 
     def find_by_ref(self, refid: str) -> Iterator[dict]:
         """Find FDOs that refer to the given PID/handle."""
         if not refid:
             raise ValueError("refid must not be empty")
-        return self.client._search(self._endpoints["find_by_ref"], {"refid": refid})
+        return self._search(self._endpoints["find_by_ref"], {"refid": refid})
 
     def get_feed(self, creator: str) -> Iterator[dict]:
         """Get FDOs published by the given creator (ORCID URL)."""
         if not creator:
             raise ValueError("creator must not be empty")
-        return self.client._search(self._endpoints["get_feed"], {"creator": creator})
+        return self._search(self._endpoints["get_feed"], {"creator": creator})
 
     def get_favorite_things(self, creator: str) -> Iterator[dict]:
         """Get favorite things (cito:likes) of the given creator."""
         if not creator:
             raise ValueError("creator must not be empty")
-        return self.client._search(self._endpoints["get_favorites"], {"creator": creator})
+        return self._search(self._endpoints["get_favorites"], {"creator": creator})
+
+    def _run(self, query: str, value: str) -> Iterator[dict]:
+        """Run one of the query methods, given by name, e.g. ("get_feed", "https://orcid.org/...")."""
+        if query not in ("text_search", "find_by_ref", "get_feed", "get_favorite_things"):
+            raise ValueError(f"Unknown FDO query: {query}")
+        return getattr(self, query)(value)
+
+    def chunks(self, query: str, value: str, chunk_size: int = FDO_QUERY_CHUNK_SIZE) -> Iterator[List[dict]]:
+        """Iterate over the results of a query by chunks of `chunk_size` results.
+
+        The query servers do not page the FDO queries: all the results are requested at once,
+        and cut in chunks on the client side. The chunks are read lazily from the response, so
+        stopping after the first chunks does not convert the other results.
+
+        Args:
+            query: Name of the query method, e.g. "text_search" or "get_feed"
+            value: Argument of the query method
+            chunk_size: Number of results in each chunk
+        """
+        if chunk_size < 1:
+            raise ValueError("chunk_size must be at least 1")
+        results = self._run(query, value)
+        while chunk := list(islice(results, chunk_size)):
+            yield chunk
+
+    def chunk(self, query: str, value: str, index: int = 1, chunk_size: int = FDO_QUERY_CHUNK_SIZE) -> List[dict]:
+        """Get one chunk of the results of a query, chunks being numbered from 1.
+
+        Like `chunks`, the chunk is cut from all the results on the client side. Without a
+        cache, each call runs the whole query again: use a cache to get several chunks of a
+        query, or `chunks` to go through all of them.
+
+        Args:
+            query: Name of the query method, e.g. "text_search" or "get_feed"
+            value: Argument of the query method
+            index: Number of the chunk
+            chunk_size: Number of results in each chunk
+        """
+        if index < 1 or chunk_size < 1:
+            raise ValueError("index and chunk_size must be at least 1")
+        start = (index - 1) * chunk_size
+        return list(islice(self._run(query, value), start, start + chunk_size))
+
+    def run_many(self, queries: Iterable[Tuple[str, str]], dedupe: bool = True) -> List[dict]:
+        """Run several queries concurrently and merge their results, most recent first.
+
+        Identical queries are only sent once. With `dedupe`, the results about the same FDO
+        (see `fdo_result_id`) are merged and only the most recent one is kept.
+
+        Args:
+            queries: (query method name, argument) tuples, e.g. [("get_feed", orcid), ("text_search", "covid")]
+            dedupe: Keep one result per FDO
+
+        Returns:
+            the results of all the queries, sorted by date, most recent first.
+        """
+        unique = list(dict.fromkeys((query, value) for query, value in queries))
+        # Invalid queries are rejected before any is sent
+        searches = [self._run(query, value) for query, value in unique]
+        if not searches:
+            return []
+        with ThreadPoolExecutor(max_workers=max(1, min(self.workers, len(searches)))) as pool:
+            merged = [result for results in pool.map(list, searches) for result in results]
+        merged.sort(key=lambda result: result.get("date") or "", reverse=True)
+        if not dedupe:
+            return merged
+        seen = set()
+        deduped = []
+        for result in merged:
+            fdo_id = fdo_result_id(result)
+            if fdo_id not in seen:
+                seen.add(fdo_id)
+                deduped.append(result)
+        return deduped
+
+    def get_feeds(self, creators: Iterable[str], dedupe: bool = True) -> List[dict]:
+        """Get the FDOs published by any of the given creators, most recent first, see `run_many`."""
+        return self.run_many([("get_feed", creator) for creator in creators], dedupe=dedupe)
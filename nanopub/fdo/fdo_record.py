@@ -1,14 +1,158 @@
+from collections.abc import MutableMapping
 from rdflib import Graph, URIRef, Literal
-from typing import Optional, Union, List
+from typing import Any, Dict, Iterable, Iterator, Optional, Tuple, Union, List
 from rdflib.namespace import RDFS, DCTERMS, PROV
 from nanopub.namespaces import HDL, FDOF, FDOC
 
 
+class FdoValues(list):
+    """
+    The values of a predicate having several values in an FdoProperties.
+
+    It is a list whose changes are written back to the properties, like the lists of the
+    dict FdoProperties replaces. The values stay deduplicated.
+    """
+
+    def __init__(self, properties: "FdoProperties", predicate: URIRef):
+        super().__init__(properties.objects(predicate))
+        self._properties = properties
+        self._predicate = predicate
+
+    def _write_back(self) -> None:
+        self._properties[self._predicate] = list(self)
+        super().__setitem__(slice(None), self._properties.objects(self._predicate))
+
+    def __setitem__(self, index, value):
+        super().__setitem__(index, value)
+        self._write_back()
+
+    def __delitem__(self, index):
+        super().__delitem__(index)
+        self._write_back()
+
+    def append(self, value):
+        if self._properties.add(self._predicate, value):
+            super().append(value)
+
+    def extend(self, values):
+        super().extend(values)
+        self._write_back()
+
+    def insert(self, index, value):
+        super().insert(index, value)
+        self._write_back()
+
+    def remove(self, value):
+        super().remove(value)
+        self._write_back()
+
+    def pop(self, index=-1):
+        value = super().pop(index)
+        self._write_back()
+        return value
+
+    def clear(self):
+        super().clear()
+        self._write_back()
+
+    def sort(self, **kwargs):
+        super().sort(**kwargs)
+        self._write_back()
+
+    def reverse(self):
+        super().reverse()
+        self._write_back()
+
+    def __iadd__(self, values):
+        self.extend(values)
+        return self
+
+    def __imul__(self, n):
+        super().__imul__(n)
+        self._write_back()
+        return self
+
+
+class FdoProperties(MutableMapping):
+    """
+    The values of the properties of an FdoRecord, by predicate.
+
+    The values of each predicate are kept in an insertion-ordered set, so adding a value is
+    O(1) whatever the number of values. Like the dict it replaces, getting a predicate gives
+    its value, or a list of its values when it has several (an FdoValues, changing it changes
+    the predicate), and setting a predicate to a value or a list of values replaces its
+    values. Use `add` and `objects` to work on the values directly.
+    """
+
+    def __init__(self, items: Optional[Union[Dict[URIRef, Any], Iterable[Tuple[URIRef, Any]]]] = None):
+        self._values: Dict[URIRef, Dict[Any, None]] = {}
+        self.version = 0
+        """Incremented on every change, to invalidate the views of the record"""
+        if items:
+            self.update(items)
+
+    def __getitem__(self, predicate: URIRef) -> Any:
+        values = self._values[predicate]
+        return next(iter(values)) if len(values) == 1 else FdoValues(self, predicate)
+
+    def __setitem__(self, predicate: URIRef, value: Any) -> None:
+        values = dict.fromkeys(value) if isinstance(value, list) else {value: None}
+        if values:
+            self._values[predicate] = values
+        else:
+            self._values.pop(predicate, None)
+        self.version += 1
+
+    def __delitem__(self, predicate: URIRef) -> None:
+        del self._values[predicate]
+        self.version += 1
+
+    def __iter__(self) -> Iterator[URIRef]:
+        return iter(self._values)
+
+    def __len__(self) -> int:
+        return len(self._values)
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({dict(self.items())!r})"
+
+    def add(self, predicate: URIRef, value: Any) -> bool:
+        """Add a value to a predicate, returning False if the predicate already had it."""
+        values = self._values.setdefault(predicate, {})
+        if value in values:
+            return False
+        values[value] = None
+        self.version += 1
+        return True
+
+    def objects(self, predicate: URIRef) -> List[Any]:
+        """The values of a predicate, in the order they were added."""
+        return list(self._values.get(predicate, ()))
+
+    def count(self, predicate: URIRef) -> int:
+        """The number of values of a predicate."""
+        return len(self._values.get(predicate, ()))
+
+    def predicate_objects(self) -> Iterator[Tuple[URIRef, Any]]:
+        """All the (predicate, value) pairs, in the order they were added."""
+        for predicate, values in self._values.items():
+            for value in values:
+                yield predicate, value
+
+    def copy(self) -> "FdoProperties":
+        new = FdoProperties()
+        new._values = {predicate: dict(values) for predicate, values in self._values.items()}
+        return new
+
+
 class FdoRecord:
     """
     EXPERIMENTAL: This class is experimental and may change or be removed in future versions.
 
     Can be initialized from an assertion graph OR from explicit params.
+
+    The properties are stored in `tuples`, an FdoProperties mapping. The graph of the record
+    is cached until the record changes.
     """
 
     def __init__(
@@ -20,7 +164,7 @@ class FdoRecord:
         dataref: Optional[Union[str, URIRef]] = None,
     ):
         self.id: Optional[str] = None
-        self.tuples: dict[URIRef, Union[Literal, URIRef]] = {}
+        self.tuples = FdoProperties()
         self.profile_uri: Optional[Union[str, URIRef]] = None
         
         if assertion:
@@ -28,24 +172,16 @@ class FdoRecord:
             for s, p, o in assertion:
                 if self.id is None:
                     self.id = s
-                if str(p) == str(FDOC.profile):
+                if p == FDOC.profile:
                     self.set_profile(str(o))
                     
-                if str(p) == str(DCTERMS.conformsTo) or str(p) == str(FDOC.hasFdoProfile):
+                if p == DCTERMS.conformsTo or p == FDOC.hasFdoProfile:
                     self.profile_uri = o
 
                 if p == FDOF.isMaterializedBy:
                     self.set_data_ref(o)
                 else:
-                    existing = self.tuples.get(p)
-                    if existing is None:
-                        self.tuples[p] = o
-                    elif isinstance(existing, list):
-                        if o not in existing:
-                            existing.append(o)
-                    else:
-                        if existing != o:
-                            self.tuples[p] = [existing, o]
+                    self.tuples.add(p, o)
             if self.profile_uri is None:
                 raise ValueError("Missing required FDO profile statement")
 
@@ -66,6 +202,32 @@ class FdoRecord:
         if profile_uri:
             self.set_profile(profile_uri) # override if given explicitly
 
+    @classmethod
+    def from_assertions(
+        cls,
+        assertions: Iterable[Graph],
+        profile_uri: Optional[Union[str, URIRef]] = None,
+    ) -> List["FdoRecord"]:
+        """Build the records of many assertion graphs, e.g. of the nanopubs returned by a query.
+
+        Args:
+            assertions: The assertion graphs, one per FDO
+            profile_uri: Profile of all the records, overriding the one of the graphs
+
+        Returns:
+            the records, in the order of the graphs.
+        """
+        return [cls(assertion=assertion, profile_uri=profile_uri) for assertion in assertions]
+
+    @property
+    def tuples(self) -> FdoProperties:
+        return self._tuples
+
+    @tuples.setter
+    def tuples(self, value: Union[FdoProperties, Dict[URIRef, Any]]) -> None:
+        self._tuples = value if isinstance(value, FdoProperties) else FdoProperties(value)
+        self._graph: Optional[Graph] = None
+
     def __str__(self) -> str:
         label = self.get_label() or "No label"
         profile = self.get_profile() or "No profile"
@@ -83,21 +245,19 @@ class FdoRecord:
         if not self.id:
             raise ValueError("FDO ID is not set")
         subject = URIRef(f"https://hdl.handle.net/{self.id}")
-        triples = []
-        for p, o in self.tuples.items():
-            if isinstance(o, list):
-                for item in o:
-                    triples.append((subject, p, item))
-            else:
-                triples.append((subject, p, o))
-        return triples
-
+        return [(subject, p, o) for p, o in self.tuples.predicate_objects()]
 
     def get_graph(self) -> Graph:
-        g = Graph()
-        for s, p, o in self.get_statements():
-            g.add((s, p, o))
-        return g
+        """
+        The graph of the record. It is cached until the ID or the properties of the record
+        change, copy it before modifying it.
+        """
+        key = (self.id, self.tuples.version)
+        if self._graph is None or self._graph_key != key:
+            graph = Graph()
+            graph.addN((s, p, o, graph) for s, p, o in self.get_statements())
+            self._graph, self._graph_key = graph, key
+        return self._graph
 
     def get_profile(self) -> Optional[Union[str, URIRef]]:
         if self.profile_uri:
@@ -109,16 +269,12 @@ class FdoRecord:
         return None
 
     def get_data_ref(self) -> Optional[Union[URIRef, List[URIRef]]]:
-        val = self.tuples.get(FDOF.isMaterializedBy)
+        uris = [URIRef(v) for v in self.tuples.objects(FDOF.isMaterializedBy)]
 
-        if val is None:
+        if not uris:
             return None
 
-        if isinstance(val, list):
-            uris = [URIRef(v) for v in val]
-            return uris[0] if len(uris) == 1 else uris
-
-        return URIRef(val)
+        return uris[0] if len(uris) == 1 else uris
 
     def get_label(self) -> Optional[str]:
         val = self.tuples.get(RDFS.label)
@@ -138,19 +294,7 @@ class FdoRecord:
         self.tuples[pred] = URIRef(uri)
 
     def set_data_ref(self, uri: Union[str, URIRef]) -> None:
-        uri_ref = URIRef(uri)
-        existing = self.tuples.get(FDOF.isMaterializedBy)
-
-        if existing is None:
-            self.tuples[FDOF.isMaterializedBy] = uri_ref
-
-        elif isinstance(existing, list):
-            if uri_ref not in existing:
-                existing.append(uri_ref)
-
-        else:
-            if existing != uri_ref:
-                self.tuples[FDOF.isMaterializedBy] = [existing, uri_ref]
+        self.tuples.add(FDOF.isMaterializedBy, URIRef(uri))
 
     def set_property(self, predicate: Union[str, URIRef], value: Union[str, URIRef, Literal]) -> None:
         pred = URIRef(predicate)
@@ -158,31 +302,14 @@ class FdoRecord:
         self.tuples[pred] = obj
         
     def add_aggregate(self, iri: URIRef):
-        existing = self.tuples.get(DCTERMS.hasPart)
-        if existing:
-            if isinstance(existing, list):
-                existing.append(iri)
-            else:
-                self.tuples[DCTERMS.hasPart] = [existing, iri]
-        else:
-            self.tuples[DCTERMS.hasPart] = iri
+        self.tuples.add(DCTERMS.hasPart, iri)
 
     def add_derivation(self, iri: URIRef):
         """
         Adds a prov:wasDerivedFrom triple to the record.
         Handles multiple values as a list.
         """
-        predicate = PROV.wasDerivedFrom
-        existing = self.tuples.get(predicate)
-
-        if existing:
-            if isinstance(existing, list):
-                if iri not in existing:
-                    existing.append(iri)
-            elif existing != iri:
-                self.tuples[predicate] = [existing, iri]
-        else:
-            self.tuples[predicate] = iri
+        self.tuples.add(PROV.wasDerivedFrom, iri)
 
     def copy(self) -> "FdoRecord":
         new_record = FdoRecord(
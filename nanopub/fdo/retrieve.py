@@ -1,15 +1,31 @@
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass
 import requests
 from nanopub import NanopubClient, Nanopub, NanopubConf
+from nanopub.definitions import NANOPUB_FETCH_FORMAT
 from nanopub.fdo.utils import looks_like_handle
 from nanopub.fdo.fdo_record import FdoRecord
 from nanopub.fdo import FdoNanopub
-from rdflib import RDF, URIRef, Graph
-from nanopub.namespaces import FDOF
-from typing import Tuple, Optional, Union, List
+from nanopub.nanopub import fetch_nanopub_response
+from nanopub.query_cache import MemoryQueryCache, QueryCache, SingleFlight, make_cache_key
+from nanopub.utils import MalformedNanopubError, log
+from rdflib import RDF, URIRef, Graph, Dataset
+from nanopub.namespaces import FDOF, NP
+from typing import Iterable, Tuple, Optional, Union, List
 
-def resolve_id(iri_or_handle: str, conf: Optional[NanopubConf] = None) -> FdoRecord:
+FDO_BY_ID_QUERY = "RAs0HI_KRAds4w_OOEMl-_ed0nZHFWdfePPXsDHf4kQkU/get-fdo-by-id"
+"""Query template finding the latest nanopub of an FDO from its ID"""
+
+RESOLVE_WORKERS = 16
+"""Default number of identifiers resolved at the same time by `resolve_many`"""
+
+def resolve_id(
+    iri_or_handle: str,
+    conf: Optional[NanopubConf] = None,
+    client: Optional[NanopubClient] = None,
+) -> FdoRecord:
     try:
-        np = resolve_in_nanopub_network(iri_or_handle, conf=conf)
+        np = resolve_in_nanopub_network(iri_or_handle, conf=conf, client=client)
         if np is not None:
             record = FdoRecord(assertion=np.assertion)
             return record
@@ -30,9 +46,18 @@ def resolve_id(iri_or_handle: str, conf: Optional[NanopubConf] = None) -> FdoRec
     raise ValueError(f"FDO not found: {iri_or_handle}")
 
 
-def resolve_in_nanopub_network(iri_or_handle: Union[str, URIRef], conf: Optional[NanopubConf] = None) -> Optional[Nanopub]:
-    query_id = "RAs0HI_KRAds4w_OOEMl-_ed0nZHFWdfePPXsDHf4kQkU"
-    endpoint = "get-fdo-by-id"
+def resolve_in_nanopub_network(
+    iri_or_handle: Union[str, URIRef],
+    conf: Optional[NanopubConf] = None,
+    client: Optional[NanopubClient] = None,
+) -> Optional[Nanopub]:
+    """Find the latest nanopub of an FDO in the nanopub network.
+
+    By default the query is sent to query.knowledgepixels.com, a client can be given to use
+    its query servers instead (e.g. a local server). The nanopub is fetched from the server
+    of the conf, if it is a custom one.
+    """
+    query_id, endpoint = FDO_BY_ID_QUERY.split("/")
     query_url = f"https://query.knowledgepixels.com/api/{query_id}/"
     np = None
     if conf is not None and conf.use_test_server:
@@ -41,19 +66,189 @@ def resolve_in_nanopub_network(iri_or_handle: Union[str, URIRef], conf: Optional
         )
         np = Nanopub(iri_or_handle, conf=fetchConf)
     else:
-        data = NanopubClient()._query_api_parsed(
-            params={"fdoid": str(iri_or_handle)},
-            endpoint=endpoint,
-            query_url=query_url,
-        )
+        if client is not None:
+            data = client.execute_query_template(f"{query_id}/{endpoint}", {"fdoid": str(iri_or_handle)})
+        else:
+            data = NanopubClient()._query_api_parsed(
+                params={"fdoid": str(iri_or_handle)},
+                endpoint=endpoint,
+                query_url=query_url,
+            )
         if not data or len(data) == 0:
             return None
         else:
             np_uri = data[0].get("np")
-            np = Nanopub(np_uri)
+            np = Nanopub(np_uri, conf=NanopubConf(use_server=conf.use_server) if conf else NanopubConf())
     return np
     
 
+@dataclass
+class FdoResolution:
+    """Outcome of the resolution of one FDO identifier by `resolve_many`.
+
+    Args:
+        id: The resolved IRI or handle
+        record: The FDO record, None if it could not be resolved
+        source_uri: URI of the nanopub or handle the record was built from
+        error: Why the identifier could not be resolved
+    """
+
+    id: str
+    record: Optional[FdoRecord] = None
+    source_uri: Optional[str] = None
+    error: Optional[str] = None
+
+    dict = asdict
+
+
+class FdoResolver:
+    """Resolves FDO identifiers concurrently, like `resolve_id`, caching the lookups.
+
+    The nanopub of an FDO is searched in the nanopub network, and the Handle API is used for
+    handles not found there. The results of the searches (FDO ID to nanopub URI) and the handle
+    metadata are cached, and concurrent resolutions of the same identifier share one lookup.
+    Nanopubs are fetched and parsed in the worker threads, without building Nanopub objects.
+
+    Args:
+        conf: Config used to fetch the nanopubs, like for `resolve_in_nanopub_network`
+        client: Client whose query servers are used to search the FDOs
+        cache: Cache of the searches and handle metadata, defaults to an in-memory one with
+            a TTL of 5 minutes. A DiskQueryCache keeps them across runs.
+        workers: Number of identifiers resolved at the same time
+    """
+
+    def __init__(
+        self,
+        conf: Optional[NanopubConf] = None,
+        client: Optional[NanopubClient] = None,
+        cache: Optional[QueryCache] = None,
+        workers: int = RESOLVE_WORKERS,
+    ) -> None:
+        self.conf = conf
+        self.client = client
+        self.cache = cache if cache is not None else MemoryQueryCache(ttl=300)
+        self.workers = workers
+        self._single_flight = SingleFlight()
+
+    def resolve(self, iri_or_handle: Union[str, URIRef]) -> FdoResolution:
+        """Resolve one identifier, waiting for the resolution already running for it if any."""
+        key = str(iri_or_handle)
+        return self._single_flight.do(key, lambda: self._resolve(key))
+
+    def resolve_many(self, ids: Iterable[Union[str, URIRef]]) -> List[FdoResolution]:
+        """Resolve identifiers concurrently, returning their FdoResolution in the same order."""
+        ids = [str(i) for i in ids]
+        unique = list(dict.fromkeys(ids))
+        if not unique:
+            return []
+        with ThreadPoolExecutor(max_workers=max(1, min(self.workers, len(unique)))) as pool:
+            resolved = dict(zip(unique, pool.map(self.resolve, unique)))
+        return [resolved[i] for i in ids]
+
+    def _resolve(self, iri_or_handle: str) -> FdoResolution:
+        try:
+            np_uri = self.find_nanopub(iri_or_handle)
+            if np_uri is not None:
+                return FdoResolution(iri_or_handle, FdoRecord(assertion=self._fetch_assertion(np_uri)), np_uri)
+
+            handle = None
+            if looks_like_handle(iri_or_handle):
+                handle = iri_or_handle
+            elif iri_or_handle.startswith("https://hdl.handle.net/"):
+                handle = iri_or_handle.replace("https://hdl.handle.net/", "")
+            if handle is not None:
+                data = resolve_handle_metadata_cached(handle, self.cache)
+                np = FdoNanopub.from_handle_metadata(handle, data)
+                return FdoResolution(iri_or_handle, FdoRecord(assertion=np.assertion), f"https://hdl.handle.net/{handle}")
+
+        except Exception as e:
+            log.info(f"Could not resolve FDO {iri_or_handle}: {e}")
+            return FdoResolution(iri_or_handle, error=f"Could not resolve FDO: {iri_or_handle} ({e})")
+
+        return FdoResolution(iri_or_handle, error=f"FDO not found: {iri_or_handle}")
+
+    def find_nanopub(self, iri_or_handle: str) -> Optional[str]:
+        """URI of the latest nanopub of the FDO, found with the query template, None if there is none."""
+        if self.conf is not None and self.conf.use_test_server:
+            # Like resolve_in_nanopub_network, the identifier is fetched as a nanopub on the test server
+            return iri_or_handle
+        params = {"fdoid": iri_or_handle}
+        query_id, endpoint = FDO_BY_ID_QUERY.split("/")
+        query_url = f"https://query.knowledgepixels.com/api/{query_id}/"
+
+        def search() -> List[dict]:
+            if self.client is not None:
+                return self.client.execute_query_template(FDO_BY_ID_QUERY, params)
+            return NanopubClient()._query_api_parsed(params=params, endpoint=endpoint, query_url=query_url) or []
+
+        if self.client is not None:
+            key = self.client._cache_key(FDO_BY_ID_QUERY, params)
+        else:
+            key = make_cache_key(FDO_BY_ID_QUERY, params, [query_url])
+        rows = self.cache.get_or_fetch(key, search)
+        return rows[0].get("np") if rows else None
+
+    def _fetch_assertion(self, np_uri: str) -> Graph:
+        """Fetch a nanopub and return its assertion graph."""
+        return fetch_assertion(np_uri, self.conf)
+
+
+def fetch_nanopub_rdf(np_uri: str, conf: Optional[NanopubConf] = None) -> Dataset:
+    """Fetch the RDF of a nanopub, without building a Nanopub object, which is safe in threads.
+
+    Like `resolve_in_nanopub_network`, the nanopub is fetched from the server of the conf if
+    it is a custom one, or from the test server if the conf uses it.
+    """
+    if conf is not None and conf.use_test_server:
+        conf = NanopubConf(use_test_server=True)
+    else:
+        conf = NanopubConf(use_server=conf.use_server) if conf else NanopubConf()
+    r = fetch_nanopub_response(np_uri, conf)
+    r.raw.decode_content = True
+    rdf = Dataset()
+    with r:
+        rdf.parse(source=r.raw, format=NANOPUB_FETCH_FORMAT)
+    return rdf
+
+
+def get_assertion_graph(rdf: Dataset, np_uri: str) -> Graph:
+    """Return the assertion graph of the RDF of a nanopub."""
+    assertion = next((o for _, _, o, _ in rdf.quads((None, NP.hasAssertion, None, None))), None)
+    if assertion is None:
+        raise MalformedNanopubError(f"No assertion graph found in {np_uri}")
+    return rdf.graph(assertion)
+
+
+def fetch_assertion(np_uri: str, conf: Optional[NanopubConf] = None) -> Graph:
+    """Fetch a nanopub and return its assertion graph, without building a Nanopub object."""
+    return get_assertion_graph(fetch_nanopub_rdf(np_uri, conf), np_uri)
+
+
+def resolve_many(
+    ids: Iterable[Union[str, URIRef]],
+    conf: Optional[NanopubConf] = None,
+    client: Optional[NanopubClient] = None,
+    cache: Optional[QueryCache] = None,
+    workers: int = RESOLVE_WORKERS,
+) -> List[FdoResolution]:
+    """Resolve many FDO identifiers concurrently, e.g. the parts of an aggregation FDO.
+
+    Each identifier is resolved like with `resolve_id`, and duplicated identifiers are only
+    resolved once. Errors do not stop the other resolutions, they are given in the results.
+
+    Args:
+        ids: IRIs or handles of the FDOs
+        conf: Config used to fetch the nanopubs
+        client: Client whose query servers are used to search the FDOs
+        cache: Cache of the searches and handle metadata, to reuse them across calls
+        workers: Number of identifiers resolved at the same time
+
+    Returns:
+        the FdoResolution of each identifier, in the same order.
+    """
+    return FdoResolver(conf=conf, client=client, cache=cache, workers=workers).resolve_many(ids)
+
+
 def retrieve_record_from_id(iri_or_handle: str):
     if looks_like_handle(iri_or_handle):
         np = FdoNanopub.handle_to_nanopub(iri_or_handle)
@@ -89,12 +284,23 @@ def retrieve_content_from_id(iri_or_handle: str) -> Union[bytes, List[bytes]]:
         raise TypeError(f"Unexpected type for content_ref: {type(content_ref)}")
 
 
-def resolve_handle_metadata(handle: str) -> dict:
+def resolve_handle_metadata(handle: str, session: Optional[requests.Session] = None) -> dict:
     url = f"https://hdl.handle.net/api/handles/{handle}"
-    response = requests.get(url)
+    response = (session or requests).get(url)
     response.raise_for_status()
     return response.json()
 
+
+def resolve_handle_metadata_cached(
+    handle: str,
+    cache: QueryCache,
+    session: Optional[requests.Session] = None,
+) -> dict:
+    """Get the metadata of a handle from the Handle API, through a cache."""
+    return cache.get_or_fetch(
+        make_cache_key("handle", {"handle": handle}), lambda: resolve_handle_metadata(handle, session=session)
+    )
+
 def get_fdo_uri_from_fdo_record(assertion_graph: Graph) -> URIRef | None:
     for s, p, o in assertion_graph.triples((None, RDF.type, FDOF.FAIRDigitalObject)):
         if isinstance(s, URIRef):
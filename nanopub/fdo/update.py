@@ -1,10 +1,126 @@
-from typing import Tuple, Optional
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass, field
+from typing import Any, Iterable, List, Tuple, Optional, Union
+from rdflib import RDF, Graph, URIRef
+from nanopub.client import NanopubClient
+from nanopub.definitions import DUMMY_URI
+from nanopub.fdo.aggregation import get_shard_uris
 from nanopub.fdo.fdo_nanopub import FdoNanopub
 from nanopub.fdo.fdo_record import FdoRecord
-from nanopub.fdo.retrieve import resolve_in_nanopub_network
+from nanopub.fdo.retrieve import (
+    RESOLVE_WORKERS, FdoResolver, fetch_nanopub_rdf, get_assertion_graph, resolve_in_nanopub_network
+)
+from nanopub.fdo.utils import handle_to_iri, looks_like_handle
+from nanopub.bulk import publish_many
+from nanopub.namespaces import FDOF, NPX
+from nanopub.nanopub import Nanopub
 from nanopub.nanopub_conf import NanopubConf
+from nanopub.profile import ProfileError
+from nanopub.query_cache import QueryCache
+from nanopub.utils import log
 from nanopub import NanopubUpdate
 
+Triple = Tuple[URIRef, URIRef, Any]
+
+
+@dataclass
+class RecordDelta:
+    """Triples to add to and remove from the assertion of an FDO nanopub so it matches a record.
+
+    Args:
+        subject: IRI of the FDO in the assertion
+        added: Triples of the record missing from the assertion
+        removed: Triples about the FDO in the assertion which are not in the record
+        metadata_link: The nanopub of the assertion, linked from the FDO with fdof:hasMetadata, if any
+    """
+
+    subject: URIRef
+    added: List[Triple] = field(default_factory=list)
+    removed: List[Triple] = field(default_factory=list)
+    metadata_link: Optional[URIRef] = None
+
+    dict = asdict
+
+    @property
+    def is_empty(self) -> bool:
+        return not self.added and not self.removed
+
+    def apply(self, assertion: Graph, np_uri: URIRef = DUMMY_URI) -> Graph:
+        """Return a copy of the assertion with the delta applied, for the nanopub `np_uri`.
+
+        The fdof:hasMetadata link of the FDO to the nanopub of the assertion is replaced by a
+        link to `np_uri`, by default the URI of an unsigned nanopub, e.g. a NanopubUpdate.
+        """
+        updated = Graph()
+        for prefix, namespace in assertion.namespaces():
+            updated.bind(prefix, namespace)
+        removed = set(self.removed)
+        if self.metadata_link is not None:
+            removed.add((self.subject, FDOF.hasMetadata, self.metadata_link))
+        updated.addN((s, p, o, updated) for s, p, o in assertion if (s, p, o) not in removed)
+        updated.addN((s, p, o, updated) for s, p, o in self.added)
+        updated.add((self.subject, FDOF.hasMetadata, URIRef(np_uri)))
+        return updated
+
+
+def _same_nanopub(uri: Any, np_uri: Optional[str]) -> bool:
+    """Whether a URI is the one of the nanopub, which can be published under other bases than w3id.org."""
+    return np_uri is not None and str(uri).rsplit("/", 1)[-1] == str(np_uri).rsplit("/", 1)[-1]
+
+
+def diff_record(
+    assertion: Graph,
+    record: FdoRecord,
+    fdo_iri: Optional[Union[str, URIRef]] = None,
+    np_uri: Optional[str] = None,
+) -> RecordDelta:
+    """Compute the triples to change in the assertion of an FDO nanopub so it matches a record.
+
+    Only the triples about the FDO are compared, the FDO being the subject typed as
+    fdof:FAIRDigitalObject in the assertion, or `fdo_iri`. Its type is never removed. Its
+    fdof:hasMetadata link to the nanopub `np_uri` is not compared, `RecordDelta.apply`
+    replaces it with a link to the new nanopub. Other triples of the assertion are kept as
+    they are.
+
+    The parts of a sharded aggregation FDO are held by its shard nanopubs, which a delta of the
+    FDO nanopub cannot update, so sharded aggregations are refused.
+
+    Args:
+        assertion: Assertion graph of the published FDO nanopub
+        record: The new version of the record
+        fdo_iri: IRI or handle of the FDO, used when the assertion does not type it
+        np_uri: URI of the published FDO nanopub
+
+    Raises:
+        ValueError: if the FDO is a sharded aggregation, or is not found in the assertion
+    """
+    subject = next(assertion.subjects(RDF.type, FDOF.FAIRDigitalObject), None)
+    if subject is None:
+        if fdo_iri is None:
+            raise ValueError("No FDO found in the assertion, provide its IRI")
+        subject = handle_to_iri(fdo_iri) if looks_like_handle(fdo_iri) else URIRef(fdo_iri)
+    if get_shard_uris(assertion, subject):
+        raise ValueError(
+            f"FDO {subject} is a sharded aggregation, whose parts cannot be updated in its FDO nanopub. "
+            "Publish it again with iter_sharded_aggregation."
+        )
+
+    def compared(p: URIRef, o: Any) -> bool:
+        return not (p == FDOF.hasMetadata and _same_nanopub(o, np_uri))
+
+    current = {(p, o) for p, o in assertion.predicate_objects(subject) if compared(p, o)}
+    wanted = {(p, o): None for p, o in record.tuples.predicate_objects() if compared(p, o)}
+    delta = RecordDelta(subject)
+    delta.metadata_link = next(
+        (o for o in assertion.objects(subject, FDOF.hasMetadata) if not compared(FDOF.hasMetadata, o)), None
+    )
+    delta.added = [(subject, p, o) for p, o in wanted if (p, o) not in current]
+    delta.removed = [
+        (subject, p, o) for p, o in current
+        if (p, o) not in wanted and (p, o) != (RDF.type, FDOF.FAIRDigitalObject)
+    ]
+    return delta
+
 
 def update_record(
     fdo_iri: str,
@@ -15,6 +131,14 @@ def update_record(
     """
     Update or create an FDO nanopub depending on whether a source nanopub URI is resolvable
     and signed with our current profile key.
+
+    Only the triples that differ between the published record and the new one are changed
+    (see `diff_record`), and no update is signed when the record did not change.
+
+    Returns:
+        what `Nanopub.publish` returns when the nanopub is published, (None, None, None) otherwise:
+        when `publish` is False, when the FDO did not change, or when it is signed with another
+        key than the one of the profile.
     """
     existing_npub = resolve_in_nanopub_network(fdo_iri, conf=conf)
 
@@ -24,14 +148,15 @@ def update_record(
 
         if str(existing_pubkey) == str(current_pubkey):
 
-            existing_npub.assertion.remove((None, None, None))
-            for triple in record.get_graph():
-                existing_npub.assertion.add(triple)
+            delta = diff_record(existing_npub.assertion, record, fdo_iri, existing_npub.source_uri)
+            if delta.is_empty:
+                log.info(f"FDO {fdo_iri} did not change since {existing_npub.source_uri}, not updating it")
+                return (None, None, None)
 
             new_np = NanopubUpdate(
                 uri=existing_npub.source_uri,
                 conf=conf,
-                assertion=existing_npub.assertion,
+                assertion=delta.apply(existing_npub.assertion),
             )
             new_np.sign()
             return new_np.publish() if publish else (None, None, None)
@@ -46,3 +171,121 @@ def update_record(
             conf=conf
         )
         return npub.publish() if publish else (None, None, None)
+
+
+@dataclass
+class FdoRecordUpdate:
+    """Outcome of the update of one FDO by `update_records`.
+
+    Args:
+        fdo_iri: IRI or handle of the updated FDO
+        previous_uri: URI of the published nanopub of the FDO, None if it had none
+        source_uri: Trusty URI of the update or of the new FDO nanopub, None if none was signed
+        added: Number of triples added to the assertion
+        removed: Number of triples removed from the assertion
+        published: True if the registry accepted the new nanopub
+        skipped: Why the FDO was not updated, e.g. when it did not change. None if it was not skipped.
+        error: Description of the error if the FDO could not be resolved, signed or published
+    """
+
+    fdo_iri: str
+    previous_uri: Optional[str] = None
+    source_uri: Optional[str] = None
+    added: int = 0
+    removed: int = 0
+    published: bool = False
+    skipped: Optional[str] = None
+    error: Optional[str] = None
+
+    dict = asdict
+
+
+def update_records(
+    updates: Iterable[Tuple[str, FdoRecord]],
+    conf: NanopubConf,
+    publish: bool = True,
+    client: Optional[NanopubClient] = None,
+    cache: Optional[QueryCache] = None,
+    workers: int = RESOLVE_WORKERS,
+    **publish_kwargs,
+) -> List[FdoRecordUpdate]:
+    """Update many FDOs, like `update_record`, only publishing the ones that changed.
+
+    The latest nanopubs of the FDOs are found and fetched concurrently, with an FdoResolver.
+    Each record is compared with the assertion of its nanopub (see `diff_record`): unchanged
+    FDOs and the ones signed with another public key than the one of the profile are skipped,
+    the others are superseded by a NanopubUpdate with the delta applied. FDOs without a
+    nanopub get a new FDO nanopub. The nanopubs are signed and published with `publish_many`.
+
+    Args:
+        updates: Tuples of the IRI or handle of an FDO and its new record
+        conf: Configuration giving the profile used to sign, and the server to publish to
+        publish: Sign and publish the nanopubs. If False, only the deltas are computed.
+        client: Client whose query servers are used to find the nanopubs of the FDOs
+        cache: Cache of the searches of the nanopubs of the FDOs
+        workers: Number of FDOs resolved at the same time
+        publish_kwargs: Arguments passed to `publish_many`, e.g. sign_workers or upload_workers
+
+    Returns:
+        the FdoRecordUpdate of each FDO, in the input order.
+    """
+    if conf.profile is None or conf.profile.public_key is None:
+        raise ProfileError("Profile not available, cannot update the FDOs")
+    updates = [(str(fdo_iri), record) for fdo_iri, record in updates]
+    resolver = FdoResolver(conf=conf, client=client, cache=cache, workers=workers)
+
+    def prepare(update: Tuple[str, FdoRecord]) -> Tuple[FdoRecordUpdate, Optional[Graph]]:
+        fdo_iri, record = update
+        result = FdoRecordUpdate(fdo_iri)
+        try:
+            result.previous_uri = resolver.find_nanopub(fdo_iri)
+            if result.previous_uri is None:
+                result.added = sum(1 for _ in record.tuples.predicate_objects())
+                return result, None
+            rdf = fetch_nanopub_rdf(result.previous_uri, conf)
+            public_key = next((o for _, _, o, _ in rdf.quads((None, NPX.hasPublicKey, None, None))), None)
+            if str(public_key) != conf.profile.public_key:
+                result.skipped = "Signed with another public key than the one of the profile"
+                return result, None
+            assertion = get_assertion_graph(rdf, result.previous_uri)
+            delta = diff_record(assertion, record, fdo_iri, result.previous_uri)
+            result.added, result.removed = len(delta.added), len(delta.removed)
+            if delta.is_empty:
+                result.skipped = "Unchanged"
+                return result, None
+            return result, delta.apply(assertion)
+        except Exception as e:
+            log.info(f"Could not resolve FDO {fdo_iri}: {e}")
+            result.error = f"{type(e).__name__}: {e}"
+            return result, None
+
+    if not updates:
+        return []
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(updates)))) as pool:
+        prepared = list(pool.map(prepare, updates))
+    results = [result for result, _ in prepared]
+    if not publish:
+        return results
+
+    # The nanopubs are built in this thread, as building them can run SPARQL queries on their RDF
+    nanopubs: List[Tuple[FdoRecordUpdate, Nanopub]] = []
+    for (result, assertion), (fdo_iri, record) in zip(prepared, updates):
+        if result.error or result.skipped:
+            continue
+        try:
+            if result.previous_uri is None:
+                np = FdoNanopub.create_with_fdo_iri(record, fdo_iri, data_ref=record.get_data_ref(), conf=conf)
+            else:
+                # prepare() already compared the public key of the fetched nanopub with the one of
+                # the profile, force skips NanopubUpdate fetching it again for the same check
+                np = NanopubUpdate(conf, result.previous_uri, force=True, assertion=assertion)
+        except Exception as e:
+            result.error = f"{type(e).__name__}: {e}"
+            continue
+        nanopubs.append((result, np))
+    for published in publish_many([np for _, np in nanopubs], conf, **publish_kwargs):
+        result = nanopubs[published.index][0]
+        result.source_uri = published.source_uri
+        result.published = published.published
+        result.error = published.error
+    return results
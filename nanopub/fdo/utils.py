@@ -1,4 +1,5 @@
 import rdflib
+from typing import Any, Dict, List, Optional
 from rdflib import RDF, URIRef, Literal, Namespace, Graph
 from rdflib.namespace import SH, XSD
 
@@ -14,6 +15,12 @@ NUMERIC_SHACL_PROPS = [
     SH.maxInclusive
 ]
 
+FDO_PROFILE_TARGET_CLASS = URIRef("https://w3id.org/fdof/ontology#FairDigitalObject")
+"""Class of the records targeted by the shapes converted from a JSON Schema profile"""
+
+JSONSCHEMA_ANNOTATIONS = {"$schema", "$id", "$comment", "title", "description", "examples", "default"}
+"""JSON Schema keywords that do not constrain the records"""
+
 def fix_numeric_shacl_constraints(shape_graph: Graph) -> Graph:
     """
     Convert string literals used as SHACL numeric constraints into xsd:integer literals.
@@ -49,7 +56,7 @@ def convert_jsonschema_to_shacl(json_schema: dict) -> rdflib.Graph:
 
     node_shape = EX["FdoProfileShape"]
     g.add((node_shape, RDF.type, SH.NodeShape))
-    g.add((node_shape, SH.targetClass, URIRef("https://w3id.org/fdof/ontology#FairDigitalObject")))
+    g.add((node_shape, SH.targetClass, FDO_PROFILE_TARGET_CLASS))
     g.add((node_shape, SH.closed, Literal(False)))
 
     for field in json_schema.get("required", []):
@@ -62,3 +69,74 @@ def convert_jsonschema_to_shacl(json_schema: dict) -> rdflib.Graph:
         g.add((prop_shape, SH.datatype, XSD.string))
 
     return g
+
+
+class JsonSchemaChecker:
+    """Checks FDO records against a JSON Schema profile directly on their attributes.
+
+    It checks the same constraints as the shapes built by `convert_jsonschema_to_shacl`, with
+    the same messages: each required handle attribute of the records typed with the target
+    class has exactly one value, which is a string. It runs over `FdoRecord.tuples`, without
+    building a graph or running pyshacl.
+
+    Use `JsonSchemaChecker.compile` to get a checker for a schema.
+    """
+
+    def __init__(self, schema: Dict[str, Any], required: List[str]) -> None:
+        self.schema = schema
+        self.required = [(field, HDL[field]) for field in required]
+
+    @classmethod
+    def compile(cls, json_schema: Any) -> Optional["JsonSchemaChecker"]:
+        """Compile a JSON Schema into a checker.
+
+        Returns:
+            the checker, or None if the schema uses keywords the checker does not support,
+            like $ref or allOf, or types other than strings for the required attributes.
+        """
+        if not isinstance(json_schema, dict):
+            return None
+        if set(json_schema) - JSONSCHEMA_ANNOTATIONS - {"type", "required", "properties", "additionalProperties"}:
+            return None
+        if json_schema.get("type", "object") != "object" or json_schema.get("additionalProperties", True) is not True:
+            return None
+        required = json_schema.get("required", [])
+        properties = json_schema.get("properties", {})
+        if not isinstance(required, list) or not all(isinstance(field, str) for field in required):
+            return None
+        if not isinstance(properties, dict):
+            return None
+        for field in required:
+            prop = properties.get(field, {})
+            if not isinstance(prop, dict) or set(prop) - JSONSCHEMA_ANNOTATIONS - {"type"}:
+                return None
+            if prop.get("type", "string") != "string":
+                return None
+        return cls(json_schema, required)
+
+    def check(self, record: Any) -> List[str]:
+        """Check an FdoRecord, returning the messages of the violations."""
+        if FDO_PROFILE_TARGET_CLASS not in record.tuples.objects(RDF.type):
+            return []
+        if not record.id:
+            raise ValueError("FDO ID is not set")
+        subject = URIRef(f"https://hdl.handle.net/{record.id}")
+        errors = []
+        for field, predicate in self.required:
+            values = record.tuples.objects(predicate)
+            if len(values) < 1:
+                errors.append(f"Less than 1 values on {subject.n3()}->{predicate.n3()}")
+            if len(values) > 1:
+                errors.append(f"More than 1 values on {subject.n3()}->{predicate.n3()}")
+            for value in values:
+                if not _is_string_literal(value):
+                    errors.append("Value is not Literal with datatype xsd:string")
+        return errors
+
+
+def _is_string_literal(value: Any) -> bool:
+    if not isinstance(value, Literal):
+        return False
+    if value.datatype is None:
+        return value.language is None
+    return value.datatype == XSD.string
@@ -1,22 +1,133 @@
 import json
+import os
+import threading
+import time
+from pathlib import Path
 import requests
 from pyshacl import validate
 from rdflib import Graph
-from nanopub.fdo.utils import convert_jsonschema_to_shacl, looks_like_handle, fix_numeric_shacl_constraints
+from nanopub.fdo.utils import JsonSchemaChecker, convert_jsonschema_to_shacl, looks_like_handle, fix_numeric_shacl_constraints
 from nanopub.fdo.retrieve import resolve_in_nanopub_network
 from nanopub.fdo.fdo_record import FdoRecord 
 from nanopub.fdo.fdo_nanopub import FdoNanopub
 from nanopub.namespaces import FDOC
+from nanopub.bulk import make_sign_pool
+from nanopub.query_cache import CacheStats, DiskQueryCache, MemoryQueryCache, SingleFlight
 from rdflib.namespace import SH
-from typing import List
+from typing import Callable, Dict, Iterable, List, Optional, Tuple, Union
 from dataclasses import dataclass
 
+VALIDATION_BATCH_SIZE = 500
+"""Number of records of the same profile validated together in a single data graph"""
+
+
 @dataclass
 class ValidationResult:
     is_valid: bool
     errors: List[str]
     warnings: List[str]
-    
+
+
+ProfileShapes = Union[Graph, JsonSchemaChecker]
+"""Compiled constraints of an FDO profile: a SHACL shapes graph, or a checker for JSON Schema profiles"""
+
+
+class ProfileShapeError(Exception):
+    """Error raised when the SHACL shapes of an FDO profile cannot be obtained."""
+
+
+class ShapeCache:
+    """Cache of the compiled shapes of FDO profiles, keyed by profile URI.
+
+    Resolving a profile means fetching its handle metadata and compiling its JSON Schema,
+    or fetching its nanopub and fixing its numeric constraints. The cache keeps the resulting
+    JsonSchemaChecker or shapes graph, ready to be used, for `ttl` seconds. Profiles that could
+    not be resolved are not cached. Concurrent lookups of the same profile only resolve it once.
+
+    The cached shapes are shared between validations and must not be modified.
+
+    Args:
+        ttl: Number of seconds the shapes of a profile are kept
+        maxsize: Maximum number of profiles kept in memory
+        directory: Optional directory where the shapes are also stored, as turtle or as the
+            JSON Schema they were compiled from, so they are reused across processes and runs
+        clock: Function returning the current time in seconds
+    """
+
+    def __init__(
+        self,
+        ttl: float = 3600,
+        maxsize: int = 128,
+        directory: Optional[Union[Path, str]] = None,
+        clock: Callable[[], float] = time.time,
+    ) -> None:
+        self.stats = CacheStats()
+        self._memory = MemoryQueryCache(maxsize=maxsize, ttl=ttl, clock=clock)
+        self._disk = DiskQueryCache(directory, ttl=ttl, clock=clock) if directory is not None else None
+        self._lock = threading.Lock()
+        self._single_flight = SingleFlight()
+
+    def __len__(self) -> int:
+        return len(self._memory)
+
+    def get(self, profile_uri: str) -> Optional[ProfileShapes]:
+        """Return the cached shapes of a profile if they have not expired, None otherwise."""
+        key = str(profile_uri)
+        shapes = self._memory.get(key)
+        if shapes is None and self._disk is not None:
+            entry = self._disk.get(key)
+            if isinstance(entry, dict) and "jsonschema" in entry:
+                shapes = JsonSchemaChecker.compile(entry["jsonschema"])
+            elif isinstance(entry, dict) and "turtle" in entry:
+                shapes = Graph().parse(data=entry["turtle"], format="turtle")
+            if shapes is not None:
+                self._memory.set(key, shapes)
+        return shapes
+
+    def set(self, profile_uri: str, shapes: ProfileShapes) -> None:
+        """Store the shapes of a profile."""
+        key = str(profile_uri)
+        self._memory.set(key, shapes)
+        if self._disk is not None:
+            if isinstance(shapes, JsonSchemaChecker):
+                self._disk.set(key, {"jsonschema": shapes.schema})
+            else:
+                self._disk.set(key, {"turtle": shapes.serialize(format="turtle")})
+
+    def invalidate(self, profile_uri: str) -> None:
+        """Remove the shapes of a profile, so that it is resolved again on next use."""
+        self._memory.invalidate(str(profile_uri))
+        if self._disk is not None:
+            self._disk.invalidate(str(profile_uri))
+
+    def clear(self) -> None:
+        """Remove all the shapes from the cache."""
+        self._memory.clear()
+        if self._disk is not None:
+            self._disk.clear()
+
+    def get_or_build(self, profile_uri: str, build: Callable[[], ProfileShapes]) -> ProfileShapes:
+        """Return the shapes of a profile, calling build() to create them when needed."""
+        key = str(profile_uri)
+        built = []
+
+        def get_or_build_once() -> ProfileShapes:
+            shapes = self.get(key)
+            if shapes is None:
+                shapes = build()
+                self.set(key, shapes)
+                built.append(shapes)
+            return shapes
+
+        shapes = self._single_flight.do(key, get_or_build_once)
+        with self._lock:
+            if built:
+                self.stats.misses += 1
+            else:
+                self.stats.hits += 1
+        return shapes
+
+
 def _profile_landing_page_uri_to_api_url(uri: str) -> str:
     """
     Convert an FdoProfile landing page URI into a handle API URI unless it is already an API URI.
@@ -38,7 +149,61 @@ def _profile_landing_page_uri_to_api_url(uri: str) -> str:
     api_url = f"https://hdl.handle.net/api/handles/{handle}"
     return api_url
 
-def validate_fdo_record(record: FdoRecord, profile_np: FdoNanopub = None) -> ValidationResult:
+def _build_profile_shapes(profile_uri: str) -> ProfileShapes:
+    """Resolve an FDO profile and build its shapes.
+
+    JSON Schema profiles are compiled to a JsonSchemaChecker when possible, and converted to
+    SHACL otherwise.
+
+    Raises:
+        ProfileShapeError: if the profile cannot be resolved
+    """
+    if looks_like_handle(profile_uri) or str(profile_uri).startswith("https://hdl.handle.net/"):
+        api_url = _profile_landing_page_uri_to_api_url(str(profile_uri))
+        resp = requests.get(api_url)
+        if resp.status_code != 200:
+            raise ProfileShapeError(f"Could not fetch handle metadata for {api_url}")
+        metadata = resp.json()
+
+        schema_entry = next(
+            (v for v in metadata.get("values", []) if v["type"].endswith("JsonSchema")),
+            None
+        )
+        if not schema_entry:
+            raise ProfileShapeError("JSON Schema entry not found in FDO profile.")
+
+        schema_str = schema_entry["data"]["value"]
+        schema_json = json.loads(schema_str)
+        return JsonSchemaChecker.compile(schema_json) or convert_jsonschema_to_shacl(schema_json)
+
+    profile_np = resolve_in_nanopub_network(profile_uri)
+    if not profile_np:
+        raise ProfileShapeError(f"Could not resolve profile nanopub for {profile_uri}")
+    # Fix a copy, so the assertion of the fetched nanopub is left untouched
+    shape_graph = Graph()
+    for prefix, namespace in profile_np.assertion.namespaces():
+        shape_graph.bind(prefix, namespace)
+    shape_graph += profile_np.assertion
+    return fix_numeric_shacl_constraints(shape_graph)
+
+
+def validate_fdo_record(
+    record: FdoRecord,
+    profile_np: FdoNanopub = None,
+    shape_cache: Optional[ShapeCache] = None,
+) -> ValidationResult:
+    """Validate an FDO record against the SHACL shapes of its profile.
+
+    Args:
+        record: The FDO record to validate
+        profile_np: Nanopub of the profile, whose assertion holds the shapes. If not given,
+            the profile of the record is resolved.
+        shape_cache: Cache of the shapes graphs of the profiles, to resolve each profile only
+            once when validating many records
+
+    Returns:
+        a ValidationResult, with the messages of the SHACL violations as errors.
+    """
     try:
         shape_graph = None
 
@@ -48,47 +213,163 @@ def validate_fdo_record(record: FdoRecord, profile_np: FdoNanopub = None) -> Val
             profile_uri = record.get_profile()
             if not profile_uri:
                 return ValidationResult(False, ["FDO profile URI not found in record."], [])
+            try:
+                if shape_cache is not None:
+                    shape_graph = shape_cache.get_or_build(
+                        str(profile_uri), lambda: _build_profile_shapes(profile_uri)
+                    )
+                else:
+                    shape_graph = _build_profile_shapes(profile_uri)
+            except ProfileShapeError as e:
+                return ValidationResult(False, [str(e)], [])
+            if isinstance(shape_graph, JsonSchemaChecker):
+                errors = shape_graph.check(record)
+                return ValidationResult(not errors, errors, [])
+
+        if shape_graph is None:
+            return ValidationResult(False, ["SHACL shape graph could not be created."], [])
 
-            if looks_like_handle(profile_uri) or str(profile_uri).startswith("https://hdl.handle.net/"):
-                api_url = _profile_landing_page_uri_to_api_url(str(profile_uri))
-                resp = requests.get(api_url)
-                if resp.status_code != 200:
-                    return ValidationResult(False, [f"Could not fetch handle metadata for {api_url}"], [])
-                metadata = resp.json()
+        return _validate_graph(record.get_graph(), shape_graph)
 
-                schema_entry = next(
-                    (v for v in metadata.get("values", []) if v["type"].endswith("JsonSchema")),
-                    None
-                )
-                if not schema_entry:
-                    return ValidationResult(False, ["JSON Schema entry not found in FDO profile."], [])
+    except Exception as e:
+        return ValidationResult(False, [f"Validation error: {str(e)}"], [])
 
-                schema_str = schema_entry["data"]["value"]
-                schema_json = json.loads(schema_str)
-                shape_graph = convert_jsonschema_to_shacl(schema_json)
 
-            else:
-                profile_np = resolve_in_nanopub_network(profile_uri)
-                if not profile_np:
-                    return ValidationResult(False, [f"Could not resolve profile nanopub for {profile_uri}"], [])
-                shape_graph = fix_numeric_shacl_constraints(profile_np.assertion)
+def _run_shacl(graph: Graph, shape_graph: Graph) -> Tuple[bool, Graph]:
+    conforms, results_graph, results_text = validate(
+        graph,
+        shacl_graph=shape_graph,
+        inference="rdfs",
+        abort_on_first=False,
+        meta_shacl=False,
+        advanced=True,
+        debug=False
+    )
+    return conforms, results_graph
 
-        if shape_graph is None:
-            return ValidationResult(False, ["SHACL shape graph could not be created."], [])
 
-        graph = record.get_graph()
-        conforms, results_graph, results_text = validate(
-            graph,
-            shacl_graph=shape_graph,
-            inference="rdfs",
-            abort_on_first=False,
-            meta_shacl=False,
-            advanced=True,
-            debug=False
-        )
+def _validate_graph(graph: Graph, shape_graph: Graph) -> ValidationResult:
+    conforms, results_graph = _run_shacl(graph, shape_graph)
+    errors = [str(o) for s, p, o in results_graph.triples((None, SH.resultMessage, None))]
+    return ValidationResult(conforms, errors, [])
 
-        errors = [str(o) for s, p, o in results_graph.triples((None, SH.resultMessage, None))]
-        return ValidationResult(conforms, errors, [])
 
+def _validate_chunk(shape_graph: Graph, chunk: List[Tuple[int, Graph]]) -> List[Tuple[int, ValidationResult]]:
+    """Validate the graphs of records sharing a profile, in the worker processes of `validate_fdo_records`.
+
+    The graphs are merged in one data graph, so pyshacl builds the shapes and computes the RDFS
+    closure once, and the report is split by focus node. Records that share or reference each
+    other's subjects could see each other's triples once merged, so they are validated one by one.
+    """
+    if len(chunk) == 1:
+        return _validate_one_by_one(shape_graph, chunk)
+    owners: Dict[object, int] = {}
+    for position, (_, graph) in enumerate(chunk):
+        for subject in set(graph.subjects()):
+            if owners.setdefault(subject, position) != position:
+                return _validate_one_by_one(shape_graph, chunk)
+    for position, (_, graph) in enumerate(chunk):
+        if any(owners.get(o, position) != position for o in graph.objects()):
+            return _validate_one_by_one(shape_graph, chunk)
+
+    data = Graph()
+    for _, graph in chunk:
+        data += graph
+    try:
+        _, results_graph = _run_shacl(data, shape_graph)
     except Exception as e:
-        return ValidationResult(False, [f"Validation error: {str(e)}"], [])
+        return [(index, ValidationResult(False, [f"Validation error: {str(e)}"], [])) for index, _ in chunk]
+
+    errors: Dict[int, List[str]] = {}
+    for result, focus_node in results_graph.subject_objects(SH.focusNode):
+        position = owners.get(focus_node)
+        if position is None:
+            # The violation cannot be attributed to a single record
+            return _validate_one_by_one(shape_graph, chunk)
+        errors.setdefault(position, []).extend(str(o) for o in results_graph.objects(result, SH.resultMessage))
+    return [
+        (index, ValidationResult(position not in errors, errors.get(position, []), []))
+        for position, (index, _) in enumerate(chunk)
+    ]
+
+
+def _validate_one_by_one(shape_graph: Graph, chunk: List[Tuple[int, Graph]]) -> List[Tuple[int, ValidationResult]]:
+    results = []
+    for index, graph in chunk:
+        try:
+            results.append((index, _validate_graph(graph, shape_graph)))
+        except Exception as e:
+            results.append((index, ValidationResult(False, [f"Validation error: {str(e)}"], [])))
+    return results
+
+
+def validate_fdo_records(
+    records: Iterable[FdoRecord],
+    shape_cache: Optional[ShapeCache] = None,
+    workers: Optional[int] = None,
+    batch_size: int = VALIDATION_BATCH_SIZE,
+) -> List[ValidationResult]:
+    """Validate many FDO records against the SHACL shapes of their profiles.
+
+    Records are grouped by profile, and each profile is resolved once. Records whose profile is a
+    JSON Schema compiled to a JsonSchemaChecker are checked directly. The other records of a profile
+    are validated by batches merged in a single data graph, so that pyshacl builds the shapes
+    and computes the RDFS inference once per batch instead of once per record. The batches are
+    validated in a pool of processes.
+
+    Args:
+        records: The FDO records to validate
+        shape_cache: Cache of the shapes graphs of the profiles, to also reuse them across calls
+        workers: Number of validation processes, defaults to the number of CPUs.
+            Use 0 to validate in the current process.
+        batch_size: Number of records of the same profile validated together
+
+    Returns:
+        the ValidationResult of each record, in the order of the records.
+    """
+    shape_cache = shape_cache if shape_cache is not None else ShapeCache()
+    results: List[Optional[ValidationResult]] = []
+    shapes: Dict[str, ProfileShapes] = {}
+    failed: Dict[str, ValidationResult] = {}
+    groups: Dict[str, List[Tuple[int, Graph]]] = {}
+    for index, record in enumerate(records):
+        results.append(None)
+        try:
+            profile_uri = record.get_profile()
+            if not profile_uri:
+                results[index] = ValidationResult(False, ["FDO profile URI not found in record."], [])
+                continue
+            key = str(profile_uri)
+            if key in failed:
+                results[index] = failed[key]
+                continue
+            if key not in shapes:
+                try:
+                    shapes[key] = shape_cache.get_or_build(key, lambda: _build_profile_shapes(profile_uri))
+                except ProfileShapeError as e:
+                    failed[key] = results[index] = ValidationResult(False, [str(e)], [])
+                    continue
+            if isinstance(shapes[key], JsonSchemaChecker):
+                errors = shapes[key].check(record)
+                results[index] = ValidationResult(not errors, errors, [])
+                continue
+            groups.setdefault(key, []).append((index, record.get_graph()))
+        except Exception as e:
+            results[index] = ValidationResult(False, [f"Validation error: {str(e)}"], [])
+
+    chunks = [
+        (shapes[key], group[start:start + batch_size])
+        for key, group in groups.items()
+        for start in range(0, len(group), batch_size)
+    ]
+    if workers is None:
+        workers = min(os.cpu_count() or 1, len(chunks))
+    if workers > 1 and len(chunks) > 1:
+        with make_sign_pool(workers) as pool:
+            chunk_results = list(pool.map(_validate_chunk, *zip(*chunks)))
+    else:
+        chunk_results = [_validate_chunk(shape_graph, chunk) for shape_graph, chunk in chunks]
+    for chunk_result in chunk_results:
+        for index, result in chunk_result:
+            results[index] = result
+    return results
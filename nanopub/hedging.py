@@ -0,0 +1,163 @@
+"""
+This module holds helpers to send hedged requests: when a server is slow to answer, the same
+idempotent request is sent to another server, and the first successful answer is used.
+"""
+import threading
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Callable, Dict, List, Optional, Tuple, TypeVar
+
+import requests
+
+from nanopub.definitions import NANOPUB_FETCH_FORMAT, NANOPUB_REGISTRY_URLS, QUERY_TIMEOUT
+from nanopub.server_selection import ServerSelector, shared_selector
+from nanopub.trustyuri import TrustyUriUtils
+from nanopub.utils import log
+
+T = TypeVar("T")
+
+DEFAULT_HEDGE_DELAY = 1.0
+"""Delay in seconds before hedging, used as long as no latency has been measured"""
+
+MIN_HEDGE_DELAY = 0.05
+"""Minimum delay in seconds before hedging, to avoid doubling the load on fast servers"""
+
+registry_selector = shared_selector(NANOPUB_REGISTRY_URLS)
+"""Latency and errors of the nanopub registries, used to hedge fetches of nanopubs"""
+
+
+def hedged_call(
+    call: Callable[[str], T],
+    targets: List[str],
+    hedge_after: float,
+    max_parallel: int = 2,
+    discard: Optional[Callable[[T], None]] = None,
+) -> Tuple[T, str]:
+    """Call a function on a first target, and on the next targets if it is too slow or fails.
+
+    A request is sent to the next target when the running ones have not answered after
+    `hedge_after` seconds (up to `max_parallel` requests at the same time), or as soon as one
+    fails. The first successful result is returned, the other requests are cancelled if they
+    did not start yet, and their results are passed to `discard` when they complete.
+
+    Args:
+        call: Function sending the request to the given target
+        targets: Targets to try, in order
+        hedge_after: Number of seconds to wait before sending the request to another target
+        max_parallel: Maximum number of requests running at the same time
+        discard: Function to release the results of the requests that lost the race
+
+    Returns:
+        tuple of: the result of the first successful call, the target that gave it.
+    """
+    if not targets:
+        raise ValueError("No target provided for the hedged call")
+    remaining = list(targets)
+    pending: Dict[Future, str] = {}
+    errors: List[Exception] = []
+    executor = ThreadPoolExecutor(max_workers=max_parallel)
+
+    def launch() -> None:
+        target = remaining.pop(0)
+        pending[executor.submit(call, target)] = target
+
+    def release(future: Future) -> None:
+        if discard is not None and not future.cancelled() and future.exception() is None:
+            discard(future.result())
+
+    try:
+        launch()
+        while pending:
+            can_hedge = bool(remaining) and len(pending) < max_parallel
+            done, _ = wait(list(pending), timeout=hedge_after if can_hedge else None, return_when=FIRST_COMPLETED)
+            if not done:
+                log.debug(f"No answer after {hedge_after:.3f}s, hedging the request to {remaining[0]}")
+                launch()
+                continue
+            for future in done:
+                target = pending.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    errors.append(e)
+                    if remaining:
+                        launch()
+                    continue
+                for other in pending:
+                    if not other.cancel():
+                        other.add_done_callback(release)
+                return result, target
+        raise errors[-1]
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def fetch_nanopub_hedged(
+    trusty_artefact: str,
+    quantile: float = 0.95,
+    selector: ServerSelector = registry_selector,
+    fetch_format: str = NANOPUB_FETCH_FORMAT,
+    timeout=QUERY_TIMEOUT,
+) -> requests.Response:
+    """Fetch a nanopub by its trusty artefact code from the registries, with hedging.
+
+    The request is sent to another registry if the first one did not answer within the
+    given quantile of the latencies observed so far.
+
+    Only the registries answering with the nanopub are counted as healthy by the selector.
+    A registry answering 404 might not have received the nanopub yet: it counts as failing
+    if another registry has the nanopub, and as healthy if another registry answers 404 too.
+    """
+    lock = threading.Lock()
+    not_found: List[Tuple[str, float]] = []
+
+    def fetch(registry_url: str) -> requests.Response:
+        try:
+            r = requests.get(f"{registry_url}{trusty_artefact}.{fetch_format}", timeout=timeout, stream=True)
+        except (requests.ConnectionError, requests.Timeout):
+            selector.record_failure(registry_url)
+            raise
+        if 200 <= r.status_code < 300:
+            selector.record_success(registry_url, r.elapsed.total_seconds())
+            return r
+        r.close()
+        if r.status_code == 404:
+            # Decided once the other registries answered
+            with lock:
+                not_found.append((registry_url, r.elapsed.total_seconds()))
+        else:
+            selector.record_failure(registry_url)
+        r.raise_for_status()
+        raise requests.HTTPError(f"{r.status_code} answered by {registry_url}", response=r)
+
+    try:
+        r, _ = hedged_call(
+            fetch,
+            selector.ordered(),
+            hedge_after=hedge_delay(selector, quantile),
+            discard=lambda response: response.close(),
+        )
+    except Exception:
+        with lock:
+            confirmed = list(not_found) if len(not_found) > 1 else []
+        for registry_url, latency in confirmed:
+            selector.record_success(registry_url, latency)
+        raise
+    with lock:
+        lagging = [registry_url for registry_url, _ in not_found]
+    for registry_url in lagging:
+        selector.record_failure(registry_url)
+    return r
+
+
+def hedge_delay(selector: ServerSelector, quantile: float) -> float:
+    """Delay before hedging: the given quantile of the latencies observed by the selector."""
+    latency = selector.latency_percentile(quantile)
+    if latency is None:
+        return DEFAULT_HEDGE_DELAY
+    return max(latency, MIN_HEDGE_DELAY)
+
+
+def get_trusty_artefact(uri: str) -> Optional[str]:
+    """Return the trusty artefact code of a nanopub URI, or None if it has none."""
+    tail = TrustyUriUtils.get_trustyuri_tail(str(uri))
+    return tail if tail.startswith("RA") else None
@@ -0,0 +1,469 @@
+"""
+This module holds a local stand-in for the nanopub registry and query services.
+
+It runs in a background thread and implements the publication and retrieval of nanopubs, the
+grlc-style query endpoints used by the NanopubClient and FdoQuery, and a SPARQL endpoint. It
+can inject latency and failures, to test and benchmark the client without the network.
+"""
+import gzip
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Union
+from urllib.parse import parse_qs, urlparse
+
+from rdflib import Dataset, Literal, Namespace, URIRef
+from rdflib.namespace import DCTERMS, PROV, RDFS
+
+from nanopub.client import FILTER_RETRACTED, SPARQL_PREFIXES, NanopubClient
+from nanopub.definitions import MAX_TRIPLES_PER_NANOPUB
+from nanopub.namespaces import FDOF, HDL, NP, NPA, NPX
+from nanopub.nanopub import Nanopub
+from nanopub.nanopub_conf import NanopubConf
+from nanopub.trustyuri.rdf import RdfHasher, RdfUtils
+from nanopub.utils import MalformedNanopubError, log
+
+CITO = Namespace("http://purl.org/spar/cito/")
+
+QUERY_PREFIXES = SPARQL_PREFIXES + f"""prefix rdfs: <{RDFS}>
+prefix prov: <{PROV}>
+prefix fdof: <{FDOF}>
+prefix cito: <{CITO}>
+"""
+
+NANOPUB_GRAPHS = """GRAPH npa:graph {
+    ?np np:hasAssertion ?a ;
+        np:hasPublicationInfo ?pi ;
+        npa:hasValidSignatureForPublicKey ?pubkey ;
+        dct:created ?date .
+    %(filters)s
+  }"""
+
+FETCH_FORMATS = {
+    "trig": ("trig", "application/trig"),
+    "nq": ("nquads", "application/n-quads"),
+    "jsonld": ("json-ld", "application/ld+json"),
+}
+
+UPLOAD_FORMATS = {
+    "application/n-quads": "nquads",
+    "application/ld+json": "json-ld",
+}
+
+
+def _fdo_term(value: str) -> str:
+    """SPARQL IRI of an FDO identifier, which can be a handle."""
+    return URIRef(value if value.startswith(("http://", "https://")) else HDL[value]).n3()
+
+
+def _text_filter(variable: str, text: str) -> str:
+    return f"FILTER(CONTAINS(LCASE(STR({variable})), LCASE({Literal(text).n3()})))"
+
+
+def _pattern_query(params: Dict[str, str]) -> str:
+    subj = URIRef(params["subj"]).n3() if params.get("subj") else "?s"
+    pred = URIRef(params["pred"]).n3() if params.get("pred") else "?p"
+    obj_filter = f"FILTER(STR(?o) = {Literal(params['obj']).n3()})" if params.get("obj") else ""
+    return f"""SELECT DISTINCT ?np ?date WHERE {{
+  GRAPH ?a {{ {subj} {pred} ?o {obj_filter} }}
+  {NANOPUB_GRAPHS}
+}} ORDER BY DESC(?date)"""
+
+
+def _text_query(params: Dict[str, str]) -> str:
+    return f"""SELECT ?np ?date (SAMPLE(?text) AS ?label) WHERE {{
+  GRAPH ?a {{ ?s ?p ?text FILTER(isLiteral(?text)) {_text_filter("?text", params.get("query", ""))} }}
+  {NANOPUB_GRAPHS}
+}} GROUP BY ?np ?date ORDER BY DESC(?date)"""
+
+
+def _things_query(params: Dict[str, str]) -> str:
+    search = params.get("query", "*:*")
+    label_filter = "" if search == "*:*" else _text_filter("?label", search)
+    return f"""SELECT DISTINCT ?thing ?label ?np ?date WHERE {{
+  GRAPH ?pi {{ ?np npx:introduces ?thing }}
+  GRAPH ?a {{
+    ?thing a {URIRef(params.get("type", "")).n3()} .
+    OPTIONAL {{ ?thing rdfs:label ?label }}
+  }}
+  {label_filter}
+  {NANOPUB_GRAPHS}
+}} ORDER BY DESC(?date)"""
+
+
+def _fdo_by_id_query(params: Dict[str, str]) -> str:
+    return f"""SELECT DISTINCT ?np ?date WHERE {{
+  GRAPH ?a {{ {_fdo_term(params.get("fdoid", ""))} a fdof:FAIRDigitalObject }}
+  {NANOPUB_GRAPHS}
+}} ORDER BY DESC(?date)"""
+
+
+def _fdo_text_query(params: Dict[str, str]) -> str:
+    return f"""SELECT DISTINCT ?fdo ?label ?np ?date WHERE {{
+  GRAPH ?a {{ ?fdo a fdof:FAIRDigitalObject ; rdfs:label ?label }}
+  {_text_filter("?label", params.get("query", ""))}
+  {NANOPUB_GRAPHS}
+}} ORDER BY DESC(?date)"""
+
+
+def _fdo_by_ref_query(params: Dict[str, str]) -> str:
+    refid = params.get("refid", "")
+    refs = ", ".join(Literal(ref).n3() for ref in sorted({refid, _fdo_term(refid)[1:-1]}))
+    return f"""SELECT DISTINCT ?fdo ?label ?np ?date WHERE {{
+  GRAPH ?a {{
+    ?fdo a fdof:FAIRDigitalObject ; ?p ?ref .
+    OPTIONAL {{ ?fdo rdfs:label ?label }}
+    FILTER(STR(?ref) IN ({refs}))
+  }}
+  {NANOPUB_GRAPHS}
+}} ORDER BY DESC(?date)"""
+
+
+def _fdo_feed_query(params: Dict[str, str]) -> str:
+    return f"""SELECT DISTINCT ?fdo ?label ?np ?date WHERE {{
+  GRAPH ?pi {{ ?np prov:wasAttributedTo|dct:creator {URIRef(params.get("creator", "")).n3()} }}
+  GRAPH ?a {{
+    ?fdo a fdof:FAIRDigitalObject .
+    OPTIONAL {{ ?fdo rdfs:label ?label }}
+  }}
+  {NANOPUB_GRAPHS}
+}} ORDER BY DESC(?date)"""
+
+
+def _favorites_query(params: Dict[str, str]) -> str:
+    return f"""SELECT DISTINCT ?thing ?np ?date WHERE {{
+  GRAPH ?a {{ {URIRef(params.get("creator", "")).n3()} cito:likes ?thing }}
+  {NANOPUB_GRAPHS}
+}} ORDER BY DESC(?date)"""
+
+
+QUERY_TEMPLATES: Dict[str, Callable[[Dict[str, str]], str]] = {
+    "fulltext-search-on-labels-all": _text_query,
+    "fulltext-search-on-labels": _text_query,
+    "find_nanopubs_with_pattern": _pattern_query,
+    "find_valid_nanopubs_with_pattern": _pattern_query,
+    "find-things": _things_query,
+    "find-valid-things": _things_query,
+    "get-fdo-by-id": _fdo_by_id_query,
+    "fdo-text-search": _fdo_text_query,
+    "find-fdos-by-ref": _fdo_by_ref_query,
+    "get-fdo-feed": _fdo_feed_query,
+    "get-favorite-things": _favorites_query,
+}
+"""Query templates implemented by the local server, by endpoint name (the query ID is ignored)"""
+
+ALL_NANOPUBS_QUERIES = {"fulltext-search-on-labels-all", "find_nanopubs_with_pattern", "find-things"}
+"""Query templates which do not filter out the retracted and superseded nanopubs"""
+
+
+class LocalNanopubServer:
+    """Local stand-in for the nanopub registry, query and SPARQL services.
+
+    The server listens on `url` in a background thread, once started:
+
+    * `registry_url` (`/np/`): publish nanopubs with POST, and fetch them with GET
+      `<trusty artefact>.trig` (or `.nq`, `.jsonld`)
+    * `query_url` (`/api/`): the grlc-style query endpoints used by NanopubClient and FdoQuery,
+      answering in JSON or CSV depending on the Accept header
+    * `sparql_url` (`/repo/full`): a SPARQL endpoint over all the nanopubs and an admin graph
+      giving their public key, date, and the nanopubs invalidating them
+
+    Args:
+        host: Host to listen on
+        port: Port to listen on, 0 to pick a free one
+        directory: Directory where the nanopubs are stored as trig files, loaded when the
+            server is created. By default nanopubs are only kept in memory.
+        latency: Delay in seconds added before answering each request
+        latency_jitter: Random variation in seconds of the delay, in each direction
+        failure_rate: Probability that a request fails with `failure_status`
+        failure_status: HTTP status of the injected failures
+        seed: Seed of the random generator used for the jitter and the failures
+        verify: Check the signature and trusty URI of published nanopubs
+    """
+
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        directory: Optional[Union[Path, str]] = None,
+        latency: float = 0.0,
+        latency_jitter: float = 0.0,
+        failure_rate: float = 0.0,
+        failure_status: int = 503,
+        seed: Optional[int] = None,
+        verify: bool = True,
+    ) -> None:
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.failure_rate = failure_rate
+        self.failure_status = failure_status
+        self.verify = verify
+        self.stats: Dict[str, int] = {"publish": 0, "fetch": 0, "query": 0, "sparql": 0, "injected_failures": 0}
+        self._random = random.Random(seed)
+        self._lock = threading.RLock()
+        self._nanopubs: Dict[str, str] = {}
+        self._dataset = Dataset()
+        self._directory = Path(directory) if directory else None
+        if self._directory:
+            self._directory.mkdir(parents=True, exist_ok=True)
+            for path in sorted(self._directory.glob("*.trig")):
+                self.add(path.read_text(encoding="utf-8"), verify=False)
+        self._httpd = ThreadingHTTPServer((host, port), _Handler)
+        self._httpd.daemon_threads = True
+        self._httpd.nanopub_server = self  # type: ignore[attr-defined]
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def registry_url(self) -> str:
+        return f"{self.url}/np/"
+
+    @property
+    def query_url(self) -> str:
+        return f"{self.url}/api/"
+
+    @property
+    def sparql_url(self) -> str:
+        return f"{self.url}/repo/full"
+
+    def conf(self, **kwargs) -> NanopubConf:
+        """NanopubConf publishing to this server, the keyword arguments are passed to NanopubConf."""
+        return NanopubConf(use_server=self.registry_url, **kwargs)
+
+    def client(self, **kwargs) -> NanopubClient:
+        """NanopubClient querying this server, the keyword arguments are passed to NanopubClient."""
+        return NanopubClient(query_urls=[self.query_url], sparql_urls=[self.sparql_url], **kwargs)
+
+    def start(self) -> "LocalNanopubServer":
+        """Start serving in a background thread."""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+            self._thread.start()
+            log.info(f"Local nanopub server listening on {self.url}")
+        return self
+
+    def serve_forever(self) -> None:
+        """Serve in the current thread, until interrupted."""
+        self._httpd.serve_forever()
+
+    def stop(self) -> None:
+        self._httpd.shutdown()
+        self._httpd.server_close()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def __enter__(self) -> "LocalNanopubServer":
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+    def __len__(self) -> int:
+        return len(self._nanopubs)
+
+    def __contains__(self, uri: str) -> bool:
+        return str(uri).rsplit("/", 1)[-1] in self._nanopubs
+
+    def add(self, data: str, rdf_format: str = "trig", verify: Optional[bool] = None) -> str:
+        """Store a signed nanopub, returning its URI.
+
+        Raises:
+            MalformedNanopubError: if the nanopub is not signed, or if verify is True and its
+                signature or trusty URI is not valid.
+        """
+        # The SPARQL parser of rdflib, used to extract the nanopub metadata, is not thread safe
+        with self._lock:
+            rdf = Dataset()
+            rdf.parse(data=data, format=rdf_format)
+            np = Nanopub(rdf=rdf)
+            if not np.metadata.signature:
+                raise MalformedNanopubError("The nanopub is not signed")
+            np.source_uri = str(np.metadata.np_uri)
+            if len(np.rdf) > MAX_TRIPLES_PER_NANOPUB:
+                raise MalformedNanopubError(f"The nanopub has more than {MAX_TRIPLES_PER_NANOPUB} triples")
+            trusty = np.source_uri.rsplit("/", 1)[-1]
+            if self.verify if verify is None else verify:
+                expected_trusty = RdfHasher.make_hash(RdfUtils.get_quads(np.rdf), hashstr=trusty)
+                if expected_trusty != trusty:
+                    raise MalformedNanopubError(f"The trusty artefact {trusty} is not valid, it should be {expected_trusty}")
+                # has_valid_signature raises a MalformedNanopubError for an invalid signature
+                if not np.has_valid_signature:
+                    raise MalformedNanopubError("The signature of the nanopub is not valid")
+            if trusty in self._nanopubs:
+                return np.source_uri
+            trig = np.rdf.serialize(format="trig")
+            self._nanopubs[trusty] = trig
+            self._index(np)
+            if self._directory and not (self._directory / f"{trusty}.trig").exists():
+                tmp_path = self._directory / f".{trusty}.trig.tmp"
+                tmp_path.write_text(trig, encoding="utf-8")
+                tmp_path.replace(self._directory / f"{trusty}.trig")
+            return np.source_uri
+
+    def get(self, trusty_artefact: str, rdf_format: str = "trig") -> Optional[str]:
+        """Serialization of a stored nanopub, None if it is not found."""
+        trig = self._nanopubs.get(trusty_artefact)
+        if trig is None or rdf_format == "trig":
+            return trig
+        rdf = Dataset()
+        rdf.parse(data=trig, format="trig")
+        return rdf.serialize(format=rdf_format)
+
+    def query(self, query: str):
+        """Run a SPARQL query on the nanopubs and the admin graph."""
+        with self._lock:
+            return self._dataset.query(query)
+
+    def query_template(self, name: str, params: Dict[str, str]):
+        """Run one of the QUERY_TEMPLATES with the given parameters."""
+        filters: List[str] = []
+        if params.get("pubkey"):
+            filters.append(f"FILTER(?pubkey = {Literal(params['pubkey']).n3()})")
+        if name not in ALL_NANOPUBS_QUERIES:
+            filters.append(FILTER_RETRACTED)
+        query = QUERY_TEMPLATES[name](params).replace("%(filters)s", "\n    ".join(filters))
+        return self.query(QUERY_PREFIXES + query)
+
+    def _index(self, np: Nanopub) -> None:
+        """Add the quads of a nanopub to the dataset, and its description to the admin graph."""
+        self._dataset.addN((s, p, o, self._dataset.graph(g)) for s, p, o, g in np.rdf.quads())
+        np_uri = URIRef(np.source_uri)
+        created = next(np.pubinfo.objects(np_uri, DCTERMS.created), None) or \
+            next(np.pubinfo.objects(np_uri, PROV.generatedAtTime), None) or \
+            Literal(datetime.now(timezone.utc).isoformat())
+        admin = self._dataset.graph(NPA.graph)
+        admin.add((np_uri, NP.hasAssertion, np.assertion.identifier))
+        admin.add((np_uri, NP.hasPublicationInfo, np.pubinfo.identifier))
+        admin.add((np_uri, NPA.hasValidSignatureForPublicKey, Literal(np.signed_with_public_key)))
+        admin.add((np_uri, DCTERMS.created, Literal(str(created))))
+        for target in np.assertion.objects(None, NPX.retracts):
+            admin.add((np_uri, NPX.invalidates, target))
+        for target in np.pubinfo.objects(np_uri, NPX.supersedes):
+            admin.add((np_uri, NPX.invalidates, target))
+
+    def _inject_faults(self) -> bool:
+        """Sleep the configured latency, and return True if the request must fail."""
+        with self._lock:
+            delay = self.latency + self._random.uniform(-self.latency_jitter, self.latency_jitter)
+            fail = self._random.random() < self.failure_rate
+        if delay > 0:
+            time.sleep(delay)
+        if fail:
+            self.count("injected_failures")
+        return fail
+
+    def count(self, name: str) -> None:
+        """Increment one of the request counters of `stats`."""
+        with self._lock:
+            self.stats[name] += 1
+
+
+class _Handler(BaseHTTPRequestHandler):
+    """Request handler of the LocalNanopubServer."""
+
+    protocol_version = "HTTP/1.1"
+
+    @property
+    def nanopubs(self) -> LocalNanopubServer:
+        return self.server.nanopub_server  # type: ignore[attr-defined]
+
+    def log_message(self, format, *args) -> None:
+        log.debug(f"Local nanopub server: {format % args}")
+
+    def do_GET(self) -> None:
+        self._handle("GET")
+
+    def do_POST(self) -> None:
+        self._handle("POST")
+
+    def _handle(self, method: str) -> None:
+        url = urlparse(self.path)
+        params = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        body = self._read_body() if method == "POST" else b""
+        if self.nanopubs._inject_faults():
+            return self._send(self.nanopubs.failure_status, b"Injected failure", "text/plain")
+        parts = [part for part in url.path.split("/") if part]
+        try:
+            if parts[:1] == ["np"] and method == "POST":
+                return self._publish(body)
+            if parts[:1] == ["np"] and len(parts) == 2:
+                return self._fetch(parts[1])
+            if parts[:1] == ["api"] and len(parts) >= 2:
+                return self._query_template(parts[-1], params)
+            if parts[:1] == ["repo"]:
+                return self._sparql(method, params, body)
+        except MalformedNanopubError as e:
+            return self._send(400, str(e).encode(), "text/plain")
+        except Exception as e:
+            log.warning(f"Local nanopub server failed to answer {method} {self.path}: {e}")
+            return self._send(500, str(e).encode(), "text/plain")
+        self._send(404, b"Not found", "text/plain")
+
+    def _read_body(self) -> bytes:
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        if self.headers.get("Content-Encoding") == "gzip":
+            body = gzip.decompress(body)
+        return body
+
+    def _publish(self, body: bytes) -> None:
+        content_type = (self.headers.get("Content-Type") or "").split(";")[0].strip()
+        uri = self.nanopubs.add(body.decode("utf-8"), UPLOAD_FORMATS.get(content_type, "trig"))
+        self.nanopubs.count("publish")
+        self._send(201, uri.encode(), "text/plain", {"Location": uri})
+
+    def _fetch(self, name: str) -> None:
+        trusty, _, extension = name.partition(".")
+        rdf_format, content_type = FETCH_FORMATS.get(extension or "trig", FETCH_FORMATS["trig"])
+        data = self.nanopubs.get(trusty, rdf_format)
+        if data is None:
+            return self._send(404, b"Nanopub not found", "text/plain")
+        self.nanopubs.count("fetch")
+        self._send(200, data.encode("utf-8"), content_type)
+
+    def _query_template(self, name: str, params: Dict[str, str]) -> None:
+        if name not in QUERY_TEMPLATES:
+            return self._send(404, f"Unknown query {name}".encode(), "text/plain")
+        self.nanopubs.count("query")
+        self._send_results(self.nanopubs.query_template(name, params))
+
+    def _sparql(self, method: str, params: Dict[str, str], body: bytes) -> None:
+        content_type = (self.headers.get("Content-Type") or "").split(";")[0].strip()
+        if method == "POST" and content_type == "application/sparql-query":
+            query = body.decode("utf-8")
+        elif method == "POST":
+            query = {k: v[-1] for k, v in parse_qs(body.decode("utf-8")).items()}.get("query", "")
+        else:
+            query = params.get("query", "")
+        if not query:
+            return self._send(400, b"Missing query", "text/plain")
+        self.nanopubs.count("sparql")
+        self._send_results(self.nanopubs.query(query))
+
+    def _send_results(self, result) -> None:
+        accept = self.headers.get("Accept") or ""
+        if "text/csv" in accept:
+            self._send(200, result.serialize(format="csv"), "text/csv; charset=utf-8")
+        elif "sparql-results+xml" in accept and "json" not in accept:
+            self._send(200, result.serialize(format="xml"), "application/sparql-results+xml")
+        else:
+            self._send(200, result.serialize(format="json"), "application/sparql-results+json")
+
+    def _send(self, status: int, body: bytes, content_type: str, headers: Optional[Dict[str, str]] = None) -> None:
+        if "gzip" in (self.headers.get("Accept-Encoding") or "") and len(body) > 1024:
+            body = gzip.compress(body)
+            headers = {**(headers or {}), "Content-Encoding": "gzip"}
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
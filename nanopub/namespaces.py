@@ -2,6 +2,7 @@
 This module holds handy namespaces that are often used in nanopublications.
 """
 from rdflib import Namespace
+from rdflib.namespace import DCTERMS
 
 NP = Namespace("http://www.nanopub.org/nschema#")
 """Nanopub namespace"""
@@ -9,6 +10,9 @@ NP = Namespace("http://www.nanopub.org/nschema#")
 NPX = Namespace("http://purl.org/nanopub/x/")
 """Nanopub/x namespace"""
 
+NPA = Namespace("http://purl.org/nanopub/admin/")
+"""Nanopub admin namespace, used by the Nanopub Query servers to describe the nanopubs they store"""
+
 NTEMPLATE = Namespace("https://w3id.org/np/o/ntemplate/")
 """Nanopub template namespace"""
 
@@ -34,4 +38,7 @@ FDOF = Namespace("https://w3id.org/fdof/ontology#")
 """FAIR Digital Object Framework namespace"""
 
 FDOC = Namespace("https://w3id.org/fdoc/o/terms/")
-"""FDO Connect namespace"""
\ No newline at end of file
+"""FDO Connect namespace"""
+
+HAS_SHARD = DCTERMS.requires
+"""Relation from a sharded aggregation FDO to each of its shard nanopubs, which are also its metadata records"""
@@ -6,14 +6,20 @@ import re
 from copy import deepcopy
 from datetime import datetime
 from pathlib import Path
-from typing import Optional, Union, Tuple
+from typing import Dict, Optional, Union, Tuple
 
 import rdflib
 import requests
 from rdflib import BNode, Dataset, Graph, URIRef
 from rdflib.namespace import DC, DCTERMS, FOAF, PROV, RDF, XSD
 
-from nanopub.definitions import MAX_TRIPLES_PER_NANOPUB, NANOPUB_FETCH_FORMAT, TEST_NANOPUB_REGISTRY_URL
+from nanopub.definitions import (
+    MAX_TRIPLES_PER_NANOPUB,
+    NANOPUB_FETCH_FORMAT,
+    NANOPUB_REGISTRY_URLS,
+    TEST_NANOPUB_REGISTRY_URL,
+)
+from nanopub.hedging import fetch_nanopub_hedged, get_trusty_artefact
 from nanopub.namespaces import HYCL, NP, NPX, NTEMPLATE, ORCID, PAV
 from nanopub.nanopub_conf import NanopubConf
 from nanopub.profile import ProfileError
@@ -61,14 +67,12 @@ class Nanopub:
         # source URI, rdflib graph, or file
         if source_uri:
             # If source URI provided we retrieve the nanopub from the servers
-            r = requests.get(source_uri + "." + NANOPUB_FETCH_FORMAT)
-            if not r.ok and self._conf.use_test_server:
-                nanopub_id = source_uri.rsplit("/", 1)[-1]
-                uri_test = TEST_NANOPUB_REGISTRY_URL + nanopub_id
-                r = requests.get(uri_test + "." + NANOPUB_FETCH_FORMAT)
-            r.raise_for_status()
+            r = self._fetch(source_uri)
             self._rdf = self._preformat_graph(Dataset())
-            self._rdf.parse(data=r.text, format=NANOPUB_FETCH_FORMAT)
+            # Parse the nanopub from the response stream, decompressed on the fly
+            r.raw.decode_content = True
+            with r:
+                self._rdf.parse(source=r.raw, format=NANOPUB_FETCH_FORMAT)
 
             self._metadata = extract_np_metadata(self._rdf)
         else:
@@ -146,6 +150,11 @@ class Nanopub:
         self._handle_derived_from(derived_from=self._conf.derived_from)
 
 
+    def _fetch(self, source_uri: str) -> requests.Response:
+        """Retrieve the RDF of a published nanopub from the servers"""
+        return fetch_nanopub_response(source_uri, self._conf)
+
+
     def _preformat_graph(self, g: Dataset) -> Dataset:
         """Add a few default namespaces"""
         g.bind("np", NP)
@@ -175,8 +184,13 @@ class Nanopub:
         self._pubinfo = Graph(self._rdf.store, self._metadata.pubinfo)
 
 
-    def sign(self) -> None:
-        """Sign a Nanopub object"""
+    def sign(self, timings: Optional[Dict[str, float]] = None) -> None:
+        """Sign a Nanopub object
+
+        Args:
+            timings: If given, the CPU time in seconds spent canonicalizing the RDF and computing
+                the RSA signature is added to its "canonicalization" and "rsa" keys.
+        """
         if len(self.rdf) > MAX_TRIPLES_PER_NANOPUB:
             raise MalformedNanopubError(f"Nanopublication contains {len(self.rdf)} triples, which is more than the {MAX_TRIPLES_PER_NANOPUB} authorized")
         if not self._conf.profile:
@@ -186,7 +200,7 @@ class Nanopub:
 
         if self.is_valid:
             self._replace_blank_nodes(self._rdf)
-            signed_g = add_signature(self.rdf, self._conf.profile, self._metadata.namespace, self._pubinfo)
+            signed_g = add_signature(self.rdf, self._conf.profile, self._metadata.namespace, self._pubinfo, timings)
             self.update_from_signed(signed_g)
             log.info(f"Signed {self.source_uri}")
         else:
@@ -198,7 +212,7 @@ class Nanopub:
         if not self.source_uri:
             self.sign()
 
-        publish_graph(self.rdf, use_server=self._conf.use_server)    
+        publish_graph(self.rdf, use_server=self._conf.use_server, compress=self._conf.compress_uploads)
         log.info(f'Published {self.source_uri} to {self._conf.use_server}')
         self.published = True
 
@@ -601,3 +615,35 @@ class Nanopub:
 
                 g.add((s, p, o, c))
         return g
+
+
+def fetch_nanopub_response(source_uri: str, conf: NanopubConf) -> requests.Response:
+    """Request the RDF of a published nanopub from the servers, as a stream.
+
+    Nanopubs published to a custom registry of the conf (e.g. a local one) are fetched from it
+    first, and from the test server if the conf uses it.
+
+    Returns:
+        the response, whose raw stream holds the nanopub in the fetch format.
+    """
+    trusty_artefact = get_trusty_artefact(source_uri)
+    if conf.hedge_fetch_quantile is not None and trusty_artefact and not conf.use_test_server:
+        return fetch_nanopub_hedged(trusty_artefact, quantile=conf.hedge_fetch_quantile)
+    if trusty_artefact and conf.use_server not in NANOPUB_REGISTRY_URLS and not conf.use_test_server:
+        # Nanopubs published to a custom registry (e.g. a local one) are fetched from it first
+        try:
+            r = requests.get(conf.use_server + trusty_artefact + "." + NANOPUB_FETCH_FORMAT, stream=True)
+            if r.ok:
+                return r
+            r.close()
+        except requests.ConnectionError as e:
+            log.info(f"Could not fetch {source_uri} from {conf.use_server}: {e}")
+
+    r = requests.get(source_uri + "." + NANOPUB_FETCH_FORMAT, stream=True)
+    if not r.ok and conf.use_test_server:
+        r.close()
+        nanopub_id = source_uri.rsplit("/", 1)[-1]
+        uri_test = TEST_NANOPUB_REGISTRY_URL + nanopub_id
+        r = requests.get(uri_test + "." + NANOPUB_FETCH_FORMAT, stream=True)
+    r.raise_for_status()
+    return r
@@ -20,6 +20,11 @@ class NanopubConf:
         assertion_attributed_to: Optional str
         publication_attributed_to: Optional str
         derived_from: Optional str
+        hedge_fetch_quantile: when set, nanopubs fetched by trusty URI are requested from
+            another registry if the first one did not answer within this quantile (e.g. 0.95)
+            of the registries latencies. Default is None, no hedging.
+        compress_uploads: send nanopubs gzip compressed when publishing them, for servers
+            accepting `Content-Encoding: gzip` request bodies. Default is False.
     """
 
     profile: Optional[Profile] = None
@@ -38,5 +43,9 @@ class NanopubConf:
 
     derived_from: Optional[str] = None
 
+    hedge_fetch_quantile: Optional[float] = None
+
+    compress_uploads: bool = False
+
 
     dict = asdict
@@ -0,0 +1,362 @@
+"""
+This module holds a durable outbox of signed nanopubs waiting to be published.
+
+The outbox is a SQLite journal recording the state of each nanopub (signed, uploading, published
+or failed), so a publishing job that is interrupted can be resumed without knowing which
+nanopubs already reached the registry, and without publishing them again.
+"""
+import hashlib
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import asdict, dataclass
+from itertools import islice
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Union
+
+import requests
+
+from nanopub.bulk import (
+    DEFAULT_BACKOFF,
+    DEFAULT_MAX_RETRIES,
+    DEFAULT_UPLOAD_WORKERS,
+    PublishInput,
+    _serialize_input,
+    make_publish_session,
+    make_sign_pool,
+    sign_rdf,
+    upload_signed,
+)
+from nanopub.definitions import TEST_NANOPUB_REGISTRY_URL
+from nanopub.nanopub import Nanopub
+from nanopub.nanopub_conf import NanopubConf
+from nanopub.profile import ProfileError
+from nanopub.utils import log
+
+SIGNED = "signed"
+UPLOADING = "uploading"
+PUBLISHED = "published"
+FAILED = "failed"
+STATES = (SIGNED, UPLOADING, PUBLISHED, FAILED)
+
+SIGN_BATCH_SIZE = 1000
+"""Number of nanopubs signed and stored in the outbox in one transaction"""
+
+UPLOAD_LEASE = 600.0
+"""Seconds after which a nanopub left uploading is considered abandoned by its drainer, and queued again"""
+
+UNSIGNED_PREFIX = "unsigned:"
+"""Prefix of the keys of the nanopubs that could not be signed, followed by the hash of their input"""
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox (
+    source_uri TEXT PRIMARY KEY,
+    server TEXT NOT NULL,
+    rdf TEXT NOT NULL,
+    state TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    updated REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS outbox_state ON outbox (state);
+"""
+
+
+@dataclass
+class OutboxItem:
+    """A nanopub stored in the outbox, without its RDF.
+
+    Args:
+        source_uri: Trusty URI of the signed nanopub
+        server: Server the nanopub is published to
+        state: One of signed, uploading, published or failed
+        attempts: Number of times the drainer tried to upload the nanopub
+        error: Description of the last error, if any
+    """
+
+    source_uri: str
+    server: str
+    state: str
+    attempts: int = 0
+    error: Optional[str] = None
+
+    dict = asdict
+
+
+class _RateLimiter:
+    """Space calls to `wait` so that at most `rate` of them return per second."""
+
+    def __init__(self, rate: Optional[float]) -> None:
+        self._interval = 1.0 / rate if rate else 0.0
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self) -> None:
+        if not self._interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            at = max(now, self._next)
+            self._next = at + self._interval
+        time.sleep(max(0.0, at - now))
+
+
+class PublishOutbox:
+    """Durable outbox of signed nanopubs, drained to the nanopub registries.
+
+    Nanopubs are signed when added, and stored with their trusty URI as key, so adding a
+    nanopub that is already in the outbox does nothing, even once it is published.
+    Nanopubs left in the uploading state by an interrupted drain are uploaded again when
+    the outbox is drained once their lease expired, which is safe since publishing a signed
+    nanopub is idempotent. Several processes can drain the same outbox.
+    Nanopubs that cannot be signed are stored as failed, under a key starting with
+    `unsigned:`, and are not published even after `retry_failed`.
+
+    Args:
+        path: Path to the SQLite file of the outbox, created if it does not exist
+    """
+
+    def __init__(self, path: Union[Path, str]) -> None:
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(_SCHEMA)
+        self._drain_thread: Optional[threading.Thread] = None
+        self._stop_draining = threading.Event()
+
+    def close(self) -> None:
+        self.stop_draining()
+        self._db.close()
+
+    def __enter__(self) -> "PublishOutbox":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def add(
+        self,
+        nanopubs: Iterable[PublishInput],
+        conf: NanopubConf = NanopubConf(),
+        sign_workers: Optional[int] = None,
+    ) -> List[Optional[str]]:
+        """Sign nanopubs and store them in the outbox, to be published to the server of the conf.
+
+        A nanopub that cannot be signed is stored as failed with the error, the other ones
+        are still added.
+
+        Args:
+            nanopubs: Nanopub objects, rdflib Datasets, or paths to trig/nquads files
+            conf: Configuration giving the profile used to sign, and the server to publish to
+            sign_workers: Number of signing processes, defaults to the number of CPUs.
+                Use 0 to sign in the current process.
+
+        Returns:
+            the trusty URIs of the nanopubs, in the input order, None for the ones that could not be signed.
+        """
+        server = TEST_NANOPUB_REGISTRY_URL if conf.use_test_server else conf.use_server
+        pool = make_sign_pool(sign_workers)
+        source_uris: List[Optional[str]] = []
+        try:
+            items = iter(nanopubs)
+            while batch := list(islice(items, SIGN_BATCH_SIZE)):
+                signed = self._sign_batch(batch, conf, pool)
+                now = time.time()
+                with self._lock, self._db:
+                    self._db.executemany(
+                        "INSERT OR IGNORE INTO outbox (source_uri, server, rdf, state, error, updated) "
+                        "VALUES (?, ?, ?, ?, ?, ?)",
+                        [
+                            (source_uri, server, rdf, FAILED if error else SIGNED, error, now)
+                            for source_uri, rdf, error in signed
+                        ],
+                    )
+                source_uris.extend(None if error else source_uri for source_uri, _, error in signed)
+        finally:
+            if pool is not None:
+                pool.shutdown()
+        failed = source_uris.count(None)
+        log.info(f"Added {len(source_uris) - failed} nanopubs to the outbox {self.path}, {failed} could not be signed")
+        return source_uris
+
+    def _sign_batch(self, batch: List[PublishInput], conf: NanopubConf, pool: Optional[ProcessPoolExecutor]):
+        """Sign the nanopubs that are not signed yet, returning (source_uri, rdf, error) tuples.
+
+        The nanopubs that cannot be signed get the error, and a key made from their input.
+        """
+        if conf.profile is None and not all(isinstance(item, Nanopub) and item.source_uri for item in batch):
+            raise ProfileError("Profile not available, cannot sign the nanopubs")
+        pending = []
+        for item in batch:
+            try:
+                data, rdf_format, source_uri = _serialize_input(item)
+            except Exception as e:
+                pending.append((_unsigned_key(str(item)), "", e))
+                continue
+            if source_uri:
+                pending.append((source_uri, data, None))
+                continue
+            add_conf_triples = not isinstance(item, Nanopub)
+            if pool is not None:
+                signing = pool.submit(sign_rdf, data, rdf_format, conf, add_conf_triples)
+            else:
+                signing = Future()
+                try:
+                    signing.set_result(sign_rdf(data, rdf_format, conf, add_conf_triples))
+                except Exception as e:
+                    signing.set_exception(e)
+            pending.append((signing, data, None))
+        signed = []
+        for key, data, error in pending:
+            if isinstance(key, Future):
+                try:
+                    key, data = key.result()
+                except Exception as e:
+                    key, error = _unsigned_key(data), e
+            if error is not None:
+                log.warning(f"Cannot sign the nanopub {key}: {error}")
+                error = f"{type(error).__name__}: {error}"
+            signed.append((key, data, error))
+        return signed
+
+    def status(self) -> Dict[str, int]:
+        """Number of nanopubs in each state."""
+        with self._lock:
+            counts = dict(self._db.execute("SELECT state, COUNT(*) FROM outbox GROUP BY state").fetchall())
+        return {state: counts.get(state, 0) for state in STATES}
+
+    def items(self, state: Optional[str] = None) -> List[OutboxItem]:
+        """List the nanopubs of the outbox, optionally only the ones in the given state."""
+        query = "SELECT source_uri, server, state, attempts, error FROM outbox"
+        args: tuple = ()
+        if state:
+            query += " WHERE state = ?"
+            args = (state,)
+        with self._lock:
+            rows = self._db.execute(query + " ORDER BY rowid", args).fetchall()
+        return [OutboxItem(*row) for row in rows]
+
+    def retry_failed(self) -> int:
+        """Put the failed nanopubs back in the queue, returning how many there were.
+
+        The nanopubs that could not be signed stay failed, they must be fixed and added again.
+        """
+        with self._lock, self._db:
+            cursor = self._db.execute(
+                "UPDATE outbox SET state = ?, updated = ? WHERE state = ? AND source_uri NOT LIKE ?",
+                (SIGNED, time.time(), FAILED, UNSIGNED_PREFIX + "%"),
+            )
+        return cursor.rowcount
+
+    def drain(
+        self,
+        workers: int = DEFAULT_UPLOAD_WORKERS,
+        max_retries: int = DEFAULT_MAX_RETRIES,
+        backoff: float = DEFAULT_BACKOFF,
+        rate_limit: Optional[float] = None,
+        session: Optional[requests.Session] = None,
+        compress: bool = False,
+        lease: float = UPLOAD_LEASE,
+    ) -> Dict[str, int]:
+        """Publish the signed nanopubs of the outbox, until none is left.
+
+        Each nanopub is retried on transient errors, and marked as failed once the retries
+        are exhausted. Failed nanopubs are only tried again after `retry_failed`.
+
+        Args:
+            workers: Number of uploads running at the same time
+            max_retries: Number of times an upload is retried after a transient error
+            backoff: Delay in seconds before the first retry, doubled after each attempt
+            rate_limit: Maximum number of uploads started per second, no limit if None
+            session: Session used for the uploads
+            compress: Send the nanopubs gzip compressed, the servers must accept it
+            lease: Seconds after which the nanopubs left uploading by another drain are uploaded
+                again. It must be longer than the time taken to upload `4 * workers` nanopubs.
+
+        Returns:
+            the number of nanopubs in each state once drained.
+        """
+        self._recover(lease)
+        session = session or make_publish_session(workers)
+        limiter = _RateLimiter(rate_limit)
+
+        def upload(item: OutboxItem, rdf: str) -> None:
+            limiter.wait()
+            try:
+                upload_signed(rdf, item.server, session, max_retries=max_retries, backoff=backoff, compress=compress)
+            except Exception as e:
+                log.warning(f"Publishing {item.source_uri} to {item.server} failed: {e}")
+                self._set_state(item.source_uri, FAILED, f"{type(e).__name__}: {e}")
+            else:
+                self._set_state(item.source_uri, PUBLISHED)
+
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            while not self._stop_draining.is_set():
+                batch = self._claim(4 * workers)
+                if not batch:
+                    break
+                list(pool.map(lambda row: upload(*row), batch))
+        return self.status()
+
+    def start_draining(self, interval: float = 10.0, **drain_kwargs) -> None:
+        """Start a background thread draining the outbox every `interval` seconds.
+
+        The keyword arguments are passed to `drain`.
+        """
+        if self._drain_thread is not None and self._drain_thread.is_alive():
+            return
+        self._stop_draining.clear()
+
+        def run():
+            while not self._stop_draining.is_set():
+                try:
+                    self.drain(**drain_kwargs)
+                except Exception as e:
+                    log.warning(f"Draining the outbox {self.path} failed: {e}")
+                self._stop_draining.wait(interval)
+
+        self._drain_thread = threading.Thread(target=run, daemon=True)
+        self._drain_thread.start()
+
+    def stop_draining(self) -> None:
+        self._stop_draining.set()
+        if self._drain_thread is not None:
+            self._drain_thread.join()
+            self._drain_thread = None
+        self._stop_draining.clear()
+
+    def _recover(self, lease: float) -> None:
+        """Queue again the nanopubs claimed more than `lease` seconds ago, by a drain that was interrupted."""
+        with self._lock, self._db:
+            cursor = self._db.execute(
+                "UPDATE outbox SET state = ? WHERE state = ? AND updated < ?", (SIGNED, UPLOADING, time.time() - lease)
+            )
+        if cursor.rowcount:
+            log.info(f"Resuming {cursor.rowcount} interrupted uploads from the outbox {self.path}")
+
+    def _claim(self, size: int) -> List[tuple]:
+        """Mark up to `size` signed nanopubs as uploading, and return them with their RDF."""
+        with self._lock, self._db:
+            rows = self._db.execute(
+                "SELECT source_uri, server, state, attempts, error, rdf FROM outbox WHERE state = ? ORDER BY rowid LIMIT ?",
+                (SIGNED, size),
+            ).fetchall()
+            self._db.executemany(
+                "UPDATE outbox SET state = ?, attempts = attempts + 1, updated = ? WHERE source_uri = ?",
+                [(UPLOADING, time.time(), row[0]) for row in rows],
+            )
+        return [(OutboxItem(*row[:5]), row[5]) for row in rows]
+
+    def _set_state(self, source_uri: str, state: str, error: Optional[str] = None) -> None:
+        with self._lock, self._db:
+            self._db.execute(
+                "UPDATE outbox SET state = ?, error = ?, updated = ? WHERE source_uri = ?",
+                (state, error, time.time(), source_uri),
+            )
+
+
+def _unsigned_key(data: str) -> str:
+    """Key of a nanopub that could not be signed, from its serialized input."""
+    return UNSIGNED_PREFIX + hashlib.sha256(data.encode("utf-8")).hexdigest()
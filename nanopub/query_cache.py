@@ -0,0 +1,292 @@
+"""
+This module holds caches for the results of queries sent to the Nanopub Query servers.
+"""
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from concurrent.futures import Future
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, Optional, Tuple, Union
+
+from nanopub.utils import log
+
+
+def make_cache_key(endpoint: str, params: Optional[dict] = None, servers: Optional[Iterable[str]] = None) -> str:
+    """Build a cache key from a query endpoint, its parameters and the servers answering it.
+
+    Parameters are sorted and stringified, and parameters set to None are dropped, so that
+    the same query always gives the same key whatever the order of the parameters. The
+    servers are part of the key, so a cache shared by clients of different servers, e.g. the
+    test and production ones, does not mix their results.
+    """
+    normalized = sorted((str(k), str(v)) for k, v in (params or {}).items() if v is not None)
+    return json.dumps([endpoint, normalized, sorted(servers or [])], separators=(",", ":"))
+
+
+@dataclass
+class CacheStats:
+    """Counters describing how a QueryCache has been used."""
+
+    hits: int = 0
+    misses: int = 0
+    stale_hits: int = 0
+    revalidations: int = 0
+    revalidation_errors: int = 0
+    evictions: int = 0
+
+    @property
+    def hit_ratio(self) -> float:
+        lookups = self.hits + self.stale_hits + self.misses
+        return (self.hits + self.stale_hits) / lookups if lookups else 0.0
+
+    def dict(self) -> dict:
+        return {**asdict(self), "hit_ratio": self.hit_ratio}
+
+
+class QueryCache(ABC):
+    """Base class for query result caches.
+
+    A cached entry is fresh for `ttl` seconds. After that it can still be served for
+    `stale_ttl` more seconds while it is refreshed in a background thread
+    (stale-while-revalidate). Subclasses only implement how entries are stored.
+
+    Args:
+        ttl: Number of seconds a result is considered fresh
+        stale_ttl: Number of seconds a result can be served stale after it expired
+        clock: Function returning the current time in seconds
+    """
+
+    def __init__(
+        self,
+        ttl: float = 300,
+        stale_ttl: float = 0,
+        clock: Callable[[], float] = time.time,
+    ) -> None:
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.stats = CacheStats()
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._revalidating: set = set()
+
+    @abstractmethod
+    def _load(self, key: str) -> Optional[Tuple[float, Any]]:
+        """Return the (stored_at, value) entry for the key, or None if missing."""
+
+    @abstractmethod
+    def _save(self, key: str, stored_at: float, value: Any) -> None:
+        """Store the entry of the key."""
+
+    @abstractmethod
+    def _delete(self, key: str) -> None:
+        """Remove the entry of the key, if any."""
+
+    @abstractmethod
+    def clear(self) -> None:
+        """Remove all entries from the cache."""
+
+    def get(self, key: str) -> Optional[Any]:
+        """Return the value stored for the key if it is still fresh, None otherwise."""
+        entry = self._load(key)
+        if entry is None or self._clock() - entry[0] > self.ttl:
+            return None
+        return entry[1]
+
+    def set(self, key: str, value: Any) -> None:
+        """Store a value for the key."""
+        self._save(key, self._clock(), value)
+
+    def invalidate(self, key: str) -> None:
+        """Remove the value stored for the key."""
+        self._delete(key)
+
+    def get_or_fetch(self, key: str, fetch: Callable[[], Any]) -> Any:
+        """Return the cached value for the key, calling fetch() to get it when needed.
+
+        Stale values are returned immediately, and refreshed with fetch() in the background.
+        """
+        entry = self._load(key)
+        if entry is not None:
+            stored_at, value = entry
+            age = self._clock() - stored_at
+            if age <= self.ttl:
+                with self._lock:
+                    self.stats.hits += 1
+                return value
+            if age <= self.ttl + self.stale_ttl:
+                with self._lock:
+                    self.stats.stale_hits += 1
+                self._revalidate_in_background(key, fetch)
+                return value
+        with self._lock:
+            self.stats.misses += 1
+        value = fetch()
+        self.set(key, value)
+        return value
+
+    def _revalidate_in_background(self, key: str, fetch: Callable[[], Any]) -> None:
+        with self._lock:
+            if key in self._revalidating:
+                return
+            self._revalidating.add(key)
+        thread = threading.Thread(target=self._revalidate, args=(key, fetch), daemon=True)
+        thread.start()
+
+    def _revalidate(self, key: str, fetch: Callable[[], Any]) -> None:
+        try:
+            self.set(key, fetch())
+            with self._lock:
+                self.stats.revalidations += 1
+        except Exception as e:
+            log.warning(f"Could not revalidate cached query result {key}: {e}")
+            with self._lock:
+                self.stats.revalidation_errors += 1
+        finally:
+            with self._lock:
+                self._revalidating.discard(key)
+
+
+class MemoryQueryCache(QueryCache):
+    """In-memory least recently used query result cache.
+
+    Args:
+        maxsize: Maximum number of query results kept in memory
+        ttl: Number of seconds a result is considered fresh
+        stale_ttl: Number of seconds a result can be served stale after it expired
+        clock: Function returning the current time in seconds
+    """
+
+    def __init__(
+        self,
+        maxsize: int = 1024,
+        ttl: float = 300,
+        stale_ttl: float = 0,
+        clock: Callable[[], float] = time.time,
+    ) -> None:
+        super().__init__(ttl=ttl, stale_ttl=stale_ttl, clock=clock)
+        self.maxsize = maxsize
+        self._entries: OrderedDict = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _load(self, key: str) -> Optional[Tuple[float, Any]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def _save(self, key: str, stored_at: float, value: Any) -> None:
+        with self._lock:
+            self._entries[key] = (stored_at, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.stats.evictions += 1
+
+    def _delete(self, key: str) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+class DiskQueryCache(QueryCache):
+    """On-disk query result cache, storing one JSON file per query in a directory.
+
+    Cached values need to be JSON serializable, which is the case for the results
+    returned by the NanopubClient search methods.
+
+    Args:
+        directory: Path to the directory where the results are stored
+        ttl: Number of seconds a result is considered fresh
+        stale_ttl: Number of seconds a result can be served stale after it expired
+        clock: Function returning the current time in seconds
+    """
+
+    def __init__(
+        self,
+        directory: Union[Path, str],
+        ttl: float = 300,
+        stale_ttl: float = 0,
+        clock: Callable[[], float] = time.time,
+    ) -> None:
+        super().__init__(ttl=ttl, stale_ttl=stale_ttl, clock=clock)
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    def _path(self, key: str) -> Path:
+        return self.directory / f"{hashlib.sha256(key.encode('utf-8')).hexdigest()}.json"
+
+    def _load(self, key: str) -> Optional[Tuple[float, Any]]:
+        try:
+            with open(self._path(key), encoding="utf-8") as f:
+                entry = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+        if entry.get("key") != key:
+            return None
+        return entry["stored_at"], entry["value"]
+
+    def _save(self, key: str, stored_at: float, value: Any) -> None:
+        # Write to a temporary file first, so readers never see a partially written entry
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump({"key": key, "stored_at": stored_at, "value": value}, f)
+            os.replace(tmp_path, self._path(key))
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def _delete(self, key: str) -> None:
+        try:
+            self._path(key).unlink()
+        except FileNotFoundError:
+            pass
+
+    def clear(self) -> None:
+        for path in self.directory.glob("*.json"):
+            path.unlink()
+
+
+class SingleFlight:
+    """Share the calls made at the same time for the same key.
+
+    A call for a key whose call is already running waits for it, and gets its result or its
+    exception, instead of calling the function again. Used with a cache, duplicated keys
+    processed concurrently lead to one request.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._in_flight: Dict[str, Future] = {}
+
+    def do(self, key: str, fn: Callable[[], Any]) -> Any:
+        """Return fn(), or the result of the call already running for the key."""
+        with self._lock:
+            future = self._in_flight.get(key)
+            owner = future is None
+            if owner:
+                future = self._in_flight[key] = Future()
+        if not owner:
+            return future.result()
+        try:
+            result = fn()
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._in_flight[key]
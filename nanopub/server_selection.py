@@ -0,0 +1,225 @@
+"""
+This module holds the logic used to pick which of several interchangeable nanopub servers to send a request to.
+"""
+import random
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Callable, Deque, Dict, Iterable, List, Optional, Tuple
+
+import requests
+
+from nanopub.utils import log
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half-open"
+
+MAX_ERROR_RATE = 0.9
+"""Error rate above which the latency of a server is not penalized more when ranking servers"""
+
+
+@dataclass
+class ServerStats:
+    """Latency and error statistics of one server, and the state of its circuit breaker."""
+
+    url: str
+    latency: Optional[float] = None
+    latencies: Deque[float] = field(default_factory=lambda: deque(maxlen=200))
+    outcomes: Deque[bool] = field(default_factory=lambda: deque(maxlen=200))
+    successes: int = 0
+    failures: int = 0
+    consecutive_failures: int = 0
+    opened_at: Optional[float] = None
+
+    @property
+    def error_rate(self) -> float:
+        """Share of the last 200 requests to the server that failed."""
+        return self.outcomes.count(False) / len(self.outcomes) if self.outcomes else 0.0
+
+
+def percentile(values: List[float], q: float) -> float:
+    """Return the q-th quantile (between 0 and 1) of a non-empty list of values."""
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(q * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+def probe_server(url: str, timeout: float = 5) -> bool:
+    """Default health check for a server: it is up if its URL answers with a success status."""
+    try:
+        return 200 <= requests.get(url, timeout=timeout).status_code < 300
+    except requests.RequestException:
+        return False
+
+
+class ServerSelector:
+    """Route requests to the fastest healthy server among a list of interchangeable servers.
+
+    The latency of each server is tracked as an exponentially weighted moving average.
+    After `failure_threshold` consecutive failures the circuit of a server is opened, and it
+    is only tried again (half-open) once `reset_timeout` seconds have passed, or when a
+    background probe finds it is up again.
+
+    Args:
+        urls: URLs of the servers
+        failure_threshold: Number of consecutive failures after which a server circuit is opened
+        reset_timeout: Number of seconds after which an open circuit lets a request through again
+        ewma_alpha: Weight of the last request in the moving average of the latency
+        clock: Function returning the current time in seconds
+        probe_when_open: Start probing the servers in the background when a circuit opens
+    """
+
+    def __init__(
+        self,
+        urls: Iterable[str],
+        failure_threshold: int = 3,
+        reset_timeout: float = 30.0,
+        ewma_alpha: float = 0.3,
+        clock: Callable[[], float] = time.monotonic,
+        probe_when_open: bool = False,
+    ) -> None:
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.ewma_alpha = ewma_alpha
+        self._clock = clock
+        self.probe_when_open = probe_when_open
+        self._lock = threading.Lock()
+        self._probe_lock = threading.Lock()
+        self._stats: Dict[str, ServerStats] = {url: ServerStats(url) for url in urls}
+        self._probe_thread: Optional[threading.Thread] = None
+        self._stop_probing = threading.Event()
+
+    @property
+    def urls(self) -> List[str]:
+        return list(self._stats.keys())
+
+    def stats(self, url: str) -> ServerStats:
+        return self._stats[url]
+
+    def state(self, url: str) -> str:
+        """Return the state of the circuit breaker of a server: closed, open or half-open."""
+        stats = self._stats[url]
+        if stats.opened_at is None:
+            return CLOSED
+        if self._clock() - stats.opened_at >= self.reset_timeout:
+            return HALF_OPEN
+        return OPEN
+
+    def ordered(self) -> List[str]:
+        """Return the servers in the order in which they should be tried.
+
+        Healthy servers come first, fastest first, their latency being divided by their rate
+        of success, since a failed request has to be sent to another server. Servers without
+        latency measurement yet are tried first in random order, to measure them and balance
+        the load. Servers with an open circuit are only returned last, as a last resort.
+        """
+        with self._lock:
+            servers = list(self._stats.values())
+            random.shuffle(servers)
+            states = {s.url: self.state(s.url) for s in servers}
+        rank = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+        servers.sort(key=lambda s: (
+            rank[states[s.url]],
+            s.latency is not None,
+            (s.latency or 0.0) / (1 - min(s.error_rate, MAX_ERROR_RATE)),
+        ))
+        return [s.url for s in servers]
+
+    def record_success(self, url: str, latency: float) -> None:
+        with self._lock:
+            stats = self._stats[url]
+            stats.successes += 1
+            stats.outcomes.append(True)
+            stats.consecutive_failures = 0
+            if stats.opened_at is not None:
+                log.info(f"Closing the circuit of {url}, the server is responding again")
+            stats.opened_at = None
+            stats.latencies.append(latency)
+            if stats.latency is None:
+                stats.latency = latency
+            else:
+                stats.latency = self.ewma_alpha * latency + (1 - self.ewma_alpha) * stats.latency
+
+    def record_failure(self, url: str) -> None:
+        with self._lock:
+            stats = self._stats[url]
+            stats.failures += 1
+            stats.outcomes.append(False)
+            stats.consecutive_failures += 1
+            opening = stats.opened_at is None and stats.consecutive_failures >= self.failure_threshold
+            if stats.opened_at is not None or opening:
+                if opening:
+                    log.warning(f"Opening the circuit of {url} after {stats.consecutive_failures} failures")
+                stats.opened_at = self._clock()
+        if opening and self.probe_when_open:
+            self.start_probing()
+
+    def latency_percentile(self, q: float, url: Optional[str] = None) -> Optional[float]:
+        """Return the q-th quantile (between 0 and 1) of the observed latencies.
+
+        Computed for the given server, or over all servers if no URL is given.
+        Returns None if no latency has been recorded yet.
+        """
+        with self._lock:
+            if url is not None:
+                values = list(self._stats[url].latencies)
+            else:
+                values = [v for s in self._stats.values() for v in s.latencies]
+        if not values:
+            return None
+        return percentile(values, q)
+
+    def probe_open_servers(self, probe: Callable[[str], bool] = probe_server) -> None:
+        """Check the servers which circuit is open, and close the circuit of the ones that are up."""
+        for url in self.urls:
+            if self.state(url) == CLOSED:
+                continue
+            start = self._clock()
+            if probe(url):
+                self.record_success(url, self._clock() - start)
+            else:
+                with self._lock:
+                    self._stats[url].opened_at = self._clock()
+
+    def start_probing(self, interval: float = 30.0, probe: Callable[[str], bool] = probe_server) -> None:
+        """Start a background thread probing the servers which circuit is open every `interval` seconds."""
+        with self._probe_lock:
+            if self._probe_thread is not None and self._probe_thread.is_alive():
+                return
+            self._stop_probing.clear()
+
+            def run():
+                while not self._stop_probing.wait(interval):
+                    try:
+                        self.probe_open_servers(probe)
+                    except Exception as e:
+                        log.warning(f"Probing nanopub servers failed: {e}")
+
+            self._probe_thread = threading.Thread(target=run, daemon=True)
+            self._probe_thread.start()
+
+    def stop_probing(self) -> None:
+        with self._probe_lock:
+            self._stop_probing.set()
+            if self._probe_thread is not None:
+                self._probe_thread.join()
+                self._probe_thread = None
+
+
+_shared_selectors: Dict[Tuple[str, ...], ServerSelector] = {}
+_shared_selectors_lock = threading.Lock()
+
+
+def shared_selector(urls: Iterable[str]) -> ServerSelector:
+    """Return the selector shared by every user of the same servers, in this process.
+
+    The statistics of the servers are then gathered from all the clients, and the servers
+    which circuit is open are probed in the background, from the first circuit opened.
+    """
+    key = tuple(sorted(set(urls)))
+    with _shared_selectors_lock:
+        if key not in _shared_selectors:
+            _shared_selectors[key] = ServerSelector(key, probe_when_open=True)
+        return _shared_selectors[key]
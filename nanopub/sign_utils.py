@@ -1,4 +1,9 @@
+import gzip
+import io
+import time
 from base64 import decodebytes, encodebytes
+from contextlib import contextmanager
+from typing import Dict, Optional, Tuple, Union
 
 import requests
 from Crypto.Hash import SHA256
@@ -14,8 +19,29 @@ from nanopub.trustyuri.rdf.RdfPreprocessor import transform
 from nanopub.utils import MalformedNanopubError, extract_np_metadata, log
 
 
-def add_signature(g: Dataset, profile: Profile, dummy_namespace: Namespace, pubinfo_g: Graph) -> Dataset:
-    """Implementation in python of the process to sign a nanopub with a RSA private key"""
+@contextmanager
+def cpu_timer(timings: Optional[Dict[str, float]], key: str):
+    """Add the CPU time spent by the current thread in the block to `timings[key]`, if timings is not None."""
+    start = time.thread_time()
+    try:
+        yield
+    finally:
+        if timings is not None:
+            timings[key] = timings.get(key, 0.0) + time.thread_time() - start
+
+
+def add_signature(
+    g: Dataset,
+    profile: Profile,
+    dummy_namespace: Namespace,
+    pubinfo_g: Graph,
+    timings: Optional[Dict[str, float]] = None,
+) -> Dataset:
+    """Implementation in python of the process to sign a nanopub with a RSA private key
+
+    If a `timings` dict is given, the CPU time in seconds spent canonicalizing the RDF and
+    computing the RSA signature is added to its "canonicalization" and "rsa" keys.
+    """
     g.add((
         dummy_namespace["sig"],
         NPX["hasPublicKey"],
@@ -41,19 +67,21 @@ def add_signature(g: Dataset, profile: Profile, dummy_namespace: Namespace, pubi
         pubinfo_g,
     ))
     # Normalize RDF
-    quads = RdfUtils.get_quads(g)
-    normed_rdf = RdfHasher.normalize_quads(
-        quads,
-        baseuri=str(dummy_namespace),
-        hashstr=" "
-    )
+    with cpu_timer(timings, "canonicalization"):
+        quads = RdfUtils.get_quads(g)
+        normed_rdf = RdfHasher.normalize_quads(
+            quads,
+            baseuri=str(dummy_namespace),
+            hashstr=" "
+        )
     # Note: normed_rdf needs to end with a newline
     # print(f"NORMED RDF STARTS\n{normed_rdf}\nNORMED RDF ENDS")
 
     # Sign the normalized RDF with the private RSA key
-    private_key = RSA.import_key(decodebytes(profile.private_key.encode()))
-    signer = PKCS1_v1_5.new(private_key)
-    signature_b = signer.sign(SHA256.new(normed_rdf.encode()))
+    with cpu_timer(timings, "rsa"):
+        private_key = RSA.import_key(decodebytes(profile.private_key.encode()))
+        signer = PKCS1_v1_5.new(private_key)
+        signature_b = signer.sign(SHA256.new(normed_rdf.encode()))
     signature = encodebytes(signature_b).decode().replace("\n", "")
     log.debug(f"Nanopub signature: {signature}")
 
@@ -66,12 +94,13 @@ def add_signature(g: Dataset, profile: Profile, dummy_namespace: Namespace, pubi
     ))
 
     # Generate the trusty URI
-    quads = RdfUtils.get_quads(g)
-    trusty_artefact = RdfHasher.make_hash(
-        quads,
-        baseuri=str(dummy_namespace),
-        hashstr=" "
-    )
+    with cpu_timer(timings, "canonicalization"):
+        quads = RdfUtils.get_quads(g)
+        trusty_artefact = RdfHasher.make_hash(
+            quads,
+            baseuri=str(dummy_namespace),
+            hashstr=" "
+        )
     log.debug(f"Trusty artefact: {trusty_artefact}")
 
     g = replace_trusty_in_graph(trusty_artefact, str(dummy_namespace), g)
@@ -113,14 +142,47 @@ def replace_trusty_in_graph(trusty_artefact: str, dummy_ns: str, graph: Dataset)
     return graph
 
 
-def publish_graph(g: Dataset, use_server: str = NANOPUB_REGISTRY_URLS[0]) -> bool:
+def serialize_upload_body(g: Union[Dataset, str], compress: bool = False) -> Tuple[io.BytesIO, Dict[str, str]]:
+    """Serialize a nanopub as trig bytes to send it to a nanopub server, gzip compressed if asked.
+
+    Args:
+        g: The nanopub, or the nanopub already serialized as trig
+        compress: Compress the body with gzip
+
+    Returns:
+        tuple of: the request body, the request headers.
+    """
+    headers = {'Content-Type': 'application/trig'}
+    body = io.BytesIO()
+    stream = gzip.GzipFile(fileobj=body, mode='wb') if compress else body
+    if compress:
+        headers['Content-Encoding'] = 'gzip'
+    if isinstance(g, str):
+        stream.write(g.encode("utf-8"))
+    else:
+        g.serialize(destination=stream, format="trig")
+    if compress:
+        stream.close()
+    body.seek(0)
+    return body, headers
+
+
+def publish_graph(
+    g: Dataset,
+    use_server: str = NANOPUB_REGISTRY_URLS[0],
+    session: Optional[requests.Session] = None,
+    compress: bool = False,
+) -> bool:
     """Publish a signed nanopub to the given nanopub server.
+
+    A `requests.Session` can be provided to reuse its keep-alive connections when publishing
+    many nanopubs. If `compress` is True the body is sent gzip compressed, which the server
+    must accept.
     """
     log.info(f"Publishing to the nanopub server {use_server}")
-    headers = {'Content-Type': 'application/trig'}
     # NOTE: nanopub-java uses {'Content-Type': 'application/x-www-form-urlencoded'}
-    data = g.serialize(format="trig")
-    r = requests.post(use_server, headers=headers, data=data.encode('utf-8'))
+    body, headers = serialize_upload_body(g, compress)
+    r = (session or requests).post(use_server, headers=headers, data=body)
     r.raise_for_status()
     return True
 
@@ -1,5 +1,6 @@
 from .nanopub_claim import NanopubClaim
-from .nanopub_index import NanopubIndex, create_nanopub_index
+from .nanopub_index import NanopubIndex, append_to_nanopub_index, create_nanopub_index, iter_nanopub_index
 from .nanopub_introduction import NanopubIntroduction
 from .nanopub_retract import NanopubRetract
 from .nanopub_update import NanopubUpdate
+from .table_template import TableTemplate
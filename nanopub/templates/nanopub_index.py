@@ -1,9 +1,12 @@
 from copy import deepcopy
-from typing import List, Union
+from datetime import datetime
+from itertools import chain, islice
+from typing import Iterable, Iterator, List, Optional, Union
 
 from rdflib import Literal, URIRef
 from rdflib.namespace import DC, DCTERMS, RDF, RDFS, XSD
 
+from nanopub.bulk import SigningPipeline
 from nanopub.definitions import DUMMY_NAMESPACE, DUMMY_URI, MAX_NP_PER_INDEX
 from nanopub.namespaces import NPX, PAV
 from nanopub.nanopub import Nanopub
@@ -22,6 +25,8 @@ class NanopubIndex(Nanopub):
         creation_time: Creation time of the Nanopub Index, in format YYYY-MM-DDThh-mm-ss
         creators: List of the ORCID of the creators of the Nanopub Index
         see_also: A URL to a page with further information on the Nanopub Index
+        top_level: Whether the nanopubs of the list are indexes appended by this one, rather than elements
+        appends_index: URI of a previous Nanopub Index appended by this one
     """
 
     def __init__(
@@ -34,6 +39,7 @@ class NanopubIndex(Nanopub):
         creators: List[str],
         see_also: str = None,
         top_level: bool = False,
+        appends_index: Optional[str] = None,
     ) -> None:
         conf = deepcopy(conf)
         conf.add_prov_generated_time = False
@@ -52,6 +58,8 @@ class NanopubIndex(Nanopub):
                 self.assertion.add((DUMMY_URI, NPX.appendsIndex, URIRef(np_uri)))
             else:
                 self.assertion.add((DUMMY_URI, NPX.includesElement, URIRef(np_uri)))
+        if appends_index:
+            self.assertion.add((DUMMY_URI, NPX.appendsIndex, URIRef(appends_index)))
 
         self.pubinfo.add((DUMMY_URI, RDF.type, NPX.NanopubIndex))
         self.pubinfo.add((DUMMY_URI, DC.title, Literal(title)))
@@ -73,6 +81,112 @@ class NanopubIndex(Nanopub):
         self.provenance.add((DUMMY_NAMESPACE.assertion, RDF.type, NPX.IndexAssertion))
 
 
+def _sign_index(
+    conf: NanopubConf,
+    np_uris: List[str],
+    title: str,
+    description: str,
+    creation_time: str,
+    creators: List[str],
+    see_also: Optional[str],
+    top_level: bool,
+    appends_index: Optional[str] = None,
+) -> "NanopubIndex":
+    """Build and sign a Nanopub Index, in the worker processes of `iter_nanopub_index`."""
+    pub = NanopubIndex(
+        conf, np_uris, title, description, creation_time, creators, see_also,
+        top_level=top_level, appends_index=appends_index,
+    )
+    pub.sign()
+    return pub
+
+
+def iter_nanopub_index(
+    conf: NanopubConf,
+    np_list: Iterable[Union[str, Nanopub]],
+    title: str,
+    description: str,
+    creation_time: str,
+    creators: List[str],
+    see_also: str = None,
+    sign_workers: Optional[int] = None,
+    max_pending: Optional[int] = None,
+) -> Iterator[Nanopub]:
+    """Create a Nanopub Index from an iterator of nanopub URIs of any length, yielding the signed indexes.
+
+    The nanopubs are included by chunks of `MAX_NP_PER_INDEX` in leaf indexes, which are
+    appended by chunks of `MAX_NP_PER_INDEX` in indexes of the level above, and so on until a
+    single index is left: the last yielded index is the top level one, which gives access to
+    all the nanopubs. If all the nanopubs fit in a single leaf index, it is the top level one.
+
+    Indexes are signed in a pool of processes while the iterator is consumed, and yielded in
+    the order they were created, as soon as they are signed. Only a bounded number of indexes
+    are kept in memory, so the iterator can give tens of millions of URIs.
+
+    Args:
+        np_list: Iterator of nanopub URIs, or of published Nanopub objects
+        title: Title of the Nanopub Index
+        description: Description of the Nanopub Index
+        creation_time: Creation time of the Nanopub Index, in format YYYY-MM-DDThh-mm-ss
+        creators: List of the ORCID of the creators of the Nanopub Index
+        see_also: A URL to a page with further information on the Nanopub Index
+        sign_workers: Number of signing processes, defaults to the number of CPUs.
+            Use 0 to sign in the current process.
+        max_pending: Maximum number of indexes being signed or waiting to be yielded,
+            defaults to twice the number of signing processes.
+    """
+    pipeline = SigningPipeline(sign_workers, max_pending)
+    # URIs waiting to be included in an index, per level: elements for level 0, indexes above
+    buffers: List[List[str]] = [[]]
+    # Number of URIs added to each level, to find the level with a single index
+    added: List[int] = [0]
+
+    def submit(level: int) -> None:
+        np_uris, buffers[level] = buffers[level], []
+        pipeline.submit(
+            _sign_index, conf, np_uris, title, description, creation_time, creators, see_also, level > 0, tag=level
+        )
+
+    def add(level: int, np_uri: str) -> None:
+        if level == len(buffers):
+            buffers.append([])
+            added.append(0)
+        buffers[level].append(np_uri)
+        added[level] += 1
+        if len(buffers[level]) == MAX_NP_PER_INDEX:
+            submit(level)
+
+    def complete(level: int, pub: Nanopub) -> Nanopub:
+        log.info(f"Signed Nanopub Index of level {level}: {pub.source_uri}")
+        add(level + 1, pub.source_uri)
+        return pub
+
+    with pipeline:
+        for np in np_list:
+            add(0, np.source_uri if isinstance(np, Nanopub) else str(np))
+            for level, pub in pipeline.ready():
+                yield complete(level, pub)
+
+        level = 0
+        while level < len(buffers):
+            if level > 0 and added[level] <= 1:
+                # The single index of the level below is the top level index
+                break
+            lone = None
+            if level > 0 and len(buffers[level]) == 1:
+                # A lone index is appended directly by the level above, rather than wrapped
+                lone = buffers[level].pop()
+            elif buffers[level]:
+                submit(level)
+            # Indexes of this level must be signed before the level above is completed
+            while any(pending_level <= level for pending_level in pipeline.tags):
+                yield complete(*pipeline.pop())
+            if lone is not None:
+                # After the indexes of this level, since it holds the last nanopubs
+                add(level + 1, lone)
+            level += 1
+
+
 def create_nanopub_index(
     conf: NanopubConf,
     np_list: Union[List[str], List[Nanopub]],
@@ -94,36 +208,73 @@ def create_nanopub_index(
         creators: List of the ORCID of the creators of the Nanopub Index
         see_also: A URL to a page with further information on the Nanopub Index
     """
-    pub_list: List[Nanopub] = []
-    for i in range(0, len(np_list), MAX_NP_PER_INDEX):
-        np_chunk = np_list[i:i + MAX_NP_PER_INDEX]
-        pub = NanopubIndex(
-            conf,
-            np_chunk,
-            title,
-            description,
-            creation_time,
-            creators,
-            see_also,
-            top_level=False
-        )
-        pub.sign()
-        log.info(f"Signed Nanopub Index: {pub.source_uri}")
-        pub_list.append(pub)
-
-    if len(pub_list) > 1:
-        toplevel_pub = NanopubIndex(
-            conf,
-            pub_list,
-            title,
-            description,
-            creation_time,
-            creators,
-            see_also,
-            top_level=True
-        )
-        toplevel_pub.sign()
-        log.info(f"Signed top level Nanopub Index: {toplevel_pub.source_uri}")
-        pub_list.append(toplevel_pub)
+    return list(iter_nanopub_index(
+        conf, np_list, title, description, creation_time, creators, see_also, sign_workers=0
+    ))
+
+
+def append_to_nanopub_index(
+    conf: NanopubConf,
+    index: Union[str, Nanopub],
+    np_list: Iterable[Union[str, Nanopub]],
+    title: Optional[str] = None,
+    description: Optional[str] = None,
+    creation_time: Optional[str] = None,
+    creators: Optional[List[str]] = None,
+    see_also: str = None,
+    sign_workers: Optional[int] = 0,
+) -> List[Nanopub]:
+    """Append nanopubs to a published Nanopub Index, without signing its existing indexes again.
+
+    Only indexes for the new nanopubs are created, and a new top level index appends both the
+    previous top level index and the new ones. When the new nanopubs fit in a single index,
+    this index includes them and appends the previous one, so appending a small batch only
+    creates one nanopub, whatever the size of the collection.
+
+    Args:
+        index: URI of the top level index to append to, or the signed index itself
+        np_list: Iterator of the URIs of the nanopubs to add, or of published Nanopub objects
+        title: Title of the new indexes, defaults to the title of the previous index
+        description: Description of the new indexes, defaults to the one of the previous index
+        creation_time: Creation time of the new indexes, in format YYYY-MM-DDThh-mm-ss, defaults to now
+        creators: List of the ORCID of the creators, defaults to the ones of the previous index
+        see_also: A URL to a page with further information, defaults to the one of the previous index
+        sign_workers: Number of processes signing the new indexes, when they do not fit in a
+            single index. Defaults to signing in the current process, use None for one per CPU.
+
+    Returns:
+        the new signed indexes to publish, the last one being the new top level index.
+    """
+    if title is None or description is None or creators is None or see_also is None:
+        if not isinstance(index, Nanopub):
+            index = Nanopub(index, conf=conf)
+        index_uri = URIRef(index.source_uri or index.metadata.np_uri)
+        if title is None:
+            title = str(next(index.pubinfo.objects(index_uri, DC.title), ""))
+        if description is None:
+            description = str(next(index.pubinfo.objects(index_uri, DC.description), ""))
+        if creators is None:
+            creators = [str(creator) for creator in index.pubinfo.objects(index_uri, PAV.createdBy)]
+        if see_also is None:
+            see_also = next(index.pubinfo.objects(index_uri, RDFS.seeAlso), None)
+    if isinstance(index, Nanopub):
+        index = str(index.source_uri or index.metadata.np_uri)
+    creation_time = creation_time or datetime.now().astimezone().replace(microsecond=0).isoformat()
+
+    np_iter = iter(np_list)
+    first = [np.source_uri if isinstance(np, Nanopub) else str(np) for np in islice(np_iter, MAX_NP_PER_INDEX + 1)]
+    if not first:
+        return []
+    if len(first) <= MAX_NP_PER_INDEX:
+        pub = _sign_index(conf, first, title, description, creation_time, creators, see_also, False, index)
+        log.info(f"Signed Nanopub Index {pub.source_uri} appending {index}")
+        return [pub]
 
-    return pub_list
+    pub_list = list(iter_nanopub_index(
+        conf, chain(first, np_iter), title, description, creation_time, creators, see_also, sign_workers=sign_workers
+    ))
+    top = _sign_index(
+        conf, [index, pub_list[-1].source_uri], title, description, creation_time, creators, see_also, True
+    )
+    log.info(f"Signed top level Nanopub Index {top.source_uri} appending {index}")
+    return pub_list + [top]
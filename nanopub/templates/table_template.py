@@ -0,0 +1,262 @@
+"""
+This module holds a template engine generating nanopubs from the rows of a table.
+
+A template is a nanopub whose assertion, provenance and pubinfo graphs contain placeholders like
+`{column}` in their IRIs and literals. It is compiled once, with the triples added by the
+NanopubConf, and each row only fills the placeholders and signs the result, without building a
+Nanopub object. Rows are read from CSV, TSV or JSON lines files, and signed in a pool of processes.
+"""
+import csv
+import json
+from dataclasses import asdict, dataclass
+from itertools import islice
+from pathlib import Path
+from string import Formatter
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+from urllib.parse import quote
+
+from rdflib import Dataset, Graph, Literal, URIRef
+from rdflib.util import guess_format
+
+from nanopub.bulk import SigningPipeline
+from nanopub.definitions import MAX_TRIPLES_PER_NANOPUB
+from nanopub.nanopub import Nanopub
+from nanopub.nanopub_conf import NanopubConf
+from nanopub.profile import ProfileError
+from nanopub.sign_utils import add_signature
+from nanopub.utils import MalformedNanopubError, log
+
+TEMPLATE_BASE = "https://w3id.org/np/table-template/"
+"""Base IRI used to parse templates, so that IRIs made of a single placeholder stay relative"""
+
+ROW_BATCH_SIZE = 100
+"""Number of rows sent at once to a signing process"""
+
+TABLE_FORMATS = {".csv": "csv", ".tsv": "tsv", ".jsonl": "jsonl", ".ndjson": "jsonl"}
+"""Table format of the supported file extensions"""
+
+
+@dataclass
+class TableNanopub:
+    """A nanopub generated from a row of a table by `TableTemplate.generate`.
+
+    Args:
+        index: Position of the row in the table
+        source_uri: Trusty URI of the signed nanopub, None if it could not be generated
+        rdf: The signed nanopub serialized as trig
+        error: Description of the error if the nanopub could not be generated
+    """
+
+    index: int
+    source_uri: Optional[str] = None
+    rdf: Optional[str] = None
+    error: Optional[str] = None
+
+    dict = asdict
+
+
+class _Term:
+    """A term of the template, with the placeholders it contains."""
+
+    def __init__(self, term: Any) -> None:
+        self.term = term
+        self.text = None
+        self.fields: List[str] = []
+        if isinstance(term, (URIRef, Literal)):
+            text = str(term)
+            if isinstance(term, URIRef) and text.startswith(TEMPLATE_BASE):
+                text = text[len(TEMPLATE_BASE):]
+            fields = [field for _, field, _, _ in Formatter().parse(text) if field is not None]
+            if fields:
+                self.text = text
+                self.fields = fields
+        # An IRI made of a single placeholder takes the value as is, otherwise values are percent-encoded
+        self.whole = isinstance(term, URIRef) and len(self.fields) == 1 and self.text == f"{{{self.fields[0]}}}"
+
+    def render(self, row: Dict[str, str]) -> Any:
+        if not self.fields:
+            return self.term
+        if isinstance(self.term, Literal):
+            return Literal(self.text.format_map(row), lang=self.term.language, datatype=self.term.datatype)
+        if self.whole:
+            return URIRef(row[self.fields[0]])
+        return URIRef(self.text.format_map({field: quote(row[field], safe="") for field in self.fields}))
+
+
+class TableTemplate:
+    """A nanopub template, compiled once to generate a signed nanopub for each row of a table.
+
+    Placeholders like `{column}` in the IRIs and literals of the graphs are replaced by the value
+    of the column in the row. The values are percent-encoded in IRIs, unless the IRI is made of
+    a single placeholder. Triples with a placeholder whose column is missing or empty in a row
+    are left out of the nanopub of that row. Use `{{` and `}}` for literal braces.
+
+    The nanopub itself, and the IRIs to mint in its namespace, are written in the temporary
+    namespace `http://purl.org/nanopub/temp/np/`, replaced by the trusty URI when signing.
+    The triples added by the conf (attribution to the profile, generation time) are computed
+    when the template is compiled, so all the nanopubs of a template have the same time.
+
+    Args:
+        conf: Config for the nanopubs, with the profile used to sign them
+        assertion: Template of the assertion graph
+        provenance: Template of the provenance graph
+        pubinfo: Template of the pubinfo graph
+    """
+
+    def __init__(
+        self,
+        conf: NanopubConf,
+        assertion: Graph,
+        provenance: Optional[Graph] = None,
+        pubinfo: Optional[Graph] = None,
+    ) -> None:
+        if conf.profile is None:
+            raise ProfileError("Profile not available, cannot sign the nanopubs of the template")
+        skeleton = Nanopub(
+            conf=conf,
+            assertion=assertion,
+            provenance=provenance if provenance is not None else Graph(),
+            pubinfo=pubinfo if pubinfo is not None else Graph(),
+        )
+        skeleton._replace_blank_nodes(skeleton.rdf)
+        self.profile = conf.profile
+        self.namespace = skeleton.metadata.namespace
+        self.assertion = skeleton.assertion.identifier
+        self.pubinfo = skeleton.pubinfo.identifier
+        self.namespaces = list(skeleton.rdf.namespaces())
+        self.quads = [
+            (_Term(s), _Term(p), _Term(o), g)
+            for s, p, o, g in skeleton.rdf.quads()
+        ]
+        self.fields = sorted({field for quad in self.quads for term in quad[:3] for field in term.fields})
+
+    @classmethod
+    def from_file(cls, conf: NanopubConf, path: Union[Path, str], rdf_format: Optional[str] = None) -> "TableTemplate":
+        """Load a template from a TriG or Turtle file.
+
+        The graphs whose IRI ends with "assertion", "provenance" or "pubinfo" are used as the
+        corresponding graphs of the nanopubs. Triples outside of a named graph, e.g. in a
+        Turtle file, are added to the assertion.
+        """
+        rdf = Dataset()
+        rdf.parse(str(path), format=rdf_format or guess_format(str(path)) or "trig", publicID=TEMPLATE_BASE)
+        graphs: Dict[str, Graph] = {"assertion": Graph(), "provenance": Graph(), "pubinfo": Graph()}
+        for prefix, namespace in rdf.namespaces():
+            graphs["assertion"].bind(prefix, namespace)
+        for s, p, o, g in rdf.quads():
+            name = str(g.identifier if isinstance(g, Graph) else g).lower() if g is not None else ""
+            role = next((role for role in graphs if name.endswith(role)), "assertion")
+            graphs[role].add((s, p, o))
+        return cls(conf, graphs["assertion"], graphs["provenance"], graphs["pubinfo"])
+
+    def render(self, row: Dict[str, Any]) -> Dataset:
+        """Fill the placeholders of the template with the values of a row, returning the unsigned RDF."""
+        values = {key: str(value) for key, value in row.items() if value is not None and value != ""}
+        rdf = Dataset()
+        for prefix, namespace in self.namespaces:
+            rdf.bind(prefix, namespace)
+        graphs: Dict[Any, Graph] = {}
+        for s, p, o, g in self.quads:
+            if any(field not in values for term in (s, p, o) for field in term.fields):
+                continue
+            if g not in graphs:
+                graphs[g] = rdf.graph(g)
+            graphs[g].add((s.render(values), p.render(values), o.render(values)))
+        return rdf
+
+    def sign(self, row: Dict[str, Any]) -> Tuple[str, str]:
+        """Generate and sign the nanopub of a row.
+
+        Returns:
+            tuple of: the trusty URI of the nanopub, the nanopub serialized as trig.
+        """
+        rdf = self.render(row)
+        if len(rdf) > MAX_TRIPLES_PER_NANOPUB:
+            raise MalformedNanopubError(f"Nanopublication contains {len(rdf)} triples, which is more than the {MAX_TRIPLES_PER_NANOPUB} authorized")
+        if len(rdf.graph(self.assertion)) == 0:
+            raise MalformedNanopubError("The assertion graph is empty")
+        signed = add_signature(rdf, self.profile, self.namespace, rdf.graph(self.pubinfo))
+        return _signed_uri(signed), signed.serialize(format="trig")
+
+    def generate(
+        self,
+        rows: Iterable[Dict[str, Any]],
+        sign_workers: Optional[int] = None,
+        batch_size: int = ROW_BATCH_SIZE,
+        max_pending: Optional[int] = None,
+    ) -> Iterator[TableNanopub]:
+        """Generate and sign the nanopubs of many rows in a pool of processes.
+
+        Rows are read from the iterator while the nanopubs are signed, and only a bounded number
+        of them are in memory, so the iterator can give millions of rows.
+
+        Args:
+            rows: Dicts giving the value of each column
+            sign_workers: Number of signing processes, defaults to the number of CPUs.
+                Use 0 to sign in the current process.
+            batch_size: Number of rows sent at once to a signing process
+            max_pending: Maximum number of batches being signed or waiting to be yielded,
+                defaults to twice the number of signing processes
+
+        Returns:
+            an iterator over the TableNanopub of each row, in the order of the rows.
+        """
+        indexed = enumerate(rows)
+        with SigningPipeline(sign_workers, max_pending, initializer=_init_worker, initargs=(self,)) as pipeline:
+            while batch := list(islice(indexed, batch_size)):
+                if pipeline.pool is not None:
+                    pipeline.submit(_sign_rows, batch)
+                else:
+                    pipeline.submit(_sign_rows, batch, self)
+                for _, results in pipeline.ready():
+                    yield from results
+            for _, results in pipeline.drain():
+                yield from results
+
+
+def _signed_uri(signed: Dataset) -> str:
+    """Trusty URI of a nanopub signed by add_signature, found in the bound "this" prefix."""
+    return str(dict(signed.namespaces())["this"])
+
+
+_worker_template: Optional[TableTemplate] = None
+"""Template of the current signing process"""
+
+
+def _init_worker(template: TableTemplate) -> None:
+    global _worker_template
+    _worker_template = template
+
+
+def _sign_rows(batch: List[Tuple[int, Dict[str, Any]]], template: Optional[TableTemplate] = None) -> List[TableNanopub]:
+    """Sign the nanopubs of a batch of rows, in the worker processes of `TableTemplate.generate`."""
+    template = template or _worker_template
+    results = []
+    for index, row in batch:
+        try:
+            source_uri, rdf = template.sign(row)
+            results.append(TableNanopub(index, source_uri, rdf))
+        except Exception as e:
+            log.info(f"Could not generate the nanopub of row {index}: {e}")
+            results.append(TableNanopub(index, error=f"{type(e).__name__}: {e}"))
+    return results
+
+
+def read_table(path: Union[Path, str], table_format: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+    """Stream the rows of a CSV, TSV or JSON lines file as dicts.
+
+    Args:
+        path: Path to the table file
+        table_format: One of csv, tsv or jsonl, guessed from the extension of the file if not given
+    """
+    path = Path(path)
+    table_format = table_format or TABLE_FORMATS.get(path.suffix.lower())
+    if table_format not in ("csv", "tsv", "jsonl"):
+        raise ValueError(f"Unknown table format for {path}, use one of csv, tsv or jsonl")
+    with open(path, newline="" if table_format != "jsonl" else None, encoding="utf-8") as f:
+        if table_format == "jsonl":
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            yield from csv.DictReader(f, delimiter="\t" if table_format == "tsv" else ",")
@@ -1,14 +1,21 @@
 import os
 import tempfile
+from dataclasses import replace
+from unittest.mock import MagicMock
 
 import pytest
 import requests
+from rdflib import Graph, Literal, URIRef
 
-from nanopub import NanopubConf, load_profile
+from nanopub import Nanopub, NanopubConf, load_profile
 from nanopub.client import TEST_NANOPUB_QUERY_URL
 from nanopub.definitions import TEST_RESOURCES_FILEPATH
+from nanopub.local_server import LocalNanopubServer
+from nanopub.namespaces import HYCL
 from tests.java_wrapper import JavaWrapper
 
+EX = "https://example.org/"
+
 
 def pytest_addoption(parser):
     parser.addoption('--no_rsa_key', action='store_true', default=False,
@@ -63,3 +70,33 @@ testsuite_conf = NanopubConf(
 )
 
 java_wrap = JavaWrapper(private_key=profile_test.private_key)
+
+
+def make_session(status_codes=None):
+    """Mock session answering the given status codes in turn, then 201."""
+    status_codes = list(status_codes or [])
+    session = MagicMock()
+
+    def post(url, **kwargs):
+        return MagicMock(status_code=status_codes.pop(0) if status_codes else 201, headers={})
+
+    session.post.side_effect = post
+    return session
+
+
+@pytest.fixture
+def server():
+    with LocalNanopubServer() as server:
+        yield server
+
+
+def make_conf(server):
+    """The default conf, publishing to a LocalNanopubServer."""
+    return replace(default_conf, use_test_server=False, use_server=server.registry_url)
+
+
+def make_claim(conf: NanopubConf, text: str) -> Nanopub:
+    """Unsigned nanopub claiming the given text."""
+    assertion = Graph()
+    assertion.add((URIRef(EX + "thing"), HYCL.claims, Literal(text)))
+    return Nanopub(conf=conf, assertion=assertion)
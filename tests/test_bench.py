@@ -0,0 +1,40 @@
+from nanopub.bench import CPU_CATEGORIES, run_bench
+from nanopub.local_server import LocalNanopubServer
+from tests.conftest import default_conf, make_claim
+
+
+def test_sign_timings():
+    np = make_claim(default_conf, "Claim 0")
+    timings = {}
+    np.sign(timings)
+    assert np.has_valid_signature
+    assert set(timings) == {"canonicalization", "rsa"}
+    assert all(seconds > 0 for seconds in timings.values())
+
+
+def test_run_bench_against_local_server():
+    with LocalNanopubServer() as server:
+        report = run_bench(
+            server.conf(), server.client(), count=4, triples=3, concurrency=2, sign_workers=0, queries=3, seed=1
+        )
+        assert len(server) == 4
+
+    assert report["published"] == 4
+    assert report["queries_with_results"] == 3
+    assert set(report["cpu_s"]) == set(CPU_CATEGORIES)
+    assert report["cpu_s"]["rsa"] > 0
+    for name, count in [("sign", 4), ("upload", 4), ("fetch", 4), ("query", 3)]:
+        stage = report["stages"][name]
+        assert stage["count"] == count
+        assert stage["error_rate"] == 0.0
+        assert stage["throughput_per_s"] > 0
+        assert set(stage["latency_ms"]) == {"p50", "p90", "p95", "p99", "mean", "max"}
+
+
+def test_run_bench_reports_errors():
+    with LocalNanopubServer(failure_rate=1.0) as server:
+        report = run_bench(server.conf(), server.client(), count=2, triples=1, sign_workers=0, queries=1)
+
+    assert report["published"] == 0
+    assert report["stages"]["upload"]["error_rate"] == 1.0
+    assert report["stages"]["fetch"]["count"] == 0
@@ -0,0 +1,241 @@
+import gzip
+import threading
+from dataclasses import replace
+from unittest.mock import MagicMock, patch
+
+import pytest
+import requests
+from rdflib import Graph, Literal, URIRef
+
+from nanopub import Nanopub, NanopubConf, Profile
+from nanopub.bulk import (
+    SIGN_START_METHOD,
+    SigningPipeline,
+    check_ownership,
+    make_sign_pool,
+    publish_many,
+    retract_many,
+    supersede_many,
+    upload_signed,
+)
+from nanopub.client import RetractionStatus
+from nanopub.definitions import TEST_NANOPUB_REGISTRY_URL
+from nanopub.fdo import FdoNanopub, FdoQuery, FdoRecord, resolve_many, update_records
+from nanopub.namespaces import FDOF, HYCL
+from tests.conftest import EX, default_conf, make_claim, make_conf, make_session
+
+
+@pytest.mark.parametrize("sign_workers", [0, 2])
+def test_publish_many_signs_and_uploads(sign_workers):
+    nanopubs = [make_claim(default_conf, f"Claim {i}") for i in range(4)]
+    expected = []
+    for i in range(4):
+        np = make_claim(default_conf, f"Claim {i}")
+        np.sign()
+        expected.append(np.source_uri)
+
+    session = make_session()
+    results = sorted(
+        publish_many(nanopubs, default_conf, sign_workers=sign_workers, upload_workers=2, max_pending=2, session=session),
+        key=lambda r: r.index,
+    )
+    assert [r.source_uri for r in results] == expected
+    assert all(r.published and r.attempts == 1 for r in results)
+    assert session.post.call_count == 4
+    assert session.post.call_args.args[0] == TEST_NANOPUB_REGISTRY_URL
+
+
+def test_publish_many_signs_with_the_conf():
+    conf = replace(
+        default_conf, attribute_assertion_to_profile=False, assertion_attributed_to="https://orcid.org/0000-0000-0000-0001"
+    )
+    unsigned = Nanopub(conf=NanopubConf(), assertion=make_claim(default_conf, "Claim 0").assertion)
+    session = make_session()
+    [result] = publish_many([unsigned.rdf], conf, sign_workers=0, session=session)
+    assert result.published
+    assert b"0000-0000-0000-0001" in session.post.call_args.kwargs["data"]
+
+
+def test_publish_many_reports_failures(tmp_path):
+    signed = make_claim(default_conf, "Claim 0")
+    signed.sign()
+    broken = tmp_path / "broken.trig"
+    broken.write_text("not rdf")
+
+    session = make_session()
+    results = sorted(publish_many([signed, broken], default_conf, sign_workers=0, session=session), key=lambda r: r.index)
+    assert results[0].published
+    assert results[0].source_uri == signed.source_uri
+    assert not results[1].published
+    assert results[1].source == str(broken)
+    assert results[1].error
+
+
+def test_upload_signed_retries_transient_errors():
+    session = make_session([503, 429])
+    with patch("nanopub.bulk.time.sleep") as mock_sleep:
+        assert upload_signed("data", "https://registry.example.org/", session, backoff=0.5) == 3
+    assert [c.args[0] for c in mock_sleep.call_args_list] == [0.5, 1.0]
+
+
+def test_upload_signed_compressed():
+    session = make_session()
+    upload_signed("data", "https://registry.example.org/", session, compress=True)
+    kwargs = session.post.call_args.kwargs
+    assert kwargs["headers"]["Content-Encoding"] == "gzip"
+    assert gzip.decompress(kwargs["data"]) == b"data"
+
+
+def test_upload_signed_gives_up():
+    session = make_session()
+    session.post.side_effect = requests.ConnectionError("down")
+    with patch("nanopub.bulk.time.sleep"), pytest.raises(requests.ConnectionError):
+        upload_signed("data", "https://registry.example.org/", session, max_retries=2)
+    assert session.post.call_count == 3
+
+    response = MagicMock(status_code=400, headers={})
+    response.raise_for_status.side_effect = requests.HTTPError("400")
+    session = MagicMock()
+    session.post.return_value = response
+    with pytest.raises(requests.HTTPError):
+        upload_signed("data", "https://registry.example.org/", session)
+    assert session.post.call_count == 1
+
+
+def test_sign_pool_is_not_forked():
+    assert make_sign_pool(0) is None
+    pool = make_sign_pool(1)
+    try:
+        assert pool._mp_context.get_start_method() == SIGN_START_METHOD != "fork"
+    finally:
+        pool.shutdown()
+
+
+def test_signing_pipeline_keeps_order():
+    with SigningPipeline(sign_workers=0, max_pending=2) as pipeline:
+        taken = []
+        for i in range(5):
+            pipeline.submit(str, i, tag=i % 2)
+            taken.extend(pipeline.ready())
+            assert len(pipeline) < 2
+        taken.extend(pipeline.drain())
+    assert taken == [(0, "0"), (1, "1"), (0, "2"), (1, "3"), (0, "4")]
+
+
+def test_retract_and_supersede_many(server):
+    conf = make_conf(server)
+    mine = [make_claim(conf, f"Mine {i}") for i in range(3)]
+    other = make_claim(replace(conf, profile=Profile("https://orcid.org/0000-0000-0000-0001", "Other")), "Not mine")
+    for np in mine + [other]:
+        np.publish()
+
+    results = retract_many(
+        [mine[0].source_uri, other.source_uri, "https://w3id.org/np/RAmissing"], conf,
+        client=server.client(), sign_workers=0,
+    )
+    assert [r.published for r in results] == [True, False, False]
+    assert results[0].source_uri in server
+    assert "another public key" in results[1].skipped
+    assert "Could not fetch" in results[2].skipped
+
+    # Already retracted nanopubs are skipped
+    [result] = retract_many([mine[0].source_uri], conf, client=server.client(), sign_workers=0)
+    assert result.skipped.startswith("Already retracted")
+
+    assertion = Graph()
+    assertion.add((URIRef(EX + "thing"), HYCL.claims, Literal("Updated")))
+    results = supersede_many(
+        [(mine[1].source_uri, assertion), (other.source_uri, assertion)], conf, client=server.client(), sign_workers=0
+    )
+    assert [(r.published, bool(r.skipped)) for r in results] == [(True, False), (False, True)]
+    status = server.client().retraction_status([mine[1].source_uri])[mine[1].source_uri]
+    assert status.superseded_by == [results[0].source_uri]
+
+
+def test_check_ownership_fetches_unindexed_nanopubs_concurrently():
+    uris = [f"https://w3id.org/np/RA{i}" for i in range(4)]
+    client = MagicMock()
+    client.retraction_status.return_value = {
+        uris[0]: RetractionStatus(uris[0], public_key=default_conf.profile.public_key),
+        **{uri: RetractionStatus(uri) for uri in uris[1:]},
+    }
+    barrier = threading.Barrier(3, timeout=5)
+
+    def fetch_public_key(uri, conf):
+        # Only returns once the 3 nanopubs are fetched at the same time
+        barrier.wait()
+        if uri == uris[3]:
+            raise requests.HTTPError("404 Not Found")
+        return default_conf.profile.public_key if uri == uris[1] else "other key"
+
+    with patch("nanopub.bulk.fetch_public_key", side_effect=fetch_public_key) as mock_fetch:
+        reasons = check_ownership(uris, default_conf, client=client)
+    assert mock_fetch.call_count == 3
+    assert reasons[uris[0]] is None and reasons[uris[1]] is None
+    assert "another public key" in reasons[uris[2]]
+    assert "Could not fetch" in reasons[uris[3]]
+
+
+def test_resolve_many_fdos(server):
+    conf = make_conf(server)
+    published = []
+    for i in range(5):
+        np = FdoNanopub(f"21.T11966/local{i}", f"Local FDO {i}", fdo_profile="21.T11966/profile", conf=conf)
+        np.publish()
+        published.append(np.source_uri)
+
+    ids = [f"21.T11966/local{i}" for i in range(5)] + ["21.T11966/local0", "https://example.org/missing"]
+    results = resolve_many(ids, conf=server.conf(), client=server.client(), workers=4)
+    assert [r.source_uri for r in results[:6]] == published + published[:1]
+    assert [r.record.get_label() for r in results[:5]] == [f"Local FDO {i}" for i in range(5)]
+    assert results[6].error == "FDO not found: https://example.org/missing"
+
+
+def test_fdo_feeds(server):
+    conf = make_conf(server)
+    for i in range(3):
+        FdoNanopub(f"21.T11966/feed{i}", f"Feed FDO {i}", conf=conf).publish()
+    FdoNanopub("21.T11966/feed0", "Feed FDO 0 updated", conf=conf).publish()
+
+    fdo_query = FdoQuery(server.client())
+    creator = default_conf.profile.orcid_id
+    results = fdo_query.get_feeds([creator, creator])
+    assert sorted(r["fdo"] for r in results) == [f"https://hdl.handle.net/21.T11966/feed{i}" for i in range(3)]
+    assert [len(chunk) for chunk in fdo_query.chunks("get_feed", creator, chunk_size=3)] == [3, 1]
+
+
+def test_update_fdo_records(server):
+    conf = make_conf(server)
+    profile = URIRef("https://hdl.handle.net/21.T11966/profile")
+    for i in range(2):
+        FdoNanopub(f"21.T11966/sync{i}", f"Synced FDO {i}", fdo_profile=profile, conf=conf).publish()
+
+    updates = [
+        ("21.T11966/sync0", FdoRecord(profile_uri=profile, label="Synced FDO 0")),
+        ("21.T11966/sync1", FdoRecord(profile_uri=profile, label="Renamed FDO 1")),
+        ("21.T11966/sync2", FdoRecord(profile_uri=profile, label="New FDO 2")),
+    ]
+    results = update_records(updates, conf, client=server.client(), workers=3, sign_workers=0)
+    assert [r.skipped for r in results] == ["Unchanged", None, None]
+    assert [(r.added, r.removed) for r in results] == [(0, 0), (1, 1), (2, 0)]
+    assert all(r.published for r in results[1:])
+    assert results[1].source_uri in server and results[2].source_uri in server
+    updated = Nanopub(results[1].source_uri, conf=server.conf())
+    fdo_iri = URIRef("https://hdl.handle.net/21.T11966/sync1")
+    assert list(updated.assertion.objects(fdo_iri, FDOF.hasMetadata)) == [URIRef(results[1].source_uri)]
+
+    # The updated FDOs are now unchanged
+    results = update_records(updates, conf, client=server.client(), publish=False)
+    assert [r.skipped for r in results] == ["Unchanged"] * 3
+
+
+def test_update_fdo_records_of_another_key(server):
+    conf = make_conf(server)
+    other = replace(conf, profile=Profile("https://orcid.org/0000-0000-0000-0001", "Other"))
+    profile = URIRef("https://hdl.handle.net/21.T11966/profile")
+    FdoNanopub("21.T11966/theirs", "Their FDO", fdo_profile=profile, conf=other).publish()
+
+    record = FdoRecord(profile_uri=profile, label="Renamed")
+    [result] = update_records([("21.T11966/theirs", record)], conf, client=server.client(), sign_workers=0)
+    assert result.skipped == "Signed with another public key than the one of the profile"
+    assert not result.published and result.source_uri is None
@@ -1,4 +1,5 @@
 import os
+import shutil
 from pathlib import Path
 
 import pytest
@@ -59,14 +60,17 @@ def test_publish():
     assert "Nanopub published at" in result.stdout
 
 
-def test_sign_with_key():
-    test_file = "./tests/testsuite/valid/plain/simple1.trig"
+def test_sign_with_key(tmp_path):
+    # The signed nanopub is written next to the input, so copy it out of the testsuite
+    test_file = tmp_path / "simple1.trig"
+    shutil.copy("./tests/testsuite/valid/plain/simple1.trig", test_file)
     result = runner.invoke(cli, [
-        "sign", test_file,
+        "sign", str(test_file),
         "-k", PRIVATE_KEY_PATH,
     ])
     assert result.exit_code == 0
     assert "Nanopub signed in" in result.stdout
+    assert (tmp_path / "signed.simple1.trig").exists()
 
 
 def test_version():
@@ -0,0 +1,97 @@
+from unittest.mock import patch
+
+from rdflib import Dataset, Literal, URIRef
+from rdflib.namespace import DCTERMS, RDF
+
+from nanopub import NanopubClient
+from nanopub.namespaces import NP, NPA, NPX
+
+EX = "https://example.org/"
+PUBKEY = "PUBKEY"
+
+
+def add_nanopub(ds: Dataset, name: str, assertion, pubkey: str = PUBKEY):
+    np_uri = URIRef(f"https://w3id.org/np/{name}")
+    assertion_graph = ds.graph(URIRef(f"{np_uri}/assertion"))
+    for triple in assertion:
+        assertion_graph.add(triple)
+    admin = ds.graph(NPA.graph)
+    admin.add((np_uri, NP.hasAssertion, assertion_graph.identifier))
+    admin.add((np_uri, NPA.hasValidSignatureForPublicKey, Literal(pubkey)))
+    admin.add((np_uri, DCTERMS.created, Literal("2024-01-01")))
+    return np_uri
+
+
+def local_sparql(ds: Dataset):
+    """Run the SPARQL queries of the client on a local rdflib Dataset, returning rows like iter_sparql."""
+    def iter_sparql(self, query, converters=None):
+        for result in ds.query(query):
+            row = {str(k): str(v) if v is not None else "" for k, v in result.asdict().items()}
+            for column, convert in (converters or {}).items():
+                row[column] = convert(row[column])
+            yield row
+    return iter_sparql
+
+
+def test_find_nanopubs_with_patterns():
+    ds = Dataset()
+    thing = URIRef(EX + "thing")
+    np1 = add_nanopub(ds, "RA1", [(thing, RDF.type, URIRef(EX + "Class"))])
+    np2 = add_nanopub(ds, "RA2", [(thing, URIRef(EX + "label"), Literal("Thing"))])
+    np3 = add_nanopub(ds, "RA3", [(thing, URIRef(EX + "label"), Literal("Other"))], pubkey="OTHER")
+    retraction = add_nanopub(ds, "RA4", [(URIRef(EX + "me"), NPX.retracts, np2)])
+    ds.graph(NPA.graph).add((retraction, NPX.invalidates, np2))
+
+    patterns = [
+        (thing, RDF.type, None),
+        (thing, URIRef(EX + "label"), Literal("Thing")),
+        (None, URIRef(EX + "unknown"), None),
+        (EX + "thing", "", ""),
+    ]
+    client = NanopubClient()
+    with patch.object(NanopubClient, "iter_sparql", local_sparql(ds)):
+        results = client.find_nanopubs_with_patterns(patterns, chunk_size=2)
+        all_results = client.find_nanopubs_with_patterns(patterns, filter_retracted=False, pubkey=PUBKEY)
+
+    assert [r["np"] for r in results[0]] == [str(np1)]
+    assert results[1] == []
+    assert results[2] == []
+    assert sorted(r["np"] for r in results[3]) == [str(np1), str(np3)]
+    assert [r["np"] for r in all_results[1]] == [str(np2)]
+    assert sorted(r["np"] for r in all_results[3]) == [str(np1), str(np2)]
+    assert results[0][0]["date"] == "2024-01-01"
+
+
+def test_find_nanopubs_with_patterns_chunks_queries():
+    client = NanopubClient()
+    with patch.object(NanopubClient, "iter_sparql", return_value=iter([])) as mock_sparql:
+        client.find_nanopubs_with_patterns([(EX + str(i), None, None) for i in range(5)], chunk_size=2)
+    assert mock_sparql.call_count == 3
+    assert "(4 <https://example.org/4> UNDEF UNDEF)" in mock_sparql.call_args.args[0]
+
+
+def test_retraction_status():
+    ds = Dataset()
+    me = URIRef(EX + "me")
+    np1 = add_nanopub(ds, "RA1", [(me, RDF.type, URIRef(EX + "Person"))])
+    np2 = add_nanopub(ds, "RA2", [(me, RDF.type, URIRef(EX + "Person"))])
+    retraction = add_nanopub(ds, "RA3", [(me, NPX.retracts, np1)])
+    add_nanopub(ds, "RA4", [(me, NPX.retracts, np2)], pubkey="OTHER")
+    update = add_nanopub(ds, "RA5", [(me, RDF.type, URIRef(EX + "Human"))])
+    ds.graph(URIRef(f"{update}/pubinfo")).add((update, NPX.supersedes, np2))
+    unknown = "https://w3id.org/np/RA6"
+
+    client = NanopubClient()
+    with patch.object(NanopubClient, "iter_sparql", local_sparql(ds)):
+        statuses = client.retraction_status([np1, np2, unknown, np1], chunk_size=2)
+        all_statuses = client.retraction_status([np2], valid_only=False)
+
+    assert list(statuses) == [str(np1), str(np2), unknown]
+    assert statuses[str(np1)].retracted_by == [str(retraction)]
+    assert statuses[str(np1)].public_key == PUBKEY
+    assert not statuses[str(np1)].is_superseded
+    assert not statuses[str(np2)].is_retracted
+    assert statuses[str(np2)].superseded_by == [str(update)]
+    assert statuses[unknown].public_key is None
+    assert not statuses[unknown].is_retracted
+    assert all_statuses[str(np2)].retracted_by == ["https://w3id.org/np/RA4"]
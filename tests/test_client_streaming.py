@@ -0,0 +1,59 @@
+import io
+from unittest.mock import patch
+
+import pytest
+import requests
+from urllib3 import HTTPResponse
+
+from nanopub import NanopubClient
+from nanopub.server_selection import ServerSelector
+
+CSV_BODY = '﻿np,count,label\r\nhttps://w3id.org/np/RA1,3,"multi\nline"\r\n\r\nhttps://w3id.org/np/RA2,,two\r\n'.encode("utf-8")
+
+
+def make_response(body: bytes = CSV_BODY, status_code: int = 200) -> requests.Response:
+    response = requests.Response()
+    response.status_code = status_code
+    response.raw = HTTPResponse(body=io.BytesIO(body), preload_content=False)
+    return response
+
+
+def test_iter_query_template_streams_rows():
+    client = NanopubClient(query_urls=["https://query.example.org/api/"])
+    with patch("nanopub.client.requests.get", return_value=make_response()) as mock_get:
+        rows = client.iter_query_template("RAquery/name", {"a": "1"}, converters={"count": int})
+        mock_get.assert_not_called()
+        assert next(rows) == {"np": "https://w3id.org/np/RA1", "count": 3, "label": "multi\nline"}
+        assert list(rows) == [{"np": "https://w3id.org/np/RA2", "count": None, "label": "two"}]
+    assert mock_get.call_args.kwargs["stream"] is True
+
+
+def test_iter_query_template_fails_over_before_first_row():
+    servers = ["https://a.example.org/api/", "https://b.example.org/api/"]
+    client = NanopubClient(query_urls=servers, server_selector=ServerSelector(servers))
+    client.server_selector.record_success(servers[0], 0.1)
+    client.server_selector.record_success(servers[1], 0.2)
+
+    def get(url, **kwargs):
+        return make_response(status_code=503 if url.startswith(servers[0]) else 200)
+
+    with patch("nanopub.client.requests.get", side_effect=get), pytest.warns(UserWarning):
+        rows = list(client.iter_query_template("RAquery/name", {}))
+    assert len(rows) == 2
+
+
+def test_iter_sparql():
+    client = NanopubClient(sparql_urls=["https://sparql.example.org/repo"])
+    with patch("nanopub.client.requests.post", return_value=make_response()) as mock_post:
+        rows = list(client.iter_sparql("SELECT * WHERE { ?s ?p ?o }"))
+    assert [row["np"] for row in rows] == ["https://w3id.org/np/RA1", "https://w3id.org/np/RA2"]
+    assert mock_post.call_args.args[0] == "https://sparql.example.org/repo"
+
+
+def test_iter_sparql_closes_failed_responses():
+    client = NanopubClient(sparql_urls=["https://a.example.org/repo", "https://b.example.org/repo"])
+    failed, ok = make_response(status_code=500), make_response()
+    with patch("nanopub.client.requests.post", side_effect=[failed, ok]), pytest.warns(UserWarning):
+        rows = list(client.iter_sparql("SELECT * WHERE { ?s ?p ?o }"))
+    assert len(rows) == 2
+    assert failed.raw.closed
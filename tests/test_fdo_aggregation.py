@@ -0,0 +1,100 @@
+import re
+from unittest.mock import patch
+
+import pytest
+from rdflib import URIRef
+from rdflib.namespace import DCTERMS
+
+from nanopub import Nanopub
+from nanopub.definitions import MAX_TRIPLES_PER_NANOPUB
+from nanopub.fdo import FdoNanopub, iter_aggregation_parts, iter_sharded_aggregation, retrieve_aggregation_record
+from nanopub.local_server import LocalNanopubServer
+from nanopub.namespaces import FDOF, HAS_SHARD
+from tests.conftest import default_conf, make_conf
+
+FDO_IRI = URIRef("https://example.org/collection")
+PARTS = [f"https://example.org/part/{i}" for i in range(7)]
+
+
+def test_small_aggregation_in_fdo_nanopub():
+    [np] = list(iter_sharded_aggregation(FDO_IRI, "21.T11966/profile", "Collection", PARTS[:3], conf=default_conf))
+    assert isinstance(np, FdoNanopub)
+    assert np.has_valid_signature
+    assert set(np.assertion.objects(FDO_IRI, DCTERMS.hasPart)) == {URIRef(p) for p in PARTS[:3]}
+    assert sorted(map(str, iter_aggregation_parts(np))) == sorted(PARTS[:3])
+
+
+@pytest.mark.parametrize("sign_workers", [0, 2])
+def test_sharded_aggregation(sign_workers):
+    nps = list(iter_sharded_aggregation(
+        "21.T11966/collection", "21.T11966/profile", "Collection", iter(PARTS),
+        conf=default_conf, shard_size=3, sign_workers=sign_workers,
+    ))
+    assert len(nps) == 4
+    *shards, head = nps
+    fdo_iri = URIRef("https://hdl.handle.net/21.T11966/collection")
+    assert [len(shard.assertion) for shard in shards] == [3, 3, 1]
+    assert all(shard.has_valid_signature for shard in shards)
+    assert not list(head.assertion.objects(fdo_iri, DCTERMS.hasPart))
+    links = set(head.assertion.objects(fdo_iri, FDOF.hasMetadata))
+    assert {URIRef(shard.source_uri) for shard in shards} < links
+    assert set(head.assertion.objects(fdo_iri, HAS_SHARD)) == {URIRef(shard.source_uri) for shard in shards}
+
+
+def test_other_metadata_records_are_not_shards():
+    [np] = list(iter_sharded_aggregation(FDO_IRI, "21.T11966/profile", "Collection", PARTS[:2], conf=default_conf))
+    np.assertion.add((FDO_IRI, FDOF.hasMetadata, URIRef("https://example.org/metadata.json")))
+    np.assertion.add((FDO_IRI, FDOF.hasMetadata, URIRef("https://w3id.org/np/RAprevious")))
+    with patch("nanopub.fdo.aggregation.fetch_assertion") as mock_fetch:
+        assert sorted(map(str, iter_aggregation_parts(np))) == PARTS[:2]
+    mock_fetch.assert_not_called()
+
+
+def test_sharded_aggregation_limits():
+    with pytest.raises(ValueError):
+        next(iter_sharded_aggregation(FDO_IRI, "21.T11966/profile", "Collection", PARTS, shard_size=5000))
+
+
+def test_sharded_aggregation_at_the_triple_limit():
+    parts = [f"https://example.org/part/{i}" for i in range(MAX_TRIPLES_PER_NANOPUB // 2)]
+    with pytest.raises(ValueError, match="which is more than its FDO nanopub can link to") as error:
+        next(iter_sharded_aggregation(
+            FDO_IRI, "21.T11966/profile", "Collection", parts, conf=default_conf, shard_size=1, sign_workers=0,
+        ))
+    max_shards = int(re.search(r"has more than (\d+) parts", str(error.value)).group(1))
+    assert MAX_TRIPLES_PER_NANOPUB // 2 - 20 < max_shards < MAX_TRIPLES_PER_NANOPUB // 2
+
+    with patch("nanopub.fdo.aggregation._sign_shard") as mock_sign:
+        with pytest.raises(ValueError):
+            next(iter_sharded_aggregation(
+                FDO_IRI, "21.T11966/profile", "Collection", parts[:max_shards + 1],
+                conf=default_conf, shard_size=1, sign_workers=0,
+            ))
+    mock_sign.assert_not_called()
+
+    *shards, head = iter_sharded_aggregation(
+        FDO_IRI, "21.T11966/profile", "Collection", parts[:max_shards],
+        conf=default_conf, shard_size=1, sign_workers=2,
+    )
+    assert len(shards) == max_shards
+    assert head.has_valid_signature
+    assert len(set(head.assertion.objects(FDO_IRI, HAS_SHARD))) == max_shards
+
+
+def test_read_sharded_aggregation():
+    with LocalNanopubServer() as server:
+        conf = make_conf(server)
+        nps = FdoNanopub.create_sharded_aggregation_fdo(FDO_IRI, "21.T11966/profile", "Collection", PARTS, conf=conf)
+        assert len(nps) == 1
+        nps = list(iter_sharded_aggregation(
+            FDO_IRI, "21.T11966/profile", "Collection", PARTS, conf=conf, shard_size=2, sign_workers=0,
+        ))
+        for np in nps:
+            np.publish()
+
+        parts = iter_aggregation_parts(nps[-1].source_uri, conf=server.conf(), workers=2)
+        assert sorted(map(str, parts)) == sorted(PARTS)
+
+        record = retrieve_aggregation_record(Nanopub(nps[-1].source_uri, conf=server.conf()), conf=server.conf())
+        assert record.get_label() == "Collection"
+        assert sorted(map(str, record.tuples[DCTERMS.hasPart])) == sorted(PARTS)
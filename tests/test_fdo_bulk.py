@@ -0,0 +1,54 @@
+from dataclasses import replace
+from unittest.mock import patch
+
+import pytest
+from rdflib import Dataset, RDFS, Literal
+
+from nanopub import Nanopub
+from nanopub.fdo import handles_to_nanopubs
+from nanopub.local_server import LocalNanopubServer
+from nanopub.namespaces import HDL
+from tests.conftest import default_conf
+
+
+def handle_metadata(handle, session=None):
+    if handle.endswith("missing"):
+        raise ValueError(f"404 Client Error for {handle}")
+    return {
+        "values": [
+            {"type": "HS_ADMIN", "data": {"value": {}}},
+            {"type": "name", "data": {"value": f"Record {handle}"}},
+            {"type": "21.T11966/FdoProfile", "data": {"value": "21.T11966/profile"}},
+        ]
+    }
+
+
+@pytest.mark.parametrize("sign_workers", [0, 2])
+@patch("nanopub.fdo.retrieve.resolve_handle_metadata", side_effect=handle_metadata)
+def test_handles_to_nanopubs(mock_metadata, sign_workers):
+    handles = ["21.T11966/a", "21.T11966/missing", "21.T11966/b", "21.T11966/a"]
+    results = list(handles_to_nanopubs(handles, default_conf, workers=3, sign_workers=sign_workers))
+
+    assert [r.handle for r in results] == handles
+    assert [r.error is None for r in results] == [True, False, True, True]
+    assert "404" in results[1].error
+    # The metadata of a handle is only fetched once
+    assert mock_metadata.call_count == 3
+
+    rdf = Dataset()
+    rdf.parse(data=results[0].rdf, format="trig")
+    np = Nanopub(rdf=rdf)
+    assert np.has_valid_signature
+    assert str(np.metadata.np_uri) == results[0].source_uri
+    assert np.assertion.value(HDL["21.T11966/a"], RDFS.label) == Literal("Record 21.T11966/a")
+
+
+@patch("nanopub.fdo.retrieve.resolve_handle_metadata", side_effect=handle_metadata)
+def test_handles_to_nanopubs_publish(mock_metadata):
+    with LocalNanopubServer() as server:
+        conf = replace(default_conf, use_test_server=False, use_server=server.registry_url)
+        handles = [f"21.T11966/h{i}" for i in range(6)]
+        results = list(handles_to_nanopubs(handles, conf, publish=True, workers=4, sign_workers=0, max_pending=2))
+        assert all(r.published and r.attempts == 1 for r in results)
+        assert all(r.source_uri in server for r in results)
+        assert len(server) == 6
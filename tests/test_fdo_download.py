@@ -0,0 +1,155 @@
+import hashlib
+import io
+from unittest.mock import MagicMock, patch
+
+import pytest
+import requests
+
+from nanopub.fdo.download import download_content, download_content_from_id, trusty_file_hash
+from nanopub.trustyuri import TrustyUriUtils
+
+CONTENT = bytes(range(256)) * 40
+TRUSTY = "FA" + TrustyUriUtils.get_base64(hashlib.sha256(CONTENT).digest())
+TRUSTY_URL = f"https://example.org/files/data.{TRUSTY}.bin"
+PLAIN_URL = "https://example.org/files/other.bin"
+
+
+class FakeResponse:
+    def __init__(self, status_code: int, body: bytes, fail_after: int = None):
+        self.status_code = status_code
+        self.body = body
+        self.fail_after = fail_after
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(f"{self.status_code} Error")
+
+    def iter_content(self, chunk_size):
+        for start in range(0, len(self.body), chunk_size):
+            if self.fail_after is not None and start >= self.fail_after:
+                raise requests.ConnectionError("Connection reset")
+            yield self.body[start:start + chunk_size]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+
+class FakeSession:
+    """Serves content by URL, with optional range support and interrupted transfers."""
+
+    def __init__(self, files, ranges=True, fail_after=None):
+        self.files = files
+        self.ranges = ranges
+        self.fail_after = fail_after
+        self.requests = []
+
+    def get(self, url, headers=None, **kwargs):
+        range_header = (headers or {}).get("Range")
+        self.requests.append((url, range_header))
+        content = self.files.get(url)
+        if content is None:
+            return FakeResponse(404, b"")
+        fail_after, self.fail_after = self.fail_after, None
+        if range_header and self.ranges:
+            start = int(range_header[len("bytes="):-1])
+            if start >= len(content):
+                return FakeResponse(416, b"")
+            return FakeResponse(206, content[start:], fail_after)
+        return FakeResponse(200, content, fail_after)
+
+
+def test_trusty_file_hash():
+    assert trusty_file_hash(TRUSTY_URL) == TRUSTY
+    assert trusty_file_hash(PLAIN_URL) is None
+    assert trusty_file_hash("https://w3id.org/np/RAkz9U-7HYNKZ9dxomtcGR0W_mC8Pd9dBD_69hVLnETMU") is None
+
+
+def test_download_to_directory(tmp_path):
+    session = FakeSession({TRUSTY_URL: CONTENT, PLAIN_URL: b"plain"})
+    results = download_content([TRUSTY_URL, PLAIN_URL, PLAIN_URL + "x"], tmp_path, chunk_size=1000, session=session)
+
+    assert [(r.size, r.verified, r.error is None) for r in results] == [
+        (len(CONTENT), True, True), (5, None, True), (0, None, False)
+    ]
+    assert (tmp_path / f"data.{TRUSTY}.bin").read_bytes() == CONTENT
+    assert (tmp_path / "other.bin").read_bytes() == b"plain"
+    assert "404" in results[2].error
+    assert not list(tmp_path.glob("*.part"))
+
+    # Files already downloaded are only verified
+    results = download_content([TRUSTY_URL], tmp_path, session=session)
+    assert results[0].verified and results[0].resumed_from == len(CONTENT)
+    assert len(session.requests) == 3
+
+
+def test_resume_interrupted_download(tmp_path):
+    session = FakeSession({TRUSTY_URL: CONTENT}, fail_after=3000)
+    [result] = download_content([TRUSTY_URL], tmp_path, chunk_size=1000, session=session)
+    assert result.verified and result.error is None
+    assert session.requests == [(TRUSTY_URL, None), (TRUSTY_URL, "bytes=3000-")]
+    assert (tmp_path / f"data.{TRUSTY}.bin").read_bytes() == CONTENT
+
+    # Partial downloads left by a previous run are resumed, and hashed from the start
+    (tmp_path / f"data.{TRUSTY}.bin").rename(tmp_path / f"data.{TRUSTY}.bin.part")
+    with open(tmp_path / f"data.{TRUSTY}.bin.part", "r+b") as f:
+        f.truncate(5000)
+    [result] = download_content([TRUSTY_URL], tmp_path, session=session)
+    assert (result.resumed_from, result.verified) == (5000, True)
+    assert session.requests[-1] == (TRUSTY_URL, "bytes=5000-")
+
+
+def test_resume_without_range_support(tmp_path):
+    (tmp_path / "other.bin.part").write_bytes(b"stale")
+    session = FakeSession({PLAIN_URL: b"plain content"}, ranges=False)
+    [result] = download_content([PLAIN_URL], tmp_path, session=session)
+    assert result.error is None
+    assert (tmp_path / "other.bin").read_bytes() == b"plain content"
+
+
+def test_reject_corrupted_content(tmp_path):
+    session = FakeSession({TRUSTY_URL: CONTENT[:-1] + b"x"})
+    [result] = download_content([TRUSTY_URL], tmp_path, session=session)
+    assert result.verified is False
+    assert "does not match the trusty hash" in result.error
+    assert not list(tmp_path.iterdir())
+
+
+def test_download_to_sink():
+    sinks = {}
+
+    def sink(url):
+        sinks[url] = io.BytesIO()
+        return sinks[url]
+
+    session = FakeSession({TRUSTY_URL: CONTENT}, fail_after=2000)
+    [result] = download_content([TRUSTY_URL], sink=sink, chunk_size=1000, session=session)
+    assert result.verified and result.path is None
+    assert sinks[TRUSTY_URL].getvalue() == CONTENT
+
+    with pytest.raises(ValueError):
+        download_content([TRUSTY_URL], session=session)
+
+
+@patch("nanopub.fdo.download.resolve_id")
+def test_download_content_from_id(mock_resolve_id, tmp_path):
+    mock_resolve_id.return_value = MagicMock(get_data_ref=lambda: [TRUSTY_URL, PLAIN_URL])
+    session = FakeSession({TRUSTY_URL: CONTENT, PLAIN_URL: b"plain"})
+    results = download_content_from_id("21.T11966/fdo", tmp_path, session=session)
+    assert [r.url for r in results] == [TRUSTY_URL, PLAIN_URL]
+    assert all(r.error is None for r in results)
+
+
+def test_download_urls_with_the_same_file_name(tmp_path):
+    first, second = "https://a.example.org/x/data.csv", "https://b.example.org/y/data.csv"
+    session = FakeSession({first: b"first", second: b"second"})
+    results = download_content([first, second, first], tmp_path, session=session)
+
+    assert [r.size for r in results] == [5, 6, 5]
+    assert results[0] is results[2]
+    assert len(session.requests) == 2
+    assert len({r.path for r in results}) == 2
+    assert [r.path.read_bytes() for r in results[:2]] == [b"first", b"second"]
+    assert all(r.path.name.startswith("data-") and r.path.suffix == ".csv" for r in results)
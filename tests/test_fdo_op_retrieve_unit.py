@@ -1,3 +1,6 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from unittest.mock import patch, MagicMock
 from rdflib import Graph, URIRef
 import pytest
@@ -9,7 +12,10 @@ from nanopub.fdo.retrieve import (
     retrieve_content_from_id,
     resolve_handle_metadata,
     get_fdo_uri_from_fdo_record,
-    resolve_in_nanopub_network
+    resolve_in_nanopub_network,
+    resolve_many,
+    FdoResolver,
+    FdoResolution,
 )
 
 @patch("nanopub.fdo.retrieve.resolve_in_nanopub_network")
@@ -156,4 +162,61 @@ def test_get_fdo_uri_from_fdo_record_fallback_subjects():
 
 def test_get_fdo_uri_from_fdo_record_none_case():
     g = Graph()
-    assert get_fdo_uri_from_fdo_record(g) is None
\ No newline at end of file
+    assert get_fdo_uri_from_fdo_record(g) is None
+
+HANDLE_RESPONSE = {
+    "values": [
+        {"type": "name", "data": {"value": "Handle FDO"}},
+        {"type": "21.T11966/FdoProfile", "data": {"value": "21.T11966/profile"}},
+    ]
+}
+
+
+@patch("nanopub.fdo.retrieve.resolve_handle_metadata", return_value=HANDLE_RESPONSE)
+@patch("nanopub.fdo.retrieve.NanopubClient._query_api_parsed", return_value=[])
+def test_resolve_many_caches_lookups(mock_query, mock_handle):
+    resolver = FdoResolver()
+    ids = ["21.T11966/a", "https://hdl.handle.net/21.T11966/b", "21.T11966/a"]
+    results = resolver.resolve_many(ids)
+    assert [r.record.get_label() for r in results] == ["Handle FDO"] * 3
+    assert [r.source_uri for r in results] == [
+        "https://hdl.handle.net/21.T11966/a", "https://hdl.handle.net/21.T11966/b", "https://hdl.handle.net/21.T11966/a"
+    ]
+    assert mock_query.call_count == 2
+    assert mock_handle.call_count == 2
+
+    resolver.resolve_many(ids)
+    assert mock_query.call_count == 2
+    assert mock_handle.call_count == 2
+
+
+@patch("nanopub.fdo.retrieve.resolve_handle_metadata", side_effect=RuntimeError("boom"))
+@patch("nanopub.fdo.retrieve.NanopubClient._query_api_parsed", return_value=None)
+def test_resolve_many_errors(mock_query, mock_handle):
+    [failed, missing] = resolve_many(["21.T11966/a", "https://example.org/fdo"])
+    assert failed.record is None
+    assert failed.error.startswith("Could not resolve FDO: 21.T11966/a")
+    assert missing.error == "FDO not found: https://example.org/fdo"
+
+
+def test_resolve_many_single_flight():
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def slow_resolve(iri_or_handle):
+        calls.append(iri_or_handle)
+        started.set()
+        release.wait(5)
+        return FdoResolution(iri_or_handle, error="slow")
+
+    resolver = FdoResolver()
+    with patch.object(resolver, "_resolve", side_effect=slow_resolve):
+        with ThreadPoolExecutor(max_workers=3) as pool:
+            futures = [pool.submit(resolver.resolve, "21.T11966/a") for _ in range(3)]
+            started.wait(5)
+            time.sleep(0.05)
+            release.set()
+            results = [f.result() for f in futures]
+    assert calls == ["21.T11966/a"]
+    assert all(r is results[0] for r in results)
@@ -1,8 +1,9 @@
 import pytest
-from rdflib import URIRef, Graph, Literal
+from rdflib import RDF, RDFS, DCTERMS, URIRef, Graph, Literal
 from unittest.mock import patch, MagicMock
 from nanopub.fdo.fdo_record import FdoRecord
-from nanopub.fdo.update import update_record
+from nanopub.fdo.update import diff_record, update_record
+from nanopub.namespaces import FDOF, HAS_SHARD
 from nanopub.nanopub_conf import NanopubConf
 
 
@@ -74,3 +75,82 @@ def test_create_new_nanopub_when_none_exists(mock_create, mock_resolve, sample_c
     )
     mock_np.publish.assert_called_once()
     assert result == ("new_uri", "new_head", "new_sig")
+
+
+def published_assertion(record, np_uri="https://w3id.org/np/RAexisting"):
+    subject = URIRef("https://hdl.handle.net/21.T11966/abc123")
+    assertion = Graph()
+    assertion.add((subject, RDF.type, FDOF.FAIRDigitalObject))
+    assertion.add((subject, FDOF.hasMetadata, URIRef(np_uri)))
+    for p, o in record.tuples.predicate_objects():
+        assertion.add((subject, p, o))
+    return assertion
+
+
+def test_diff_record(sample_record):
+    np_uri = "https://w3id.org/np/RAexisting"
+    assertion = published_assertion(sample_record, np_uri)
+    assert diff_record(assertion, sample_record, np_uri=np_uri).is_empty
+    # A record read from the assertion links to the published nanopub too
+    assert diff_record(assertion, FdoRecord(assertion), np_uri=np_uri).is_empty
+
+    changed = sample_record.copy()
+    changed.set_label("New label")
+    changed.add_aggregate(URIRef("https://example.org/part/1"))
+    delta = diff_record(assertion, changed, np_uri=np_uri)
+    subject = URIRef("https://hdl.handle.net/21.T11966/abc123")
+    assert set(delta.added) == {
+        (subject, RDFS.label, Literal("New label")),
+        (subject, DCTERMS.hasPart, URIRef("https://example.org/part/1")),
+    }
+    assert delta.removed == [(subject, RDFS.label, Literal("Example FDO"))]
+
+    new_uri = URIRef("https://w3id.org/np/RAnew")
+    updated = delta.apply(assertion, new_uri)
+    assert set(updated.objects(subject, FDOF.hasMetadata)) == {new_uri}
+    assert (subject, RDF.type, FDOF.FAIRDigitalObject) in updated
+    assert diff_record(updated, changed, np_uri=new_uri).is_empty
+
+
+def test_diff_record_refuses_sharded_aggregations(sample_record):
+    assertion = published_assertion(sample_record)
+    fdo_iri, shard_uri = URIRef("https://hdl.handle.net/21.T11966/abc123"), URIRef("https://w3id.org/np/RAshard")
+    assertion.add((fdo_iri, HAS_SHARD, shard_uri))
+    diff_record(assertion, sample_record)
+    assertion.add((fdo_iri, FDOF.hasMetadata, shard_uri))
+    with pytest.raises(ValueError, match="sharded aggregation"):
+        diff_record(assertion, sample_record)
+
+
+@patch("nanopub.fdo.update.resolve_in_nanopub_network")
+@patch("nanopub.fdo.update.NanopubUpdate")
+def test_no_update_when_unchanged(mock_update_cls, mock_resolve, sample_conf, sample_record):
+    existing_npub = MagicMock()
+    existing_npub.signed_with_public_key = sample_conf.profile.public_key
+    existing_npub.source_uri = "https://w3id.org/np/RAexisting"
+    existing_npub.assertion = published_assertion(sample_record)
+    mock_resolve.return_value = existing_npub
+
+    result = update_record("https://hdl.handle.net/21.T11966/abc123", sample_record, publish=True, conf=sample_conf)
+
+    mock_update_cls.assert_not_called()
+    assert result == (None, None, None)
+
+
+@patch("nanopub.fdo.update.resolve_in_nanopub_network")
+@patch("nanopub.fdo.update.NanopubUpdate")
+def test_update_without_publishing(mock_update_cls, mock_resolve, sample_conf, sample_record):
+    existing_npub = MagicMock()
+    existing_npub.signed_with_public_key = sample_conf.profile.public_key
+    existing_npub.source_uri = "https://w3id.org/np/RAexisting"
+    existing_npub.assertion = published_assertion(sample_record)
+    mock_resolve.return_value = existing_npub
+    mock_update_cls.return_value.source_uri = "https://w3id.org/np/RAupdate"
+
+    changed = sample_record.copy()
+    changed.set_label("New label")
+    result = update_record("https://hdl.handle.net/21.T11966/abc123", changed, publish=False, conf=sample_conf)
+
+    mock_update_cls.return_value.sign.assert_called_once()
+    mock_update_cls.return_value.publish.assert_not_called()
+    assert result == (None, None, None)
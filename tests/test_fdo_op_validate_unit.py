@@ -1,9 +1,11 @@
 import json
+import threading
 import pytest
 from unittest.mock import patch, MagicMock
 from rdflib import URIRef, Graph, Literal, BNode
 from rdflib.namespace import DCTERMS, RDFS, RDF, SH, XSD
-from nanopub.fdo.validate import validate_fdo_record
+from nanopub.fdo.utils import FDO_PROFILE_TARGET_CLASS, JsonSchemaChecker, convert_jsonschema_to_shacl
+from nanopub.fdo.validate import ShapeCache, _validate_graph, validate_fdo_record, validate_fdo_records
 from nanopub.fdo.fdo_record import FdoRecord
 from nanopub.fdo.fdo_nanopub import to_hdl_uri
 from nanopub.namespaces import FDOF
@@ -218,3 +220,213 @@ def test_invalid_fdo_from_nanopub_network(mock_resolve, mock_get):
 
     assert result.is_valid is False
     assert len(result.errors) > 0
+
+
+HANDLE_METADATA_WITH_REQUIRED = {
+    "responseCode": 1,
+    "handle": "21.T11966/996c38676da9ee56f8ab",
+    "values": [
+        {
+            "index": 3,
+            "type": "21.T11966/JsonSchema",
+            "data": {"format": "string", "value": json.dumps(JSON_SCHEMA)},
+        }
+    ],
+}
+
+
+@patch("nanopub.fdo.validate.requests.get")
+def test_shape_cache_resolves_profile_once(mock_get, valid_fdo_record, tmp_path):
+    mock_get.return_value = MagicMock(status_code=200, json=lambda: HANDLE_METADATA_WITH_REQUIRED)
+    now = [0.0]
+    cache = ShapeCache(ttl=60, directory=tmp_path, clock=lambda: now[0])
+
+    results = [validate_fdo_record(valid_fdo_record, shape_cache=cache) for _ in range(5)]
+    assert all(r.is_valid for r in results)
+    assert mock_get.call_count == 1
+    assert (cache.stats.hits, cache.stats.misses) == (4, 1)
+
+    # The shapes are reloaded from disk by another cache
+    other = ShapeCache(ttl=60, directory=tmp_path, clock=lambda: now[0])
+    assert validate_fdo_record(valid_fdo_record, shape_cache=other).is_valid
+    assert other.get(valid_fdo_record.get_profile()).required == cache.get(valid_fdo_record.get_profile()).required
+    assert mock_get.call_count == 1
+
+    # Expired shapes are resolved again
+    now[0] = 61
+    validate_fdo_record(valid_fdo_record, shape_cache=cache)
+    assert mock_get.call_count == 2
+
+
+@patch("nanopub.fdo.validate.requests.get")
+def test_shape_cache_skips_failures(mock_get, valid_fdo_record):
+    mock_get.return_value = MagicMock(status_code=404)
+    cache = ShapeCache()
+    for _ in range(2):
+        result = validate_fdo_record(valid_fdo_record, shape_cache=cache)
+        assert result.errors == ["Could not fetch handle metadata for https://hdl.handle.net/api/handles/21.T11966/996c38676da9ee56f8ab"]
+    assert mock_get.call_count == 2
+    assert len(cache) == 0
+
+
+def test_shape_cache_builds_concurrent_lookups_once():
+    cache = ShapeCache(maxsize=2)
+    started, release = threading.Event(), threading.Event()
+    builds = []
+
+    def build():
+        builds.append(1)
+        started.set()
+        release.wait(5)
+        return label_shapes()
+
+    first = threading.Thread(target=cache.get_or_build, args=("https://example.org/profile", build))
+    first.start()
+    started.wait(5)
+    second = threading.Thread(target=cache.get_or_build, args=("https://example.org/profile", build))
+    second.start()
+    second.join(0.1)
+    release.set()
+    first.join()
+    second.join()
+    assert len(builds) == 1
+    assert (cache.stats.hits, cache.stats.misses) == (1, 1)
+
+    # Nothing is kept per profile beyond the bounded cache
+    for i in range(10):
+        cache.get_or_build(f"https://example.org/profile/{i}", label_shapes)
+    assert len(cache) == 2
+    assert not cache._single_flight._in_flight
+
+
+def label_shapes() -> Graph:
+    """Profile requiring exactly one label on FAIR digital objects."""
+    profile_graph = Graph()
+    shape = BNode()
+    property_bnode = BNode()
+    profile_graph.add((shape, RDF.type, SH.NodeShape))
+    profile_graph.add((shape, SH.targetClass, FDOF.FAIRDigitalObject))
+    profile_graph.add((shape, SH.property, property_bnode))
+    profile_graph.add((property_bnode, SH.path, RDFS.label))
+    profile_graph.add((property_bnode, SH.minCount, Literal("1")))
+    profile_graph.add((property_bnode, SH.maxCount, Literal("1")))
+    return profile_graph
+
+
+@patch("nanopub.fdo.validate.resolve_in_nanopub_network")
+def test_shape_cache_nanopub_profile(mock_resolve):
+    profile_uri = "https://w3id.org/np/RAprofile"
+    profile_graph = label_shapes()
+    property_bnode = profile_graph.value(predicate=SH.path, object=RDFS.label, any=False)
+    mock_resolve.return_value = MagicMock(assertion=profile_graph)
+
+    cache = ShapeCache()
+    record = FdoRecord(profile_uri=profile_uri, label="Example FDO")
+    assert validate_fdo_record(record, shape_cache=cache).is_valid
+    assert validate_fdo_record(record, shape_cache=cache).is_valid
+    assert mock_resolve.call_count == 1
+    # The fetched profile is not modified when fixing its constraints
+    assert profile_graph.value(property_bnode, SH.minCount) == Literal("1")
+
+
+def make_fdo(i: int, labels=("Example FDO",), profile_uri="https://w3id.org/np/RAprofile") -> FdoRecord:
+    record_graph = Graph()
+    subject = URIRef(f"{HDL_PREFIX}21.T11966/fdo{i}")
+    record_graph.add((subject, RDF.type, FDOF.FAIRDigitalObject))
+    record_graph.add((subject, DCTERMS.conformsTo, URIRef(profile_uri)))
+    for label in labels:
+        record_graph.add((subject, RDFS.label, Literal(label)))
+    return FdoRecord(assertion=record_graph)
+
+
+@pytest.mark.parametrize("workers, batch_size", [(0, 500), (0, 2), (2, 2)])
+@patch("nanopub.fdo.validate.requests.get")
+@patch("nanopub.fdo.validate.resolve_in_nanopub_network")
+def test_validate_fdo_records(mock_resolve, mock_get, workers, batch_size):
+    mock_resolve.return_value = MagicMock(assertion=label_shapes())
+    mock_get.return_value = MagicMock(status_code=404)
+    records = [
+        make_fdo(0),
+        make_fdo(1, labels=()),
+        make_fdo(2, labels=("A", "B")),
+        make_fdo(3, profile_uri="https://hdl.handle.net/21.T11966/missing"),
+        make_fdo(4),
+        make_fdo(5, profile_uri="https://hdl.handle.net/21.T11966/missing"),
+    ]
+
+    results = validate_fdo_records(records, workers=workers, batch_size=batch_size)
+    assert [r.is_valid for r in results] == [True, False, False, False, True, False]
+    assert results == [validate_fdo_record(record) for record in records]
+    assert mock_resolve.call_count == 1 + 4
+    assert mock_get.call_count == 1 + 2
+
+
+@patch("nanopub.fdo.validate.resolve_in_nanopub_network")
+def test_validate_fdo_records_referencing_each_other(mock_resolve):
+    shapes = label_shapes()
+    # Objects pointed to by isMaterializedBy must be labelled FAIR digital objects
+    shape = BNode()
+    shapes.add((shape, RDF.type, SH.NodeShape))
+    shapes.add((shape, SH.targetObjectsOf, FDOF.isMaterializedBy))
+    shapes.add((shape, SH["class"], FDOF.FAIRDigitalObject))
+    mock_resolve.return_value = MagicMock(assertion=shapes)
+    records = [make_fdo(0), make_fdo(1)]
+    records[0].set_data_ref(URIRef(f"{HDL_PREFIX}21.T11966/fdo1"))
+
+    results = validate_fdo_records(records, workers=0)
+    assert results == [validate_fdo_record(record) for record in records]
+    assert results[0].is_valid is False
+
+
+@pytest.mark.parametrize("schema, compiles", [
+    (JSON_SCHEMA, True),
+    ({"$schema": "http://json-schema.org/draft-07/schema#", "title": "Profile", "properties": {
+        "21.T11966/FdoProfile": {"type": "string", "description": "Profile"}}, "required": ["21.T11966/FdoProfile"]}, True),
+    ({"$ref": "https://example.org/schema/fdo.json"}, False),
+    ({"required": ["21.T11966/size"], "properties": {"21.T11966/size": {"type": "integer"}}}, False),
+    ({"required": ["21.T11966/name"], "properties": {"21.T11966/name": {"type": "string", "pattern": "^a"}}}, False),
+    ({"type": "array"}, False),
+    ({"allOf": [JSON_SCHEMA]}, False),
+])
+def test_json_schema_checker_compile(schema, compiles):
+    assert (JsonSchemaChecker.compile(schema) is not None) == compiles
+
+
+@pytest.mark.parametrize("values", [
+    {"21.T11966/FdoProfile": [Literal("21.T11966/996c38676da9ee56f8ab")], "21.T11966/b5b58656b1fa5aff0505": [Literal("a")]},
+    {"21.T11966/FdoProfile": [Literal("21.T11966/996c38676da9ee56f8ab")]},
+    {"21.T11966/b5b58656b1fa5aff0505": [Literal("a"), Literal("b")]},
+    {"21.T11966/FdoProfile": [URIRef(HDL_PREFIX + "21.T11966/996c38676da9ee56f8ab")],
+     "21.T11966/b5b58656b1fa5aff0505": [Literal(1), Literal("a", lang="en"), Literal("a", datatype=XSD.string)]},
+])
+@pytest.mark.parametrize("typed", [True, False])
+def test_json_schema_checker_matches_shacl(values, typed):
+    record = FdoRecord(profile_uri="21.T11966/996c38676da9ee56f8ab", label="Example FDO")
+    record.set_id("21.T11966/fdo")
+    if typed:
+        record.tuples[RDF.type] = FDO_PROFILE_TARGET_CLASS
+    for field, objects in values.items():
+        record.tuples[URIRef(HDL_PREFIX + field)] = objects if len(objects) > 1 else objects[0]
+
+    errors = JsonSchemaChecker.compile(JSON_SCHEMA).check(record)
+    expected = _validate_graph(record.get_graph(), convert_jsonschema_to_shacl(JSON_SCHEMA))
+    assert (not errors) == expected.is_valid
+    assert sorted(errors) == sorted(expected.errors)
+
+
+@patch("nanopub.fdo.validate.validate")
+@patch("nanopub.fdo.validate.requests.get")
+def test_validate_fdo_record_json_schema_fast_path(mock_get, mock_validate, valid_fdo_record):
+    mock_get.return_value = MagicMock(status_code=200, json=lambda: HANDLE_METADATA_WITH_REQUIRED)
+    valid_fdo_record.tuples[RDF.type] = FDO_PROFILE_TARGET_CLASS
+
+    result = validate_fdo_record(valid_fdo_record)
+    assert result.is_valid is False
+    assert result.errors == [
+        "Less than 1 values on <https://hdl.handle.net/996c38676da9ee56f8ab>->"
+        "<https://hdl.handle.net/21.T11966/FdoProfile>",
+        "Less than 1 values on <https://hdl.handle.net/996c38676da9ee56f8ab>->"
+        "<https://hdl.handle.net/21.T11966/b5b58656b1fa5aff0505>",
+    ]
+    assert validate_fdo_records([valid_fdo_record], workers=0) == [result]
+    mock_validate.assert_not_called()
@@ -1,6 +1,7 @@
 import pytest
 from unittest.mock import MagicMock
 from nanopub.fdo.fdo_query import FdoQuery
+from nanopub.query_cache import MemoryQueryCache
 
 @pytest.fixture
 def mock_client():
@@ -52,3 +53,36 @@ def test_get_feed_raises_on_empty(fdo_query):
 def test_get_favorite_things_raises_on_empty(fdo_query):
     with pytest.raises(ValueError, match="must not be empty"):
         fdo_query.get_favorite_things("")
+
+def test_cache_shares_results_between_chunks(mock_client):
+    mock_client._search.return_value = iter([{"np": f"np{i}", "date": "2024"} for i in range(5)])
+    fdo_query = FdoQuery(mock_client, cache=MemoryQueryCache())
+    assert [r["np"] for r in fdo_query.chunk("text_search", "test", index=1, chunk_size=2)] == ["np0", "np1"]
+    assert [r["np"] for r in fdo_query.chunk("text_search", "test", index=3, chunk_size=2)] == ["np4"]
+    assert mock_client._search.call_count == 1
+
+def test_chunks_are_lazy(fdo_query):
+    chunks = fdo_query.chunks("get_feed", "https://orcid.org/1234", chunk_size=1)
+    assert next(chunks) == [{"id": 1}]
+    assert list(chunks) == [[{"id": 2}]]
+    with pytest.raises(ValueError, match="Unknown FDO query"):
+        fdo_query.chunk("_search", "x")
+
+def test_run_many_merges_and_dedupes(mock_client):
+    feeds = {
+        "https://orcid.org/1": [
+            {"np": "np3", "fdo": "fdo-b", "date": "2024-03"},
+            {"np": "np1", "fdo": "fdo-a", "date": "2024-01"},
+        ],
+        "https://orcid.org/2": [
+            {"np": "np2", "fdo": "fdo-a", "date": "2024-02"},
+        ],
+    }
+    mock_client._search.side_effect = lambda endpoint, params: iter(feeds[params["creator"]])
+    fdo_query = FdoQuery(mock_client, workers=2)
+    creators = ["https://orcid.org/1", "https://orcid.org/2", "https://orcid.org/1"]
+    assert [r["np"] for r in fdo_query.get_feeds(creators)] == ["np3", "np2"]
+    assert [r["np"] for r in fdo_query.get_feeds(creators, dedupe=False)] == ["np3", "np2", "np1"]
+    assert mock_client._search.call_count == 4
+    with pytest.raises(ValueError, match="must not be empty"):
+        fdo_query.run_many([("get_feed", "https://orcid.org/1"), ("text_search", "")])
@@ -1,6 +1,6 @@
 import pytest
 from rdflib import Graph, URIRef, Literal
-from rdflib.namespace import RDFS, DCTERMS
+from rdflib.namespace import RDFS, DCTERMS, PROV
 from nanopub.namespaces import FDOF, FDOC
 from nanopub.fdo.fdo_record import FdoRecord
 
@@ -93,3 +93,62 @@ def test_str_repr_output():
     s = str(record)
     assert "Label: Example FDO" in s
     assert "Profile: https://hdl.handle.net/21.T11966/abc123" in s
+
+def test_properties_store_is_ordered_and_deduplicated():
+    record = FdoRecord(profile_uri=PROFILE_URI)
+    parts = [URIRef(f"https://example.org/fdo/{i}") for i in range(5000)]
+    for part in parts + parts[:10]:
+        record.add_aggregate(part)
+        record.add_derivation(part)
+
+    assert record.tuples.objects(DCTERMS.hasPart) == parts
+    assert record.tuples.count(PROV.wasDerivedFrom) == 5000
+    record.set_data_ref(DATAREF_URI)
+    record.set_data_ref(DATAREF_URI)
+    assert record.get_data_ref() == URIRef(DATAREF_URI)
+
+    # Values can still be set as a term or a list
+    record.tuples[RDFS.seeAlso] = [URIRef("https://example.org/a"), URIRef("https://example.org/b")]
+    assert record.tuples[RDFS.seeAlso] == [URIRef("https://example.org/a"), URIRef("https://example.org/b")]
+    record.tuples = {RDFS.label: Literal(LABEL)}
+    assert record.get_label() == LABEL
+
+def test_graph_is_cached_until_the_record_changes():
+    record = FdoRecord(profile_uri=PROFILE_URI, label=LABEL)
+    g = record.get_graph()
+    assert record.get_graph() is g
+
+    record.add_aggregate(URIRef("https://example.org/fdo/1"))
+    g2 = record.get_graph()
+    assert g2 is not g
+    assert (URIRef("https://hdl.handle.net/abc123"), DCTERMS.hasPart, URIRef("https://example.org/fdo/1")) in g2
+
+    record.set_id("other")
+    assert (URIRef("https://hdl.handle.net/other"), RDFS.label, Literal(LABEL)) in record.get_graph()
+
+def test_from_assertions():
+    graphs = []
+    for i in range(3):
+        g = Graph()
+        subj = URIRef(f"https://hdl.handle.net/21.T11966/fdo{i}")
+        g.add((subj, DCTERMS.conformsTo, URIRef(PROFILE_URI)))
+        g.add((subj, RDFS.label, Literal(f"FDO {i}")))
+        graphs.append(g)
+    records = FdoRecord.from_assertions(graphs)
+    assert [r.get_label() for r in records] == ["FDO 0", "FDO 1", "FDO 2"]
+    assert [r.get_profile() for r in records] == [URIRef(PROFILE_URI)] * 3
+
+def test_changing_the_values_of_a_predicate_changes_the_record():
+    record = FdoRecord(profile_uri=PROFILE_URI)
+    agg1, agg2, agg3 = (URIRef(f"https://example.org/fdo/{i}") for i in range(3))
+    record.add_aggregate(agg1)
+    record.add_aggregate(agg2)
+    g = record.get_graph()
+
+    record.tuples[DCTERMS.hasPart].append(agg3)
+    record.tuples[DCTERMS.hasPart].append(agg1)
+    assert record.tuples.objects(DCTERMS.hasPart) == [agg1, agg2, agg3]
+    record.tuples[DCTERMS.hasPart].remove(agg2)
+    assert record.tuples[DCTERMS.hasPart] == [agg1, agg3]
+    assert (URIRef("https://hdl.handle.net/abc123"), DCTERMS.hasPart, agg3) in record.get_graph()
+    assert record.get_graph() is not g
@@ -0,0 +1,121 @@
+import threading
+import time
+from unittest.mock import MagicMock, patch
+
+import pytest
+import requests
+
+from nanopub import Nanopub, NanopubClient, NanopubConf
+from nanopub.hedging import fetch_nanopub_hedged, get_trusty_artefact, hedge_delay, hedged_call
+from nanopub.server_selection import ServerSelector
+
+TRUSTY = "RAIh8Oq-29dIVTZDhETpJ6f8oxxrILbZ3gSxkyAQY4220"
+
+
+def test_hedged_call_returns_first_answer():
+    release_slow = threading.Event()
+
+    def call(target):
+        if target == "slow":
+            release_slow.wait(timeout=5)
+        return target
+
+    discarded = []
+    result, target = hedged_call(call, ["slow", "fast"], hedge_after=0.01, discard=discarded.append)
+    assert (result, target) == ("fast", "fast")
+    release_slow.set()
+    for _ in range(100):
+        if discarded:
+            break
+        time.sleep(0.01)
+    assert discarded == ["slow"]
+
+
+def test_hedged_call_does_not_hedge_fast_answers():
+    calls = []
+
+    def call(target):
+        calls.append(target)
+        return target
+
+    assert hedged_call(call, ["a", "b"], hedge_after=5) == ("a", "a")
+    assert calls == ["a"]
+
+
+def test_hedged_call_fails_over_on_error():
+    def call(target):
+        if target == "down":
+            raise requests.ConnectionError("down")
+        return target
+
+    assert hedged_call(call, ["down", "up"], hedge_after=5) == ("up", "up")
+    with pytest.raises(requests.ConnectionError):
+        hedged_call(call, ["down"], hedge_after=5)
+
+
+def test_hedge_delay_uses_observed_latencies():
+    selector = ServerSelector(["a"])
+    assert hedge_delay(selector, 0.95) == 1.0
+    for latency in [0.2, 0.3, 0.4]:
+        selector.record_success("a", latency)
+    assert hedge_delay(selector, 1.0) == 0.4
+
+
+def test_get_trusty_artefact():
+    assert get_trusty_artefact(f"https://w3id.org/np/{TRUSTY}") == TRUSTY
+    assert get_trusty_artefact("https://example.org/np/1") is None
+
+
+def test_fetch_nanopub_hedged_skips_missing_registry():
+    selector = ServerSelector(["https://r1.example.org/np/", "https://r2.example.org/np/"])
+    selector.record_success("https://r1.example.org/np/", 0.1)
+    selector.record_success("https://r2.example.org/np/", 0.5)
+
+    def get(url, **kwargs):
+        r = MagicMock(ok=url.startswith("https://r2"), status_code=200 if url.startswith("https://r2") else 404)
+        r.elapsed.total_seconds.return_value = 0.1
+        if not r.ok:
+            r.raise_for_status.side_effect = requests.HTTPError("404")
+        return r
+
+    with patch("nanopub.hedging.requests.get", side_effect=get) as mock_get:
+        r = fetch_nanopub_hedged(TRUSTY, selector=selector)
+    assert r.ok
+    assert mock_get.call_count == 2
+    # The registry missing the nanopub is lagging behind
+    assert selector.stats("https://r1.example.org/np/").consecutive_failures == 1
+    assert selector.stats("https://r2.example.org/np/").successes == 2
+
+
+def test_fetch_nanopub_hedged_confirmed_not_found():
+    registries = ["https://r1.example.org/np/", "https://r2.example.org/np/"]
+    selector = ServerSelector(registries)
+
+    def get(url, **kwargs):
+        r = MagicMock(ok=False, status_code=404)
+        r.elapsed.total_seconds.return_value = 0.1
+        r.raise_for_status.side_effect = requests.HTTPError("404")
+        return r
+
+    with patch("nanopub.hedging.requests.get", side_effect=get), pytest.raises(requests.HTTPError):
+        fetch_nanopub_hedged(TRUSTY, selector=selector)
+    # Both registries agree that the nanopub does not exist, they are healthy
+    assert [selector.stats(url).successes for url in registries] == [1, 1]
+    assert [selector.stats(url).failures for url in registries] == [0, 0]
+
+
+def test_client_hedged_query():
+    client = NanopubClient(query_urls=["https://a.example.org/api/", "https://b.example.org/api/"], hedge_quantile=0.9)
+    ok = MagicMock(status_code=200)
+    with patch.object(NanopubClient, "_query_api", return_value=ok):
+        r, query_url = client._query_api_try_servers({}, "endpoint")
+    assert r is ok
+    assert client.server_selector.latency_percentile(0.5) is not None
+
+
+def test_nanopub_fetch_uses_hedging():
+    conf = NanopubConf(hedge_fetch_quantile=0.95)
+    with patch("nanopub.nanopub.fetch_nanopub_hedged", side_effect=RuntimeError("hedged")) as mock_fetch:
+        with pytest.raises(RuntimeError, match="hedged"):
+            Nanopub(f"https://w3id.org/np/{TRUSTY}", conf=conf)
+    mock_fetch.assert_called_once_with(TRUSTY, quantile=0.95)
@@ -0,0 +1,81 @@
+import requests
+
+from nanopub import Nanopub, NanopubRetract
+from nanopub.bulk import publish_many
+from nanopub.fdo import FdoNanopub
+from nanopub.fdo.retrieve import resolve_in_nanopub_network
+from nanopub.local_server import LocalNanopubServer
+from tests.conftest import EX, make_claim, make_conf
+
+
+def test_publish_and_fetch(server):
+    np = make_claim(make_conf(server), "Hello local server")
+    np.publish()
+    assert np.source_uri in server
+
+    fetched = Nanopub(np.source_uri, conf=server.conf())
+    assert fetched.has_valid_signature
+    assert len(fetched.rdf) == len(np.rdf)
+
+    trusty = np.source_uri.rsplit("/", 1)[-1]
+    r = requests.get(f"{server.registry_url}{trusty}.nq")
+    assert r.headers["Content-Type"] == "application/n-quads"
+    assert str(np.assertion.identifier) in r.text
+    assert requests.get(f"{server.registry_url}RAunknown.trig").status_code == 404
+
+
+def test_rejects_invalid_nanopubs(server):
+    np = make_claim(make_conf(server), "Tampered")
+    np.sign()
+    tampered = np.rdf.serialize(format="trig").replace("Tampered", "Modified")
+    r = requests.post(server.registry_url, data=tampered.encode(), headers={"Content-Type": "application/trig"})
+    assert r.status_code == 400
+    assert len(server) == 0
+
+
+def test_queries(server):
+    conf = make_conf(server)
+    np = make_claim(conf, "Hello local server")
+    np.publish()
+    client = server.client()
+
+    assert [r["np"] for r in client.find_nanopubs_with_pattern(subj=EX + "thing")] == [np.source_uri]
+    assert [r["label"] for r in client.find_nanopubs_with_text("local")] == ["Hello local server"]
+
+    NanopubRetract(uri=np.source_uri, conf=conf).publish()
+    assert list(client.find_nanopubs_with_pattern(subj=EX + "thing")) == []
+    assert len(list(client.find_nanopubs_with_pattern(subj=EX + "thing", filter_retracted=False))) == 1
+    assert client.retraction_status([np.source_uri])[np.source_uri].is_retracted
+    assert client.find_nanopubs_with_patterns([(EX + "thing", None, None)]) == [[]]
+
+
+def test_fdo_by_id(server):
+    conf = make_conf(server)
+    np = FdoNanopub("21.T11966/local", "Local FDO", conf=conf)
+    np.publish()
+    fetched = resolve_in_nanopub_network("21.T11966/local", conf=server.conf(), client=server.client())
+    assert fetched.source_uri == np.source_uri
+
+
+def test_injected_failures():
+    with LocalNanopubServer(failure_rate=0.5, seed=1) as server:
+        statuses = [requests.get(server.registry_url + "RAunknown.trig").status_code for _ in range(20)]
+    assert set(statuses) == {404, 503}
+    assert server.stats["injected_failures"] == statuses.count(503)
+
+    with LocalNanopubServer(failure_rate=0.5, seed=1) as server:
+        assert [requests.get(server.registry_url + "RAunknown.trig").status_code for _ in range(20)] == statuses
+
+
+def test_publish_many_with_retries(tmp_path):
+    with LocalNanopubServer(failure_rate=0.3, seed=3, directory=tmp_path) as server:
+        conf = make_conf(server)
+        results = list(publish_many(
+            [make_claim(conf, f"Claim {i}") for i in range(10)], conf, sign_workers=0, upload_workers=4, backoff=0.01
+        ))
+        assert all(r.published for r in results)
+        assert len(server) == 10
+        assert any(r.attempts > 1 for r in results)
+
+    assert len(list(tmp_path.glob("*.trig"))) == 10
+    assert len(LocalNanopubServer(directory=tmp_path)) == 10
@@ -1,5 +1,12 @@
+import gzip
+import io
+from dataclasses import replace
+from unittest.mock import MagicMock, patch
+
 import pytest
+import requests
 from rdflib import BNode, Graph, Literal, URIRef
+from urllib3 import HTTPResponse
 
 from nanopub import Nanopub, NanopubClaim, NanopubConf, NanopubRetract, NanopubUpdate, create_nanopub_index, namespaces
 from nanopub.templates.nanopub_introduction import NanopubIntroduction
@@ -238,3 +245,34 @@ def test_specific_file():
             )
         )
     np.sign()
+
+
+def test_nanopub_fetch_parses_compressed_stream():
+    np = Nanopub(conf=default_conf, assertion=Graph().add((
+        URIRef('http://test'), namespaces.HYCL.claims, Literal('This is a test of nanopub-python')
+    )))
+    np.sign()
+    response = requests.Response()
+    response.status_code = 200
+    response.raw = HTTPResponse(
+        body=io.BytesIO(gzip.compress(np.rdf.serialize(format="trig").encode())),
+        headers={"Content-Encoding": "gzip"},
+        preload_content=False,
+    )
+    with patch("nanopub.nanopub.requests.get", return_value=response) as mock_get:
+        fetched = Nanopub(np.source_uri)
+    assert mock_get.call_args.kwargs["stream"] is True
+    assert fetched.source_uri == np.source_uri
+    assert fetched.has_valid_signature
+
+
+def test_nanopub_publish_compressed():
+    conf = replace(default_conf, compress_uploads=True)
+    np = Nanopub(conf=conf, assertion=Graph().add((
+        URIRef('http://test'), namespaces.HYCL.claims, Literal('This is a test of nanopub-python')
+    )))
+    with patch("nanopub.sign_utils.requests.post", return_value=MagicMock()) as mock_post:
+        np.publish()
+    kwargs = mock_post.call_args.kwargs
+    assert kwargs["headers"]["Content-Encoding"] == "gzip"
+    assert np.source_uri.split("/")[-1].encode() in gzip.decompress(kwargs["data"].read())
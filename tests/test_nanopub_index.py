@@ -0,0 +1,107 @@
+from unittest.mock import patch
+
+import pytest
+from rdflib.namespace import RDFS
+
+from nanopub import append_to_nanopub_index, create_nanopub_index, iter_nanopub_index
+from nanopub.namespaces import NPX
+from tests.conftest import default_conf
+
+INDEX_ARGS = dict(
+    title="My nanopub index",
+    description="This is my nanopub index",
+    creation_time="2020-09-21T00:00:00",
+    creators=["https://orcid.org/0000-0000-0000-0000"],
+)
+
+
+def np_uris(count: int):
+    return (f"https://w3id.org/np/RAexample{i}" for i in range(count))
+
+
+def index_elements(indexes, uri: str):
+    """Elements reachable from the index with the given URI, following npx:appendsIndex."""
+    index = {i.source_uri: i for i in indexes}[uri]
+    elements = [str(o) for o in index.assertion.objects(None, NPX.includesElement)]
+    for appended in index.assertion.objects(None, NPX.appendsIndex):
+        elements.extend(index_elements(indexes, str(appended)))
+    return elements
+
+
+@pytest.mark.parametrize("count, sign_workers", [(1, 0), (4, 0), (9, 0), (16, 2)])
+def test_iter_nanopub_index_levels(count, sign_workers):
+    with patch("nanopub.templates.nanopub_index.MAX_NP_PER_INDEX", 2):
+        indexes = list(iter_nanopub_index(default_conf, np_uris(count), sign_workers=sign_workers, **INDEX_ARGS))
+
+    assert all(i.has_valid_signature for i in indexes)
+    assert all(len(set(i.assertion.predicates())) == 1 for i in indexes)
+    assert all(len(i.assertion) <= 2 for i in indexes)
+    assert sorted(index_elements(indexes, indexes[-1].source_uri)) == sorted(np_uris(count))
+    # The top level index is the only one not appended by another
+    appended = {str(o) for i in indexes for o in i.assertion.objects(None, NPX.appendsIndex)}
+    assert [i.source_uri for i in indexes if i.source_uri not in appended] == [indexes[-1].source_uri]
+
+
+@pytest.mark.parametrize("sign_workers", [0, 2])
+def test_iter_nanopub_index_keeps_input_order(sign_workers):
+    with patch("nanopub.templates.nanopub_index.MAX_NP_PER_INDEX", 2):
+        indexes = list(iter_nanopub_index(default_conf, np_uris(9), sign_workers=sign_workers, **INDEX_ARGS))
+
+    # Every index gives access to consecutive nanopubs of the input
+    order = {uri: i for i, uri in enumerate(np_uris(9))}
+    for index in indexes:
+        positions = sorted(order[uri] for uri in index_elements(indexes, index.source_uri))
+        assert positions == list(range(positions[0], positions[0] + len(positions)))
+
+
+def test_iter_nanopub_index_is_lazy():
+    consumed = []
+
+    def uris():
+        for uri in np_uris(100):
+            consumed.append(uri)
+            yield uri
+
+    with patch("nanopub.templates.nanopub_index.MAX_NP_PER_INDEX", 2):
+        first = next(iter_nanopub_index(default_conf, uris(), sign_workers=0, max_pending=1, **INDEX_ARGS))
+    assert len(first.assertion) == 2
+    assert len(consumed) == 2
+
+
+def test_create_nanopub_index_single_top_level():
+    with patch("nanopub.templates.nanopub_index.MAX_NP_PER_INDEX", 3):
+        indexes = create_nanopub_index(default_conf, list(np_uris(7)), **INDEX_ARGS)
+    assert [len(list(i.assertion.objects(None, NPX.appendsIndex))) for i in indexes] == [0, 0, 0, 3]
+
+
+def test_append_small_batch_to_index():
+    with patch("nanopub.templates.nanopub_index.MAX_NP_PER_INDEX", 3):
+        indexes = create_nanopub_index(default_conf, list(np_uris(7)), **INDEX_ARGS)
+        new = [f"https://w3id.org/np/RAnew{i}" for i in range(3)]
+        appended = append_to_nanopub_index(default_conf, indexes[-1], new, creation_time="2020-09-22T00:00:00")
+
+    [top] = appended
+    assert top.has_valid_signature
+    assert [str(o) for o in top.assertion.objects(None, NPX.appendsIndex)] == [indexes[-1].source_uri]
+    assert sorted(index_elements(indexes + appended, top.source_uri)) == sorted(list(np_uris(7)) + new)
+    assert "My nanopub index" in top.rdf.serialize(format="trig")
+
+
+def test_append_large_batch_to_index_uri():
+    previous = "https://w3id.org/np/RAprevious"
+    with patch("nanopub.templates.nanopub_index.MAX_NP_PER_INDEX", 2):
+        appended = append_to_nanopub_index(
+            default_conf, previous, np_uris(5), see_also="https://example.org/index", **INDEX_ARGS
+        )
+
+    top = appended[-1]
+    assert {str(o) for o in top.assertion.objects(None, NPX.appendsIndex)} == {previous, appended[-2].source_uri}
+    assert sorted(index_elements(appended, appended[-2].source_uri)) == sorted(np_uris(5))
+    assert append_to_nanopub_index(default_conf, previous, [], see_also="https://example.org/index", **INDEX_ARGS) == []
+
+
+def test_append_to_index_keeps_see_also():
+    see_also = "https://example.org/index"
+    [index] = create_nanopub_index(default_conf, list(np_uris(2)), see_also=see_also, **INDEX_ARGS)
+    [top] = append_to_nanopub_index(default_conf, index, ["https://w3id.org/np/RAnew"], **INDEX_ARGS)
+    assert [str(o) for o in top.pubinfo.objects(None, RDFS.seeAlso)] == [see_also]
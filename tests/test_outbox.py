@@ -0,0 +1,78 @@
+from unittest.mock import MagicMock, patch
+
+import requests
+
+from nanopub.definitions import TEST_NANOPUB_REGISTRY_URL
+from nanopub.outbox import FAILED, PUBLISHED, SIGNED, UNSIGNED_PREFIX, UPLOADING, PublishOutbox
+from tests.conftest import default_conf, make_claim, make_session
+
+
+def test_outbox_add_and_drain(tmp_path):
+    with PublishOutbox(tmp_path / "outbox.db") as box:
+        source_uris = box.add([make_claim(default_conf, f"Claim {i}") for i in range(3)], default_conf, sign_workers=0)
+        assert box.add([make_claim(default_conf, "Claim 0")], default_conf, sign_workers=0) == source_uris[:1]
+        assert box.status() == {SIGNED: 3, UPLOADING: 0, PUBLISHED: 0, FAILED: 0}
+        assert {item.server for item in box.items()} == {TEST_NANOPUB_REGISTRY_URL}
+
+        session = make_session()
+        assert box.drain(workers=2, session=session)[PUBLISHED] == 3
+        assert session.post.call_count == 3
+
+        # Published nanopubs are not published again
+        box.add([make_claim(default_conf, "Claim 0")], default_conf, sign_workers=0)
+        box.drain(session=session)
+        assert session.post.call_count == 3
+
+
+def test_outbox_resumes_interrupted_uploads(tmp_path):
+    path = tmp_path / "outbox.db"
+    with PublishOutbox(path) as box:
+        box.add([make_claim(default_conf, f"Claim {i}") for i in range(2)], default_conf, sign_workers=0)
+        box._claim(1)
+        assert box.status()[UPLOADING] == 1
+
+    with PublishOutbox(path) as box:
+        # The claimed nanopub may still be uploaded by another drain
+        session = make_session()
+        assert box.drain(session=session)[PUBLISHED] == 1
+        assert box.status()[UPLOADING] == 1
+
+        # Until its lease expired
+        assert box.drain(session=session, lease=0)[PUBLISHED] == 2
+        assert session.post.call_count == 2
+
+
+def test_outbox_failed_and_retry(tmp_path):
+    with PublishOutbox(tmp_path / "outbox.db") as box:
+        [source_uri] = box.add([make_claim(default_conf, "Claim 0")], default_conf, sign_workers=0)
+        session = MagicMock()
+        session.post.side_effect = requests.ConnectionError("down")
+        with patch("nanopub.bulk.time.sleep"):
+            assert box.drain(session=session, max_retries=1)[FAILED] == 1
+        [item] = box.items(FAILED)
+        assert item.source_uri == source_uri
+        assert "down" in item.error
+
+        assert box.retry_failed() == 1
+        assert box.drain(session=make_session())[PUBLISHED] == 1
+        assert box.items(PUBLISHED)[0].attempts == 2
+
+
+def test_outbox_keeps_nanopubs_that_cannot_be_signed(tmp_path):
+    broken = tmp_path / "broken.trig"
+    broken.write_text("<http://example.org/s> <http://example.org/p> <http://example.org/o> .")
+    with PublishOutbox(tmp_path / "outbox.db") as box:
+        claims = [make_claim(default_conf, f"Claim {i}") for i in range(2)]
+        source_uris = box.add([claims[0], broken, tmp_path / "missing.trig", claims[1]], default_conf, sign_workers=2)
+        assert source_uris[1:3] == [None, None]
+        assert None not in (source_uris[0], source_uris[3])
+        assert box.status() == {SIGNED: 2, UPLOADING: 0, PUBLISHED: 0, FAILED: 2}
+        failed = box.items(FAILED)
+        assert all(item.source_uri.startswith(UNSIGNED_PREFIX) and item.error for item in failed)
+        assert "missing.trig" in failed[1].error
+
+        # Nanopubs that could not be signed are not published
+        assert box.retry_failed() == 0
+        session = make_session()
+        assert box.drain(session=session)[PUBLISHED] == 2
+        assert session.post.call_count == 2
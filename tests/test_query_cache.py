@@ -0,0 +1,162 @@
+import threading
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from nanopub import NanopubClient
+from nanopub.query_cache import DiskQueryCache, MemoryQueryCache, QueryCache, SingleFlight, make_cache_key
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_make_cache_key_normalizes_params():
+    assert make_cache_key("endpoint", {"b": "2", "a": "1"}) == make_cache_key("endpoint", {"a": "1", "b": "2"})
+    assert make_cache_key("endpoint", {"a": "1", "pubkey": None}) == make_cache_key("endpoint", {"a": "1"})
+    assert make_cache_key("endpoint", {"a": "1"}) != make_cache_key("other", {"a": "1"})
+    assert make_cache_key("endpoint", {}, ["https://a/", "https://b/"]) == make_cache_key("endpoint", {}, ["https://b/", "https://a/"])
+    assert make_cache_key("endpoint", {}, ["https://a/"]) != make_cache_key("endpoint", {}, ["https://b/"])
+
+
+def test_query_cache_is_abstract():
+    with pytest.raises(TypeError):
+        QueryCache()
+
+
+def test_memory_cache_ttl():
+    clock = FakeClock()
+    cache = MemoryQueryCache(ttl=10, clock=clock)
+    fetch = MagicMock(return_value=["result"])
+
+    assert cache.get_or_fetch("key", fetch) == ["result"]
+    assert cache.get_or_fetch("key", fetch) == ["result"]
+    assert fetch.call_count == 1
+    clock.now += 11
+    assert cache.get("key") is None
+    cache.get_or_fetch("key", fetch)
+    assert fetch.call_count == 2
+    assert cache.stats.hits == 1
+    assert cache.stats.misses == 2
+    assert cache.stats.dict()["hit_ratio"] == pytest.approx(1 / 3)
+
+
+def test_memory_cache_lru_eviction():
+    cache = MemoryQueryCache(maxsize=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+    assert cache.get("a") == 1
+    assert cache.get("b") is None
+    assert cache.get("c") == 3
+    assert len(cache) == 2
+    assert cache.stats.evictions == 1
+
+
+def test_memory_cache_stale_while_revalidate():
+    clock = FakeClock()
+    cache = MemoryQueryCache(ttl=10, stale_ttl=60, clock=clock)
+    cache.set("key", "old")
+    clock.now += 30
+
+    refreshed = threading.Event()
+
+    def fetch():
+        refreshed.set()
+        return "new"
+
+    assert cache.get_or_fetch("key", fetch) == "old"
+    assert refreshed.wait(timeout=5)
+    for _ in range(100):
+        if cache.stats.revalidations:
+            break
+        threading.Event().wait(0.01)
+    assert cache.get("key") == "new"
+    assert cache.stats.stale_hits == 1
+
+
+def test_disk_cache_persists(tmp_path):
+    clock = FakeClock()
+    DiskQueryCache(tmp_path, ttl=10, clock=clock).set("key", [{"np": "uri"}])
+
+    cache = DiskQueryCache(tmp_path, ttl=10, clock=clock)
+    assert cache.get("key") == [{"np": "uri"}]
+    clock.now += 11
+    assert cache.get("key") is None
+    cache.clear()
+    assert list(tmp_path.glob("*.json")) == []
+
+
+def test_client_search_uses_cache():
+    client = NanopubClient(query_urls=["https://query.example.org/api/"], cache=MemoryQueryCache())
+    response = MagicMock()
+    response.json.return_value = {"results": {"bindings": [
+        {"np": {"value": "https://w3id.org/np/RA1"}, "date": {"value": "2024-01-01"}},
+    ]}}
+    with patch.object(NanopubClient, "_query_api_try_servers", return_value=(response, "url")) as mock_query:
+        first = list(client.find_nanopubs_with_text("test"))
+        first[0]["np"] = "altered"
+        second = list(client.find_nanopubs_with_text("test"))
+    assert mock_query.call_count == 1
+    assert second[0]["np"] == "https://w3id.org/np/RA1"
+    assert client.cache.stats.hits == 1
+
+
+def test_clients_of_different_servers_share_cache():
+    cache = MemoryQueryCache()
+    production = NanopubClient(cache=cache)
+    test = NanopubClient(use_test_server=True, cache=cache)
+    with patch.object(NanopubClient, "_query_api_csv", side_effect=["np\nprod\n", "np\ntest\n"]) as mock_csv:
+        assert production.execute_query_template("RAquery/name", {}) == [{"np": "prod"}]
+        assert test.execute_query_template("RAquery/name", {}) == [{"np": "test"}]
+        assert production.execute_query_template("RAquery/name", {}) == [{"np": "prod"}]
+    assert mock_csv.call_count == 2
+
+
+@pytest.mark.parametrize("cache", [None, MemoryQueryCache()])
+def test_client_execute_query_template_cache(cache):
+    client = NanopubClient(query_urls=["https://query.example.org/api/"], cache=cache)
+    with patch.object(NanopubClient, "_query_api_csv", return_value="np,label\nuri1,one\n") as mock_csv:
+        assert client.execute_query_template("RAquery/name", {"a": "1"}) == [{"np": "uri1", "label": "one"}]
+        assert client.execute_query_template("RAquery/name", {"a": "1"}) == [{"np": "uri1", "label": "one"}]
+    assert mock_csv.call_count == (2 if cache is None else 1)
+
+
+def test_single_flight_shares_running_calls():
+    single_flight = SingleFlight()
+    started, release = threading.Event(), threading.Event()
+    calls = []
+
+    def fetch():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        raise ValueError("down")
+
+    errors = []
+
+    def call():
+        try:
+            single_flight.do("key", fetch)
+        except ValueError as e:
+            errors.append(e)
+
+    first = threading.Thread(target=call)
+    first.start()
+    started.wait(5)
+    second = threading.Thread(target=call)
+    second.start()
+    second.join(0.1)
+    release.set()
+    first.join()
+    second.join()
+    assert len(calls) == 1
+    assert len(errors) == 2 and errors[0] is errors[1]
+
+    # Calls made once the first one is over run again
+    assert single_flight.do("key", lambda: 42) == 42
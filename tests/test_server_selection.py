@@ -0,0 +1,139 @@
+from unittest.mock import MagicMock, patch
+
+import pytest
+import requests
+
+from nanopub import NanopubClient
+from nanopub.definitions import NANOPUB_QUERY_URLS
+from nanopub.server_selection import CLOSED, HALF_OPEN, OPEN, ServerSelector, probe_server, shared_selector
+
+SERVERS = ["https://a.example.org/api/", "https://b.example.org/api/", "https://c.example.org/api/"]
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_ordered_prefers_fastest_server():
+    selector = ServerSelector(SERVERS)
+    selector.record_success(SERVERS[0], 0.9)
+    selector.record_success(SERVERS[1], 0.1)
+    selector.record_success(SERVERS[2], 0.5)
+    assert selector.ordered() == [SERVERS[1], SERVERS[2], SERVERS[0]]
+
+
+def test_ordered_avoids_failing_servers():
+    selector = ServerSelector(SERVERS[:2])
+    selector.record_success(SERVERS[0], 0.1)
+    selector.record_failure(SERVERS[0])
+    selector.record_success(SERVERS[0], 0.1)
+    selector.record_failure(SERVERS[0])
+    selector.record_success(SERVERS[1], 0.15)
+    assert selector.stats(SERVERS[0]).error_rate == 0.5
+    assert selector.ordered() == [SERVERS[1], SERVERS[0]]
+
+
+def test_unmeasured_servers_are_tried_first():
+    selector = ServerSelector(SERVERS)
+    selector.record_success(SERVERS[0], 0.1)
+    assert selector.ordered()[-1] == SERVERS[0]
+
+
+def test_circuit_opens_and_half_opens():
+    clock = FakeClock()
+    selector = ServerSelector(SERVERS, failure_threshold=2, reset_timeout=10, clock=clock)
+    selector.record_failure(SERVERS[0])
+    assert selector.state(SERVERS[0]) == CLOSED
+    selector.record_failure(SERVERS[0])
+    assert selector.state(SERVERS[0]) == OPEN
+    assert selector.ordered()[-1] == SERVERS[0]
+
+    clock.now += 11
+    assert selector.state(SERVERS[0]) == HALF_OPEN
+    selector.record_failure(SERVERS[0])
+    assert selector.state(SERVERS[0]) == OPEN
+
+    selector.record_success(SERVERS[0], 0.2)
+    assert selector.state(SERVERS[0]) == CLOSED
+    assert selector.stats(SERVERS[0]).error_rate == pytest.approx(0.75)
+
+
+def test_probe_open_servers():
+    selector = ServerSelector(SERVERS, failure_threshold=1)
+    selector.record_failure(SERVERS[0])
+    selector.record_failure(SERVERS[1])
+    selector.probe_open_servers(probe=lambda url: url == SERVERS[0])
+    assert selector.state(SERVERS[0]) == CLOSED
+    assert selector.state(SERVERS[1]) == OPEN
+
+
+def test_probe_server_requires_success_status():
+    with patch("nanopub.server_selection.requests.get", return_value=MagicMock(status_code=200)):
+        assert probe_server(SERVERS[0])
+    with patch("nanopub.server_selection.requests.get", return_value=MagicMock(status_code=404)):
+        assert not probe_server(SERVERS[0])
+    with patch("nanopub.server_selection.requests.get", side_effect=requests.ConnectionError("down")):
+        assert not probe_server(SERVERS[0])
+
+
+def test_probing_starts_when_a_circuit_opens():
+    selector = ServerSelector(SERVERS, failure_threshold=2, probe_when_open=True)
+    with patch.object(ServerSelector, "start_probing") as start_probing:
+        selector.record_failure(SERVERS[0])
+        start_probing.assert_not_called()
+        selector.record_failure(SERVERS[0])
+        selector.record_failure(SERVERS[0])
+        start_probing.assert_called_once_with()
+
+
+def test_clients_share_the_selector_of_their_servers():
+    client = NanopubClient(query_urls=SERVERS[:2])
+    assert client.server_selector is NanopubClient(query_urls=SERVERS[1::-1]).server_selector
+    assert client.server_selector is shared_selector(SERVERS[:2])
+    assert client.server_selector is not NanopubClient(query_urls=SERVERS).server_selector
+    assert client.server_selector.probe_when_open
+
+
+def test_latency_percentile():
+    selector = ServerSelector(SERVERS)
+    assert selector.latency_percentile(0.95) is None
+    for latency in [0.1, 0.2, 0.3, 0.4, 1.0]:
+        selector.record_success(SERVERS[0], latency)
+    assert selector.latency_percentile(0.5) == 0.3
+    assert selector.latency_percentile(1.0, url=SERVERS[0]) == 1.0
+
+
+def test_client_does_not_shuffle_module_urls():
+    before = list(NANOPUB_QUERY_URLS)
+    client = NanopubClient()
+    client.server_selector.ordered()
+    assert NANOPUB_QUERY_URLS == before
+    assert client.query_urls is not NANOPUB_QUERY_URLS
+
+
+def test_client_fails_over_dead_servers():
+    client = NanopubClient(query_urls=SERVERS[:2], server_selector=ServerSelector(SERVERS[:2]))
+    client.server_selector.record_success(SERVERS[0], 0.1)
+    client.server_selector.record_success(SERVERS[1], 0.2)
+    ok = MagicMock(status_code=200)
+
+    def query_api(params, endpoint, query_url, timeout=None):
+        if query_url == SERVERS[0]:
+            raise requests.ConnectTimeout("timeout")
+        return ok
+
+    with patch.object(NanopubClient, "_query_api", side_effect=query_api), pytest.warns(UserWarning):
+        r, query_url = client._query_api_try_servers({}, "endpoint")
+    assert query_url == SERVERS[1]
+    assert client.server_selector.stats(SERVERS[0]).consecutive_failures == 1
+
+
+def test_client_raises_when_all_servers_down():
+    client = NanopubClient(query_urls=SERVERS[:2], server_selector=ServerSelector(SERVERS[:2]))
+    with patch.object(NanopubClient, "_query_api", return_value=MagicMock(status_code=503, reason="Unavailable")), \
+            pytest.warns(UserWarning), pytest.raises(requests.HTTPError):
+        client._query_api_try_servers({}, "endpoint")
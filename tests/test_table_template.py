@@ -0,0 +1,71 @@
+import os
+from unittest.mock import patch
+
+import pytest
+from rdflib import RDFS, Dataset, Graph, Literal, URIRef
+from typer.testing import CliRunner
+
+from nanopub import Nanopub, TableTemplate
+from nanopub.__main__ import cli
+from nanopub.templates.table_template import read_table
+from tests.conftest import TEST_RESOURCES_FILEPATH, default_conf
+
+TEMPLATE_PATH = os.path.join(TEST_RESOURCES_FILEPATH, "table_template.trig")
+CSV_PATH = os.path.join(TEST_RESOURCES_FILEPATH, "table_rows.csv")
+JSONL_PATH = os.path.join(TEST_RESOURCES_FILEPATH, "table_rows.jsonl")
+
+
+def load(result) -> Nanopub:
+    rdf = Dataset()
+    rdf.parse(data=result.rdf, format="trig")
+    return Nanopub(rdf=rdf)
+
+
+def test_render_placeholders():
+    template = TableTemplate.from_file(default_conf, TEMPLATE_PATH)
+    assert template.fields == ["dose", "id", "link", "name", "source file"]
+
+    [first, second] = list(template.generate(read_table(CSV_PATH), sign_workers=0))
+    np = load(first)
+    assert np.has_valid_signature
+    assert str(np.metadata.np_uri) == first.source_uri
+    drug = URIRef("https://example.org/drug/1")
+    assert np.assertion.value(drug, RDFS.label) == Literal("Aspirin", lang="en")
+    assert np.assertion.value(drug, RDFS.seeAlso) == URIRef("https://example.org/a")
+    assert URIRef("https://example.org/table/drugs%20v1.csv") in set(np.provenance.objects())
+
+    # The triple with an empty value is left out
+    np = load(second)
+    assert len(np.assertion) == 2
+    assert np.assertion.value(URIRef("https://example.org/drug/2"), RDFS.label) == Literal("Ibu profen", lang="en")
+
+
+def test_matches_nanopub_signing():
+    assertion = Graph()
+    assertion.add((URIRef("https://example.org/drug/{id}"), RDFS.label, Literal("{name}")))
+    template = TableTemplate(default_conf, assertion)
+
+    expected = Graph()
+    expected.add((URIRef("https://example.org/drug/1"), RDFS.label, Literal("Aspirin")))
+    np = Nanopub(conf=default_conf, assertion=expected)
+    np.sign()
+    assert template.sign({"id": 1, "name": "Aspirin"})[0] == np.source_uri
+
+
+@pytest.mark.parametrize("sign_workers", [0, 2])
+def test_generate_jsonl_with_errors(sign_workers):
+    template = TableTemplate.from_file(default_conf, TEMPLATE_PATH)
+    results = list(template.generate(read_table(JSONL_PATH), sign_workers=sign_workers, batch_size=1))
+    assert [r.index for r in results] == [0, 1]
+    assert load(results[0]).has_valid_signature
+    assert "assertion graph is empty" in results[1].error
+
+
+def test_cli_from_table(tmp_path):
+    with patch("nanopub.__main__.load_profile", return_value=default_conf.profile):
+        result = CliRunner().invoke(cli, [
+            "create", "from-table", TEMPLATE_PATH, CSV_PATH, "--output-dir", str(tmp_path), "--sign-workers", "0"
+        ])
+    assert result.exit_code == 0, result.stdout
+    assert "2 nanopubs signed" in result.stdout
+    assert len(list(tmp_path.glob("RA*.trig"))) == 2